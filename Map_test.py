@@ -1,116 +1,381 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import plotly.express as px
+import plotly.colors
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from flask import has_request_context, request
 
-import statsmodels.api as sm
-from sklearn.preprocessing import StandardScaler
-from scipy.stats import pearsonr, spearmanr
+import hashlib
+import itertools
 import numpy as np
+import os
 import pandas as pd
 import re
 
+from nyctrees.autocorrelation import QUADRANT_LABELS, AutocorrelationEngine
+from nyctrees.breaks import BreaksCache, palette
+from nyctrees.cache import LRUCache, SharedCache, code_version
+from nyctrees.choropleth import ChoroplethEngine
+from nyctrees.correlation import CorrelationEngine
+from nyctrees.data import CACHE_DIR, DATA_DIR, load_snapshot
+from nyctrees.figcache import FigureCache, map_view
+from nyctrees.geoserve import GeoJSONStore, register_geojson_route
+from nyctrees.hexbin import HEXBINS_FILE, HexBins, HexTileLayer
+from nyctrees.metrics import Metrics
+from nyctrees.raster import TREE_POINTS_FILE, Rasterizer, TreePoints, register_raster_route
+from nyctrees.selection import AreaIndex, PolygonSelector, selection_key
+from nyctrees.similarity import SimilarityIndex
+from nyctrees.species import SpeciesMatrix
+from nyctrees.tiles import TileServer, register_tile_route
+from nyctrees.timeseries import YEARS_DIR, YearStore
+
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# the WSGI app: gunicorn -c gunicorn.conf.py Map_test:server
+server = app.server
+
+# per-callback phase timings on /metrics; NYCTREES_PROFILER=1 also allows
+# /metrics?profile=SECONDS (see nyctrees/metrics.py)
+metrics = Metrics(enabled=os.environ.get('NYCTREES_METRICS') == '1',
+                  profiler=os.environ.get('NYCTREES_PROFILER') == '1')
 
 
 mapbox_access_token = 'pk.eyJ1IjoibWlzaGtpY2UiLCJhIjoiY2s5MG94bWRoMDQxdjNmcHI1aWI1YnFkYyJ9.eFsHqEMYY7qxa0Pb9USCtQ'
 mapbox_style = "mapbox://styles/mishkice/ck98qopeo05k21ipc1atfdn8h"
 
-# Load data
-
-df_trees_properties = pd.read_csv(
-    "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/Trees_Properties_With_Centroids.csv")
-
-df_trees_properties_boro = pd.read_csv(
-    "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/Trees_Properties_With_Centroids_Boro.csv")
-
-df_species = pd.read_csv(
-    "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/GroupedTreesDataSpecies.csv")
-
-# trees neighborhoods bins
-BINS = [
-    "0-500",
-    "501-1000",
-    "1001-1500",
-    "1501-2000",
-    "2001-2500",
-    "2501-3000",
-    "3001-3500",
-    "3501-4000",
-    "4001-4500",
-    "4501-5000"
-]
-# trees boroughs bins
-BINSB = [
-    "2000-2300",
-    "2301-2600",
-    "2601-2900",
-    "2901-3200",
-    "3201-3500"
-]
-# prices neighborhoods bins
-BINS_P = [
-    "0-20",
-    "21-40",
-    "41-60",
-    "61-80",
-    "81-100",
-    "above 100"
-]
-# prices boroughs bins
-BINSB_P = [
-    "0-50",
-    "51-100",
-    "151-200",
-    "above 200"
-]
+# Load data (local snapshot of the csv files in data/, no network needed)
+
+snapshot = load_snapshot()
+
+df_trees_properties = snapshot.nta
+
+df_trees_properties_boro = snapshot.boro
+
+df_species = snapshot.species
+
+# individual trees and lots binned into hexagons, and the trees themselves;
+# written by nyctrees.etl from the raw census files, so not every data/ has them
+hexbins_path = DATA_DIR / HEXBINS_FILE
+hexbins = HexBins.load(hexbins_path) if hexbins_path.exists() else None
+tree_points_path = DATA_DIR / TREE_POINTS_FILE
+tree_points = TreePoints.load(tree_points_path) if tree_points_path.exists() else None
+# the metrics of every valuation year, memory-mapped (nyctrees/timeseries.py);
+# without them the app shows the single year of the snapshot
+years_path = DATA_DIR / YEARS_DIR
+year_store = YearStore.load(years_path)
+YEARS = year_store.years if year_store is not None else []
+DEFAULT_YEAR = YEARS.index(year_store.current) if year_store is not None else None
+data_version = snapshot.hash
+for path in [hexbins_path, tree_points_path] + sorted(years_path.glob('**/*')):
+    if path.is_file():
+        data_version = hashlib.sha1((data_version + ':').encode() +
+                                    path.read_bytes()).hexdigest()
+
+# map markers carry integer area ids (customdata); selections resolve to
+# boolean masks over these indexes (see nyctrees/selection.py)
+nta_index = AreaIndex(df_trees_properties['ntaname'].astype(str))
+boro_index = AreaIndex(df_trees_properties_boro['borough'].astype(str),
+                       offset=len(nta_index))
+species_nta_rows = nta_index.lookup(df_species['ntaname'].astype(str))
+species_boro_rows = boro_index.lookup(df_species['borough'].astype(str))
+SPECIES_TOP_N = 10
+# view -> tree counts per (area, species), so a selection's species mix is
+# one product; built with the first pie chart (or by warm())
+species_matrices = {}
+
+
+def species_matrix(view):
+    if view not in species_matrices:
+        if view == 'neighborhoods':
+            rows, n_areas = species_nta_rows, len(nta_index)
+        else:
+            rows, n_areas = species_boro_rows, len(boro_index)
+        species_matrices[view] = SpeciesMatrix.from_table(df_species, rows, n_areas)
+    return species_matrices[view]
+
+# area geometry is loaded once and served by this app; choropleths are
+# colored at runtime (see nyctrees/choropleth.py)
+geojson_store = GeoJSONStore()
+register_geojson_route(app.server, geojson_store)
+
+nta_geometry = ChoroplethEngine(
+    DATA_DIR / 'NeighborhoodTabulationAreas.geojson', 'ntaname', geojson_store)
+boro_geometry = ChoroplethEngine(
+    DATA_DIR / 'BoroughBoundaries.geojson', 'boro_name', geojson_store)
+
+# sequential palettes; a map uses as many evenly spaced colors as it has classes
+GREENS = ["#f2fffb", "#98ffe0", "#6df0c8", "#59dab2", "#45d0a5",
+          "#2bb489", "#1e906d", "#188463", "#157658", "#10523e"]
+ORANGES = ["#feedde", "#fdd0a2", "#fdae6b", "#fd8d3c", "#e6550d", "#a63603"]
+PURPLES = ["#efedf5", "#dadaeb", "#bcbddc", "#9e9ac8", "#807dba", "#6a51a3", "#4a1486"]
+BLUES = ["#deebf7", "#c6dbef", "#9ecae1", "#6baed6", "#4292c6", "#2171b5", "#084594"]
+REDS = ["#fee0d2", "#fcbba1", "#fc9272", "#fb6a4a", "#ef3b2c", "#cb181d", "#99000d"]
+
+# metric -> (choice_feature value, radio label, tile layer, legend title, palette);
+# these come first, in this order, then any other numeric column of the area
+# table, under its column name
+METRIC_STYLES = {
+    'trees/sq.mile': ('Trees/sq.mile', 'Trees/ sq.mile', 'trees_per_sqmile', 'Trees/sq.mile',
+                      GREENS),
+    'avg.landprice_thous$/acre': ('Avg land price', 'Avg land price', 'land_price',
+                                  'Avg land price, thous$/acre', ORANGES),
+    'health': ('Trees health', 'Trees health', 'health', 'Trees health, of 15', PURPLES),
+    'properties/sq.mile': ('Properties/sq.mile', 'Properties/ sq.mile', 'properties_per_sqmile',
+                           'Properties/sq.mile', BLUES),
+    'avg.propvalue_thous$/acre': ('Avg property value', 'Avg property value', 'property_value',
+                                  'Avg property value, thous$/acre', REDS),
+}
+# numeric columns that are not metrics of an area
+NOT_METRICS = {'centerLong', 'centerLat'}
+
+
+def map_features(df):
+    """choice_feature value -> (metric, tile layer, legend title, palette) of
+    every numeric metric column of ``df``, and the radio options offering them."""
+    numeric = [column for column in df.columns
+               if column not in NOT_METRICS and pd.api.types.is_numeric_dtype(df[column])]
+    features, options = {}, []
+    for metric in [m for m in METRIC_STYLES if m in numeric] + \
+            [m for m in numeric if m not in METRIC_STYLES]:
+        value, label, layer, title, colors = METRIC_STYLES.get(
+            metric, (metric, metric, re.sub(r'[^a-z0-9]+', '_', metric.lower()).strip('_'),
+                     metric, GREENS))
+        features[value] = (metric, layer, title, colors)
+        options.append({'label': label, 'value': value})
+    return features, options
+
+
+# the neighborhood table has every metric; the borough view disables the ones
+# it lacks (see feature_options)
+MAP_FEATURES, FEATURE_OPTIONS = map_features(df_trees_properties)
+DEFAULT_FEATURE = 'Trees/sq.mile'
+
+# class breaks come from the data: 'jenks', 'quantile' or 'equal' (nyctrees/breaks.py)
+CLASSIFICATION = 'jenks'
+MAP_CLASSES = {'neighborhoods': 8, 'boroughs': 5}
+map_breaks = BreaksCache(version=data_version)
+
+# hover lines of an area: (label, metric, suffix)
+HOVER_METRICS = [('trees/sq.mile', 'trees/sq.mile', ''),
+                 ('avg. landprice', 'avg.landprice_thous$/acre', ''),
+                 ('trees health', 'health', '/15')]
+
+
+def year_index(year):
+    """The year slider value as an index into ``YEARS`` (None without years)."""
+    if not YEARS:
+        return None
+    return year if year in range(len(YEARS)) else DEFAULT_YEAR
+
+
+def area_hover(df, view, deltas=None, previous=None):
+    hover = (df['ntaname'].astype(str) + '<br>' + df['borough'].astype(str)
+             if view == 'neighborhoods' else df['borough'].astype(str))
+    for label, metric, suffix in HOVER_METRICS:
+        hover = hover + '<br>' + label + ': ' + df[metric].round(2).astype(str) + suffix
+        if deltas is not None:
+            change = pd.Series(deltas[metric], index=df.index).round(2)
+            hover = hover + change.map(
+                lambda d: ' ({:+g} since {})'.format(d, previous) if np.isfinite(d) else '')
+    return hover
+
+
+def year_table(view, year):
+    """The areas of ``view`` with the metrics of ``YEARS[year]``, read from the
+    store: every column is an index into the arrays of that year."""
+    df = (df_trees_properties if view == 'neighborhoods' else df_trees_properties_boro).copy()
+    label = YEARS[year]
+    rows = year_store.rows(view, df['ntaname' if view == 'neighborhoods' else 'borough'])
+    for metric in year_store.metrics:
+        if metric in df.columns:
+            df[metric] = year_store.values(view, label, metric, rows)
+    previous = year_store.previous(label)
+    deltas = None if previous is None else {
+        metric: year_store.values(view, label, metric, rows, delta=True)
+        for _, metric, _ in HOVER_METRICS}
+    df['hover'] = area_hover(df, view, deltas, previous)
+    return df
+
+
+# (view, year) -> table; built on first use, one per year at most
+year_tables = LRUCache(maxsize=64)
+
+
+def view_table(view, year=None):
+    """The areas of ``view`` in the slider's ``year``."""
+    year = year_index(year)
+    if year is None:
+        return df_trees_properties if view == 'neighborhoods' else df_trees_properties_boro
+    return year_tables.get_or_compute((view, year), lambda: year_table(view, year))
+
+
+def feature_available(view, choice_feature):
+    # the borough table has no property values
+    return MAP_FEATURES[choice_feature][0] in view_table(view).columns
+
+
+def feature_options(view):
+    return [dict(option, disabled=not feature_available(view, option['value']))
+            for option in FEATURE_OPTIONS]
+
+
+def map_classes(view, choice_feature):
+    """Breaks, legend labels and colors of one feature in one view."""
+    metric, _, _, colors = MAP_FEATURES[choice_feature]
+    # with several years the breaks pool them all, so colors compare across years
+    if year_store is None or metric not in year_store.metrics:
+        values = view_table(view)[metric]
+    else:
+        values = year_store.pooled(view, metric)
+    values = np.asarray(values, dtype=np.float64)
+    classes = map_breaks.get(view, metric, values[np.isfinite(values)], CLASSIFICATION,
+                             MAP_CLASSES[view])
+    return classes, palette(colors, len(classes))
 
-# trees neighborhoods colors
-DEFAULT_COLORSCALE = [
-    "#f2fffb",
-    "#98ffe0",
-    "#6df0c8",
-    "#59dab2",
-    "#45d0a5",
-    "#2bb489",
-    "#1e906d",
-    "#188463",
-    "#157658",
-    "#10523e",
-]
-# trees boroughs colors
-DEFAULT_COLORSCALEB = [
-    "#f2fffb",
-    "#59dab2",
-    "#2bb489",
-    "#188463",
-    "#10523e",
-]
-# prices neighborhoods colors
-DEFAULT_COLORSCALE_P = [
-    "#feedde",
-    "#fdd0a2",
-    "#fdae6b",
-    "#fd8d3c",
-    "#e6550d",
-    "#a63603"
-]
-# prices boroughs colors
-DEFAULT_COLORSCALEB_P = [
-    "#feedde",
-    "#fdbe85",
-    "#fd8d3c",
-    "#e6550d",
-    "#a63603",
-]
 
 DEFAULT_OPACITY = 0.8
 
+# how a lasso/box on the map selects areas: 'intersects', 'contains' or 'centroid'
+SELECTION_MODE = 'intersects'
+
+nta_selector = PolygonSelector.from_engine(
+    nta_index, nta_geometry, df_trees_properties[['centerLong', 'centerLat']].values)
+boro_selector = PolygonSelector.from_engine(
+    boro_index, boro_geometry, df_trees_properties_boro[['centerLong', 'centerLat']].values)
+
+# splom dimensions, in order; correlations are kept as sufficient statistics
+SPLOM_METRICS = ['trees/sq.mile', 'avg.landprice_thous$/acre', 'properties/sq.mile']
+nta_correlations = CorrelationEngine(df_trees_properties, SPLOM_METRICS)
+boro_correlations = CorrelationEngine(df_trees_properties_boro, SPLOM_METRICS)
+
+# 'tiles': choropleths are vector tiles rendered by this app (nyctrees/tiles.py)
+# 'geojson': one choroplethmapbox trace over the served geometry
+MAP_SOURCE = 'tiles'
+
+
+
+def tile_layer(view, layer, year=None):
+    """Name of the tile layer of ``view`` and ``layer`` in the slider's ``year``."""
+    year = year_index(year)
+    return view + '-' + layer if year is None else '{}-{}@{}'.format(view, layer, year)
+
+
+tile_server = TileServer(version=data_version[:12])
+for view, geometry, key in [('neighborhoods', nta_geometry, 'ntaname'),
+                            ('boroughs', boro_geometry, 'borough')]:
+    for year in range(len(YEARS)) if YEARS else [None]:
+        df = view_table(view, year)
+        for choice_feature, (metric, layer, _, _) in MAP_FEATURES.items():
+            if not feature_available(view, choice_feature):
+                continue
+            classes, _ = map_classes(view, choice_feature)
+            # areas without data that year are left out
+            tile_server.add_layer(tile_layer(view, layer, year), geometry,
+                                  df[df[metric].notna()], key, metric,
+                                  classes.breaks, classes.decimals)
+
+# from this zoom on the neighborhood view shows the hexagons instead of the
+# areas, with the same classes
+HEX_MIN_ZOOM = 13
+hex_features = set()
+if hexbins is not None:
+    for choice_feature, (metric, layer, _, _) in MAP_FEATURES.items():
+        if feature_available('neighborhoods', choice_feature) and hexbins.has(metric):
+            classes, _ = map_classes('neighborhoods', choice_feature)
+            tile_server.add('hex-' + layer, HexTileLayer(hexbins, metric, classes.breaks,
+                                                         classes.decimals))
+            hex_features.add(choice_feature)
+register_tile_route(app.server, tile_server)
+
+# from this zoom on tree features show every tree, shaded on the server
+TREES_MIN_ZOOM = 15
+TREE_ENCODINGS = {'Trees/sq.mile': 'count', 'Trees health': 'health'}
+rasterizer = None
+if tree_points is not None:
+    rasterizer = Rasterizer(tree_points, version=data_version[:12])
+    register_raster_route(app.server, rasterizer)
+
+
+# map overlays: 'lisa' marks the areas of significant local spatial
+# autocorrelation of the feature (nyctrees/autocorrelation.py)
+OVERLAY_OPTIONS = [
+    {'label': 'No overlay', 'value': 'none'},
+    {'label': 'LISA clusters', 'value': 'lisa'},
+]
+# high-high, low-high, low-low, high-low
+LISA_COLORS = ['#d7191c', '#abd9e9', '#2c7bb6', '#fdae61']
+# view -> contiguity of its areas, built with the first overlay (or by warm())
+autocorrelation_engines = {}
+# (view, metric, year) -> (Moran's I, LISA) of the feature
+spatial_clusters = LRUCache(maxsize=64)
+
+
+def autocorrelation_engine(view):
+    if view not in autocorrelation_engines:
+        if view == 'neighborhoods':
+            engine, names = nta_geometry, nta_index.names
+        else:
+            engine, names = boro_geometry, boro_index.names
+        autocorrelation_engines[view] = AutocorrelationEngine.from_engine(engine, names)
+    return autocorrelation_engines[view]
+
+
+def lisa_clusters(view, metric, year=None):
+    """Global Moran's I and the LISA clusters of ``metric`` in ``year``."""
+    year = year_index(year)
+
+    def compute():
+        engine = autocorrelation_engine(view)
+        values = view_table(view, year)[metric]
+        return engine.moran(values), engine.lisa(values)
+
+    return spatial_clusters.get_or_compute((view, metric, year), compute)
+
+
+# 'find similar neighborhoods': a click on an area of the neighborhood view
+# marks the SIMILAR_K areas nearest to it in these metrics, standardized and
+# weighted by SIMILAR_WEIGHTS (nyctrees/similarity.py)
+SIMILAR_METRICS = ['trees/sq.mile', 'avg.landprice_thous$/acre', 'properties/sq.mile',
+                   'health']
+SIMILAR_WEIGHTS = [1.0, 1.0, 1.0, 1.0]
+SIMILAR_K = 5
+# year -> SimilarityIndex of the neighborhoods, built with the first click's
+# table (or by warm())
+similarity_indexes = LRUCache(maxsize=64)
+
+
+def similarity_index(year=None):
+    year = year_index(year)
+    return similarity_indexes.get_or_compute(year, lambda: SimilarityIndex(
+        view_table('neighborhoods', year)[SIMILAR_METRICS].values, SIMILAR_WEIGHTS,
+        k=SIMILAR_K))
+
+
+def map_layers(view, choice_feature, colorscale, year=None):
+    """mapbox layers of a feature: the areas of ``year``, then as the map
+    zooms in the hexagons and the single trees, where the data has them."""
+    layer = MAP_FEATURES[choice_feature][1]
+    bands = [(None, tile_layer(view, layer, year))]
+    if view == 'neighborhoods' and choice_feature in hex_features:
+        bands.append((HEX_MIN_ZOOM, 'hex-' + layer))
+    if view == 'neighborhoods' and rasterizer is not None and choice_feature in TREE_ENCODINGS:
+        bands.append((TREES_MIN_ZOOM, None))
+    layers = []
+    for i, (minzoom, name) in enumerate(bands):
+        maxzoom = bands[i + 1][0] if i + 1 < len(bands) else None
+        if name is None:
+            layers += rasterizer.mapbox_layers(TREE_ENCODINGS[choice_feature],
+                                               minzoom=minzoom, maxzoom=maxzoom)
+        else:
+            layers += tile_server.mapbox_layers(
+                name, colorscale, opacity=DEFAULT_OPACITY,
+                # hexagons without outlines
+                outline=None if minzoom else "#afafaf", minzoom=minzoom, maxzoom=maxzoom)
+    return layers
+
 
 colors = {
     'background': '#092a35',
@@ -122,15 +387,63 @@ colors = {
 
 # function to assign colors to markers by boroughs
 
+BORO_COLORS = {'manhattan': '#6a2c70', 'brooklyn': '#b83b5e', 'queens': '#f08a5d',
+               'staten island': '#f9ed69'}
+OTHER_BORO_COLOR = '#3ec1d3'
+
 
 def find_colorscale_by_boro(df):
-    color_by_boro = ['#6a2c70' if row['borough'] == 'manhattan' else '#b83b5e' if row['borough'] == 'brooklyn' else '#f08a5d' if row['borough'] ==
-                     'queens' else '#f9ed69' if row['borough'] == 'staten island' else '#3ec1d3' for index, row in df.iterrows()]
-    return color_by_boro
+    return [BORO_COLORS.get(borough, OTHER_BORO_COLOR) for borough in df['borough'].astype(str)]
 
 
 colorscale_by_boro = ['#6a2c70', '#b83b5e', '#f08a5d', '#f9ed69', '#3ec1d3']
 
+# rightGraph bar charts: choice -> (metric, y axis title, chart title)
+BAR_CHARTS = {
+    'land_price': ('avg.landprice_thous$/acre', 'Avg Land Prices (thousands$/acre)',
+                   'Barchart of Avg Land Prices by '),
+    'trees_per_area': ('trees/sq.mile', 'Trees/sq.mile',
+                       'Barchart of Number of Trees/sq.mile by '),
+}
+
+# 'clientside': the bar charts are switched, filtered and sorted in the browser
+# (assets/rightGraph.js) from columns sent once with the page; the server only
+# resolves selections. 'server': every change of the chart is a server callback
+RIGHT_GRAPH_MODE = 'clientside'
+
+# 'clientside': the full splom of a view is sent once; a selection only sends
+# the positions of the selected areas and the new annotations, which
+# assets/splom.js applies as selectedpoints. 'server': every selection
+# rebuilds the splom of the selected areas
+SPLOM_MODE = 'clientside'
+
+
+def bar_values(df):
+    return {
+        'hover': df['hover'].astype(str).tolist(),
+        'metrics': {metric: df[metric].tolist() for metric, _, _ in BAR_CHARTS.values()},
+    }
+
+
+def bar_columns(view, key):
+    """Columns of one view for the clientside bar charts; the values of every
+    year are sent along, so the slider only picks one."""
+    df = view_table(view)
+    columns = dict(bar_values(df), key=df[key].astype(str).tolist(),
+                   color=find_colorscale_by_boro(df))
+    if YEARS:
+        columns['years'] = [bar_values(view_table(view, year)) for year in range(len(YEARS))]
+    return columns
+
+
+BAR_DATA = {
+    'views': {'neighborhoods': bar_columns('neighborhoods', 'ntaname'),
+              'boroughs': bar_columns('boroughs', 'borough')},
+    'charts': {choice: {'metric': metric, 'title_y': title_y, 'title': title}
+               for choice, (metric, title_y, title) in BAR_CHARTS.items()},
+    'colors': {name: colors[name] for name in ('background', 'text2', 'border')},
+}
+
 
 # page layout
 app.layout = html.Div(
@@ -203,13 +516,8 @@ app.layout = html.Div(
                         html.Div([
                             dcc.RadioItems(
                                 id='choice_feature',
-                                options=[
-                                    {'label': 'Trees/ sq.mile',
-                                     'value': 'Trees/sq.mile'},
-                                    {'label': 'Avg land price',
-                                     'value': 'Avg land price'},
-                                ],
-                                value='Trees/sq.mile',
+                                options=feature_options('boroughs'),
+                                value=DEFAULT_FEATURE,
                                 labelStyle={
                                     'color': colors['text'], 'backgroundColor': colors['background'],
                                     'display': 'inline-block',
@@ -222,6 +530,55 @@ app.layout = html.Div(
                     style={'marginTop': 0, 'marginLeft': '2%',
                            'color': colors['text'],
                            'display': 'inline-block'}
+                ),
+                html.Div(
+                    [
+                        html.Div([
+                            dcc.RadioItems(
+                                id='overlay',
+                                options=OVERLAY_OPTIONS,
+                                value='none',
+                                labelStyle={
+                                    'color': colors['text'], 'backgroundColor': colors['background'],
+                                    'display': 'inline-block',
+                                    'paddingRight': 10}
+                            )
+                        ], style={'display': 'inline-block'})
+
+                    ],
+                    className='six columns',
+                    style={'marginTop': 0, 'marginLeft': 20,
+                           'color': colors['text'],
+                           'display': 'inline-block'}
+                )
+            ], className="row"
+        ),
+
+        html.Div(
+            [
+                html.Div(
+                    [
+                        html.Div([
+                            html.P(children="Choose year:")
+                        ], style={'display': 'inline-block', 'paddingRight': 18}),
+                        html.Div([
+                            dcc.Slider(
+                                id='year',
+                                min=0,
+                                max=max(len(YEARS) - 1, 0),
+                                step=None,
+                                marks={i: {'label': year, 'style': {'color': colors['text']}}
+                                       for i, year in enumerate(YEARS)},
+                                value=DEFAULT_YEAR,
+                            )
+                        ], style={'display': 'inline-block', 'width': '70%'})
+
+                    ],
+                    className='six columns',
+                    style={'marginTop': 0, 'marginLeft': '2%',
+                           'color': colors['text'],
+                           # a single year needs no slider
+                           'display': 'inline-block' if len(YEARS) > 1 else 'none'}
                 )
             ], className="row"
         ),
@@ -254,7 +611,10 @@ app.layout = html.Div(
                             autosize=False,
                         ),
                     ),
-                )], className='six columns', style={'width': '40%', 'paddingLeft': '2%', 'paddingBottom': 10, 'marginBottom': 10}),  # left half ends here
+                ),
+                dcc.Store(id='mapFigure'),
+                dcc.Store(id='similarData'),
+            ], className='six columns', style={'width': '40%', 'paddingLeft': '2%', 'paddingBottom': 10, 'marginBottom': 10}),  # left half ends here
 
             html.Div([
                 html.Div([
@@ -262,7 +622,8 @@ app.layout = html.Div(
                         id='scatter_matrix'
                     )
 
-                ], className='row'),
+                ] + ([dcc.Store(id='splomFigure'), dcc.Store(id='splomSelection')]
+                     if SPLOM_MODE == 'clientside' else []), className='row'),
                 html.Div([
                     dcc.Dropdown(
                         options=[
@@ -300,7 +661,9 @@ app.layout = html.Div(
                         id='rightGraph'
                     )
 
-                ], className='row')
+                ] + ([dcc.Store(id='barData', data=BAR_DATA), dcc.Store(id='serverChart'),
+                      dcc.Store(id='rightGraphData')]
+                     if RIGHT_GRAPH_MODE == 'clientside' else []), className='row')
 
             ], className='six columns', style={'width': '50%', 'paddingLeft': '3%', 'paddingRight': '1%', 'marginTop': 0, 'paddingTop': 0})  # right half ends here
 
@@ -309,23 +672,65 @@ app.layout = html.Div(
 
 # callbacks
 
+# results shared by all workers on this host; selections are keyed by the
+# rounded lasso, so a callback resolves it to areas only once, on a miss.
+# The cache outlives the process, so entries are versioned by the data, this
+# file and the nyctrees package
+callback_cache = SharedCache(CACHE_DIR / 'callbacks.sqlite',
+                             version=data_version + ':' + code_version(__file__))
+
+
 ######################################################################################################################
 # map callback
 ######################################################################################################################
 
 
+@app.callback(
+    [Output("choice_feature", "options"),
+     Output("choice_feature", "value")],
+    [Input("choiceNB", "value")],
+    [State("choice_feature", "value")],
+)
+def display_feature_options(choiceNB, choice_feature):
+    view = 'neighborhoods' if choiceNB == 'neighborhoods' else 'boroughs'
+    if not feature_available(view, choice_feature):
+        choice_feature = DEFAULT_FEATURE
+    return feature_options(view), choice_feature
+
+
 @ app.callback(
-    Output("mapGraph", "figure"),
+    Output("mapFigure", "data"),
     [Input("choiceNB", "value"),
-     Input("choice_feature", "value")],
+     Input("choice_feature", "value"),
+     Input("year", "value"),
+     Input("overlay", "value")],
     [State("mapGraph", "figure")],
 )
-def display_map(choiceNB, choice_feature, figure):
+@metrics.timed
+def display_map(choiceNB, choice_feature, year, overlay, figure):
+    # layer urls are absolute, so the host is part of the result
+    url_root = request.url_root if has_request_context() else ''
+    return figure_cache.figure((choiceNB, choice_feature, year_index(year), overlay), figure,
+                               url_root)
+
+
+def build_map_figure(choiceNB, choice_feature, year, overlay, figure):
+    view = 'neighborhoods' if choiceNB == 'neighborhoods' else 'boroughs'
+    if not feature_available(view, choice_feature):
+        choice_feature = DEFAULT_FEATURE
+    metric, _, title, _ = MAP_FEATURES[choice_feature]
+    year = year_index(year)
+    if year is not None:
+        title = '{}, {}'.format(title, YEARS[year])
+    with metrics.phase('compute'):
+        classes, colorscale = map_classes(view, choice_feature)
+        bins = classes.labels()
+
     annotations = [
         dict(
             showarrow=False,
             align="right",
-            text="Trees/sq.mile",
+            text=title,
             font=dict(color="#2cfec1"),
             bgcolor=colors['background'],
             x=0.95,
@@ -333,37 +738,21 @@ def display_map(choiceNB, choice_feature, figure):
         )
     ]
 
-    if choiceNB == 'neighborhoods' and choice_feature == 'Trees/sq.mile':
-        bins = BINS
-        colorscale = DEFAULT_COLORSCALE
-        latitude = df_trees_properties["centerLat"]
-        longitude = df_trees_properties["centerLong"]
-        hover_text = df_trees_properties["hover"]
-        base = "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/neighborhoods/trees_per_sqmile/"
-
-    elif choiceNB == 'neighborhoods':
-        bins = BINS_P
-        colorscale = DEFAULT_COLORSCALE_P
-        latitude = df_trees_properties["centerLat"]
-        longitude = df_trees_properties["centerLong"]
-        hover_text = df_trees_properties["hover"]
-        base = "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/neighborhoods/land_price/"
-
-    elif choice_feature != 'Avg land price':
-        bins = BINSB
-        colorscale = DEFAULT_COLORSCALEB
-        latitude = df_trees_properties_boro["centerLat"]
-        longitude = df_trees_properties_boro["centerLong"]
-        hover_text = df_trees_properties_boro["hover"]
-        base = "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/boroughs/trees_per_sqmile/"
-
+    df = view_table(view, year)
+    if view == 'neighborhoods':
+        geometry = nta_geometry
+        area_index = nta_index
+        key = 'ntaname'
     else:
-        bins = BINSB_P
-        colorscale = DEFAULT_COLORSCALEB_P
-        latitude = df_trees_properties_boro["centerLat"]
-        longitude = df_trees_properties_boro["centerLong"]
-        hover_text = df_trees_properties_boro["hover"]
-        base = "https://raw.githubusercontent.com/MarinaOrzechowski/NYC_Trees_Properties/master/data/boroughs/land_price/"
+        geometry = boro_geometry
+        area_index = boro_index
+        key = 'borough'
+
+    latitude = df["centerLat"]
+    longitude = df["centerLong"]
+    hover_text = df["hover"]
+
+    center, zoom = map_view(figure)
 
     cm = dict(zip(bins, colorscale))
     data = [
@@ -371,6 +760,7 @@ def display_map(choiceNB, choice_feature, figure):
             lat=latitude,
             lon=longitude,
             text=hover_text,
+            customdata=area_index.ids,
             type="scattermapbox",
             hoverinfo="text",
             marker=dict(size=5, color="black", opacity=0),
@@ -394,23 +784,16 @@ def display_map(choiceNB, choice_feature, figure):
             )
         )
 
-    if "layout" in figure:
-        lat = figure["layout"]["mapbox"]["center"]["lat"]
-        lon = figure["layout"]["mapbox"]["center"]["lon"]
-        zoom = figure["layout"]["mapbox"]["zoom"]
-    else:
-        lat = (40.7342,)
-        lon = (-73.91251,)
-        zoom = 10
-
     layout = dict(
         mapbox=dict(
             layers=[],
             accesstoken=mapbox_access_token,
             style=mapbox_style,
-            center=dict(lat=lat, lon=lon),
+            center=center,
             zoom=zoom,
         ),
+        # keeps the user's pan and zoom when assets/mapGraph.js marks similar areas
+        uirevision='mapGraph',
         height=900,
         transition={'duration': 500},
         hovermode="closest",
@@ -419,146 +802,127 @@ def display_map(choiceNB, choice_feature, figure):
         dragmode="lasso"
     )
 
-    for bin in bins:
-        geo_layer = dict(
-            sourcetype="geojson",
-            source=base + bin + ".geojson",
-            type="fill",
-            color=cm[bin],
-            opacity=DEFAULT_OPACITY,
-            # CHANGE THIS
-            fill=dict(outlinecolor="#afafaf"),
-        )
-        layout["mapbox"]["layers"].append(geo_layer)
+    with metrics.phase('build_figure'):
+        if MAP_SOURCE == 'tiles':
+            layout["mapbox"]["layers"] = map_layers(view, choice_feature, colorscale, year)
+        else:
+            data.insert(0, geometry.trace(df[key].astype(str), df[metric], classes.breaks,
+                                          colorscale, opacity=DEFAULT_OPACITY, zoom=zoom,
+                                          decimals=classes.decimals))
+
+    if overlay == 'lisa':
+        with metrics.phase('compute'):
+            moran, lisa = lisa_clusters(view, metric, year)
+        significant = np.flatnonzero(lisa.clusters > 0)
+        with metrics.phase('build_figure'):
+            # above the areas, below the markers that carry hover and selection
+            data.insert(len(data) - 1, geometry.trace(
+                df[key].astype(str).values[significant], lisa.clusters[significant],
+                [1, 2, 3], LISA_COLORS, opacity=0.7, outline=colors['background'], zoom=zoom))
+        annotations.append(dict(
+            showarrow=False,
+            align="left",
+            text="Moran's I {:.2f} (p {:.4f})".format(moran.I, moran.p_sim),
+            font=dict(color="#2cfec1"),
+            bgcolor=colors['background'],
+            x=0.05,
+            y=0.95,
+        ))
+        for i, color in enumerate(LISA_COLORS):
+            annotations.append(dict(
+                arrowcolor=color,
+                text=QUADRANT_LABELS[i + 1],
+                x=0.05,
+                y=0.90 - (i / 20),
+                ax=60,
+                ay=0,
+                arrowwidth=5,
+                arrowhead=0,
+                bgcolor="#1f2630",
+                font=dict(color='#2cfec1'),
+            ))
 
     fig = dict(data=data, layout=layout)
 
     return fig
 
 
+# map figures are rendered once per (view, feature, year, overlay, zoom
+# bucket) and kept encoded; display_map only fills in the map view and host
+# and the response carries the encoded figure as is (see install below)
+figure_cache = FigureCache(app.server, build_map_figure,
+                           zoom_bucket=nta_geometry.lod.level_for_zoom,
+                           version=data_version)
+
+
+@app.callback(
+    Output('similarData', 'data'),
+    [Input('choiceNB', 'value'),
+     Input('year', 'value')])
+@metrics.timed
+@callback_cache.memoize(lambda choiceNB, year: [choiceNB, year_index(year)])
+def display_similar(choiceNB, year):
+    """The SIMILAR_K most similar neighborhoods of every neighborhood, for
+    assets/mapGraph.js to mark on a click without a server round trip."""
+    if choiceNB != 'neighborhoods':
+        return None
+    with metrics.phase('compute'):
+        index = similarity_index(year)
+    df = view_table('neighborhoods', year)
+    return {
+        'offset': nta_index.offset,
+        'names': df['ntaname'].astype(str).tolist(),
+        'lat': df['centerLat'].tolist(),
+        'lon': df['centerLong'].tolist(),
+        'neighbors': index.neighbors.tolist(),
+        'distances': index.distances.round(3).tolist(),
+    }
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='mapGraph', function_name='figure'),
+    Output('mapGraph', 'figure'),
+    [Input('mapFigure', 'data'),
+     Input('similarData', 'data'),
+     Input('mapGraph', 'clickData')],
+    [State('mapGraph', 'figure')])
+
+
 ######################################################################################################################
 # scattermatrix callback
 ######################################################################################################################
-@app.callback(
-    Output('scatter_matrix', 'figure'),
-    [
-        Input('mapGraph', 'selectedData'),
-        Input('choiceNB', 'value')
-    ])
-def display_selected_data(selectedArea, choiceNB):
-
-    if choiceNB == 'boroughs':
-        df_selected = df_trees_properties_boro
-        title_part = ' boroughs'
-        key = 'borough'
 
-    else:
-        title_part = ' neighborhoods'
-        df_selected = df_trees_properties
-        key = 'ntaname'
+SPLOM_FONT = dict(
+    size=10,
+    color=colors['text']
+)
 
-    font_ann = dict(
-        size=10,
-        color=colors['text']
-    )
 
-    if selectedArea is not None:
-        points = selectedArea["points"]
-        area_names = [str(point["text"].split("<br")[0])
-                      for point in points]
-        df_selected = df_selected[df_selected[key].isin(area_names)]
+# (view, year) -> correlations of the splom metrics that year
+year_correlations = LRUCache(maxsize=64)
 
-    index_vals = df_selected['borough'].astype('category').cat.codes
-    coef_list = []
-
-    # find pearson coeff and p_value for each pair of attributes
-    pairs = [['trees/sq.mile', 'avg.landprice_thous$/acre'], ['trees/sq.mile',
-                                                              'properties/sq.mile'], ['avg.landprice_thous$/acre', 'properties/sq.mile']]
-    flag = True
-    for pair in pairs:
-        if len(df_selected[pair[0]]) >= 2 and len(df_selected[pair[1]]) >= 2:
-            coef_list.append(
-                pearsonr(df_selected[pair[0]], df_selected[pair[1]]))
-        else:
-            flag = False
-    if flag:
-        ann = [
-            dict(
-                x=5000,
-                y=6000,
-                xref="x2",
-                yref="y1",
-                font=font_ann,
-                text="PCC: " +
-                str(round(coef_list[0][0], 2)) + "<br>p: " +
-                ('{:0.1e}'.format(coef_list[0][1])),
-                showarrow=False,
-
-            ),
-            dict(
-                x=6000,
-                y=5000,
-                xref="x1",
-                yref="y2",
-                font=font_ann,
-                text="PCC: " +
-                str(round(coef_list[0][0], 2)) + "<br>p: " +
-                ('{:0.1e}'.format(coef_list[0][1])),
-                showarrow=False,
-            ),
-            dict(
-                x=14000,
-                y=6000,
-                xref="x3",
-                yref="y1",
-                font=font_ann,
-                text="PCC: " +
-                str(round(coef_list[1][0], 2)) + "<br>p: " +
-                ('{:0.1e}'.format(coef_list[1][1])),
-                showarrow=False,
-            ),
-            dict(
-                x=6000,
-                y=14000,
-                xref="x1",
-                yref="y3",
-                font=font_ann,
-                text="PCC: " +
-                str(round(coef_list[1][0], 2)) + "<br>p: " +
-                ('{:0.1e}'.format(coef_list[1][1])),
-                showarrow=False,
-            ),
-            dict(
-                x=14000,
-                y=6000,
-                xref="x3",
-                yref="y2",
-                font=font_ann,
-                text="PCC: " +
-                str(round(coef_list[2][0], 2)) + "<br>p: " +
-                ('{:0.1e}'.format(coef_list[2][1])),
-                showarrow=False,
-            ),
-            dict(
-                x=6000,
-                y=14000,
-                xref="x2",
-                yref="y3",
-                font=font_ann,
-                text="PCC: " +
-                str(round(coef_list[2][0], 2)) + "<br>p: " +
-                ('{:0.1e}'.format(coef_list[2][1])),
-                showarrow=False,
-            ),
-
-        ]
+
+def splom_view(choiceNB, year=None):
+    """(table, key column, selector, correlations) of a view in a year."""
+    view = 'boroughs' if choiceNB == 'boroughs' else 'neighborhoods'
+    if view == 'boroughs':
+        key, selector, correlations = 'borough', boro_selector, boro_correlations
     else:
-        ann = []
+        key, selector, correlations = 'ntaname', nta_selector, nta_correlations
+    year = year_index(year)
+    df = view_table(view, year)
+    if year is not None:
+        correlations = year_correlations.get_or_compute(
+            (view, year), lambda: CorrelationEngine(df, SPLOM_METRICS))
+    return df, key, selector, correlations
 
+
+def splom_figure(df_selected, key, ann, uirevision=None):
     axisd = dict(showline=True,
                  zeroline=False,
                  gridcolor='#104752',
                  showticklabels=True)
+    index_vals = df_selected['borough'].astype('category').cat.codes
 
     # here we build a scatter matrix, and add annotations for each subgraph
     layout = go.Layout(
@@ -578,9 +942,10 @@ def display_selected_data(selectedArea, choiceNB):
         yaxis2=dict(axisd),
         yaxis3=dict(axisd),
         yaxis4=dict(axisd),
-        annotations=ann)
+        annotations=ann,
+        uirevision=uirevision)
 
-    fig = go.Figure(data=go.Splom(
+    return go.Figure(data=go.Splom(
         dimensions=[dict(label='trees/sq.mile',
                          values=df_selected['trees/sq.mile']),
                     dict(label='avg.landprice($K/A)',
@@ -588,31 +953,111 @@ def display_selected_data(selectedArea, choiceNB):
                     dict(label='properties/sq.mile',
                          values=df_selected['properties/sq.mile']),
                     ],
-        text=(df_selected[key]+': '+df_selected['borough']
+        text=(df_selected[key].astype(str)+': '+df_selected['borough'].astype(str)
               if key == 'ntaname' else df_selected[key]),
         hoverinfo="x+y+text",
         # showlegend=True,
         marker=dict(color=index_vals,
                     showscale=False,  # colors encode categorical variables
                     line_color='white', line_width=0.4),
+        # areas outside the selection stay on the plot, dimmed
+        unselected=dict(marker=dict(opacity=0.15)),
         diagonal=dict(visible=True)
     ), layout=layout
     )
 
-    return fig
+
+if SPLOM_MODE == 'clientside':
+    @app.callback(
+        Output('splomFigure', 'data'),
+        [Input('choiceNB', 'value'),
+         Input('year', 'value')])
+    @metrics.timed
+    @callback_cache.memoize(lambda choiceNB, year: [choiceNB, year_index(year)])
+    def display_splom(choiceNB, year):
+        df, key, _, correlations = splom_view(choiceNB, year)
+        with metrics.phase('compute'):
+            ann = correlations.annotations(None, SPLOM_FONT)
+        with metrics.phase('build_figure'):
+            # uirevision keeps zoom and axis ranges while selections change
+            figure = splom_figure(df, key, ann, uirevision=choiceNB)
+        return {'view': choiceNB, 'year': year_index(year), 'figure': figure}
+
+    @app.callback(
+        Output('splomSelection', 'data'),
+        [
+            Input('mapGraph', 'selectedData'),
+            Input('choiceNB', 'value'),
+            Input('year', 'value')
+        ])
+    @metrics.timed
+    @callback_cache.memoize(lambda selectedArea, choiceNB, year: [
+        choiceNB, SELECTION_MODE, selection_key(selectedArea), year_index(year)])
+    def display_splom_selection(selectedArea, choiceNB, year):
+        _, _, selector, correlations = splom_view(choiceNB, year)
+        with metrics.phase('filter'):
+            mask = selector.mask(selectedArea, SELECTION_MODE)
+        # PCC/SCC of every pair of splom dimensions, placed in the matching cells
+        with metrics.phase('compute'):
+            ann = correlations.annotations(mask, SPLOM_FONT)
+        return {
+            'view': choiceNB,
+            'year': year_index(year),
+            'positions': None if mask is None else np.flatnonzero(mask).tolist(),
+            'annotations': ann,
+        }
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='splom', function_name='figure'),
+        Output('scatter_matrix', 'figure'),
+        [
+            Input('splomFigure', 'data'),
+            Input('splomSelection', 'data'),
+        ])
+else:
+    @app.callback(
+        Output('scatter_matrix', 'figure'),
+        [
+            Input('mapGraph', 'selectedData'),
+            Input('choiceNB', 'value'),
+            Input('year', 'value')
+        ])
+    @metrics.timed
+    @callback_cache.memoize(lambda selectedArea, choiceNB, year: [
+        choiceNB, SELECTION_MODE, selection_key(selectedArea), year_index(year)])
+    def display_selected_data(selectedArea, choiceNB, year):
+        df_selected, key, selector, correlations = splom_view(choiceNB, year)
+
+        with metrics.phase('filter'):
+            mask = selector.mask(selectedArea, SELECTION_MODE)
+            if mask is not None:
+                df_selected = df_selected[mask]
+
+        # PCC/SCC of every pair of splom dimensions, placed in the matching cells
+        with metrics.phase('compute'):
+            ann = correlations.annotations(mask, SPLOM_FONT)
+
+        with metrics.phase('build_figure'):
+            fig = splom_figure(df_selected, key, ann)
+
+        return fig
 
 
 #####################################################################################################################
 # rightGraph callback
 #####################################################################################################################
-@app.callback(
-    Output('rightGraph', 'figure'),
-    [
-        Input('choiceRightGraph', 'value'),
-        Input('mapGraph', 'selectedData'),
-        Input('choiceNB', 'value'),
-    ])
-def display_selected_data(choiceRG, selectedArea, choiceNB):
+@callback_cache.memoize(lambda choiceRG, selectedArea, choiceNB, year=None: [
+    choiceRG, year_index(year), choiceNB, SELECTION_MODE, selection_key(selectedArea)])
+def display_selected_data(choiceRG, selectedArea, choiceNB, year=None):
+    selector = nta_selector if choiceNB == 'neighborhoods' else boro_selector
+    with metrics.phase('filter'):
+        mask = selector.mask(selectedArea, SELECTION_MODE)
+    return right_graph_figure(choiceRG, mask, choiceNB, year)
+
+
+def right_graph_figure(choiceRG, mask, choiceNB, year=None):
+    """The rightGraph figure of ``choiceRG`` for the areas in ``mask``
+    (every area when it is None)."""
     title_x = ''
     title_y = ''
     title = ''
@@ -620,41 +1065,35 @@ def display_selected_data(choiceRG, selectedArea, choiceNB):
 
     if choiceNB == 'neighborhoods':
         title_part = ' neighborhoods'
-        df = df_trees_properties
+        df = view_table('neighborhoods', year)
         key = 'ntaname'
+        selector = nta_selector
     else:
-        df = df_trees_properties_boro
+        df = view_table('boroughs', year)
         title_part = ' boroughs'
         key = 'borough'
+        selector = boro_selector
 
-    if selectedArea is not None:
-        points = selectedArea["points"]
-        area_names = [str(point["text"].split("<br")[0]) for point in points]
-        df_selected = df[df[key].isin(area_names)]
-    else:
-        df_selected = df
-
-    if choiceRG is None or choiceRG == 'land_price':
-        data.append({'x': df_selected.sort_values(by=['avg.landprice_thous$/acre'])[key],
-                     'y': df_selected.sort_values(by=['avg.landprice_thous$/acre'])['avg.landprice_thous$/acre'],
-                     'type': 'bar',
-                     'text': df_selected['hover'],
-                     'marker': {
-                    'color': find_colorscale_by_boro(df_selected.sort_values(by=['avg.landprice_thous$/acre'])),  'opacity': 0.8, 'line': {'color': colors['border'], 'width': 1}}})
-        title_x = title_part
-        title_y = 'Avg Land Prices (thousands$/acre)'
-        title = 'Barchart of Avg Land Prices by ' + title_part
-
-    elif choiceRG == 'trees_per_area':
-        data.append({'x': df_selected.sort_values(by=['trees/sq.mile'])[key],
-                     'y': df_selected.sort_values(by=['trees/sq.mile'])['trees/sq.mile'],
+    with metrics.phase('filter'):
+        if mask is not None:
+            df_selected = df[mask]
+        else:
+            df_selected = df
+
+    if choiceRG is None or choiceRG in BAR_CHARTS:
+        metric, title_y, title = BAR_CHARTS[choiceRG or 'land_price']
+        # one ordering for bars, hover texts and colors
+        with metrics.phase('compute'):
+            df_sorted = df_selected.iloc[np.argsort(df_selected[metric].values, kind='stable')]
+            bar_colors = find_colorscale_by_boro(df_sorted)
+        data.append({'x': df_sorted[key],
+                     'y': df_sorted[metric],
                      'type': 'bar',
-                     'text': df_selected['hover'],
+                     'text': df_sorted['hover'],
                      'marker': {
-                    'color': find_colorscale_by_boro(df_selected.sort_values(by=['trees/sq.mile'])),  'opacity': 0.8,  'line': {'color': colors['border'], 'width': 1}}})
+                    'color': bar_colors,  'opacity': 0.8, 'line': {'color': colors['border'], 'width': 1}}})
         title_x = title_part
-        title_y = 'Trees/sq.mile'
-        title = 'Barchart of Number of Trees/sq.mile by ' + title_part
+        title = title + title_part
 
     elif choiceRG == 'trees_properties_sqmile':
 
@@ -670,77 +1109,153 @@ def display_selected_data(choiceRG, selectedArea, choiceNB):
         title = 'Scatterplot of Properties/sq.mile and Trees/sq.mile by'+title_part
 
     else:
-        if selectedArea is not None:
-            # leave only selected areas
-            df_selected = df_species[df_species[key].isin(
-                area_names)].sort_values('spc_per', ascending=False)
+        # species counts of the selected areas (all areas without a selection),
+        # the SPECIES_TOP_N most frequent plus 'other' for the rest
+        species = species_matrix('neighborhoods' if key == 'ntaname' else 'boroughs')
+        with metrics.phase('compute'):
+            labels, values = species.top(selector.area_index.by_name(mask), n=SPECIES_TOP_N)
+
+        with metrics.phase('build_figure'):
+            piechart = go.Figure(data=[go.Pie(
+                labels=labels,
+                values=values,
+            )],
+                layout=go.Layout(
+                    paper_bgcolor=colors['background'],
+                    plot_bgcolor=colors['background'],
+                    font={
+                        'color': colors['text2'],
+                        'size': 14
+                    },
+                    title='Pie-chart of Tree Species by ' + title_part))
+            piechart.update_traces(hoverinfo='label+value', textinfo='text+percent', opacity=0.9,
+                                   marker=dict(colors=plotly.colors.qualitative.Prism, line=dict(color='#000000', width=1)))
+
+    with metrics.phase('build_figure'):
+        if choiceRG != 'tree_speices':
+            figure = {
+                'data': data,
+                'layout': {
+                    'hovermode': 'closest',
+                    'transition': {'duration': 500},
+                    'title': title,
+                    'plot_bgcolor': colors['background'],
+                    'paper_bgcolor': colors['background'],
+                    'font': {
+                        'color': colors['text2'],
+                        'size': 12
+                    },
+                    'xaxis': dict(
+                        title=title_x,
+                        titlefont=dict(
+                            size=14,
+                            color=colors['text2']
+                        )),
+                    'yaxis': dict(
+                        title=title_y,
+                        titlefont=dict(
+                            size=14,
+                            color=colors['text2']
+                        )),
+                },
 
+            }
         else:
-            df_selected = df_species.sort_values(
-                'spc_per', ascending=False)
-
-        # find most species with biggest count number, sort in desc order
-        grouped = df_selected.groupby(['spc_common']).sum(
-        ).sort_values('count', ascending=False)
-        total = grouped['count'].sum()
-        # find percent for each type of trees (will remain in desc order)
-        grouped['prc'] = grouped['count']/total*100
-        grouped.reset_index(inplace=True)
-        # add row 'other' which includes info about all species except 5 most frequent
-        grouped = grouped.append({'spc_common': 'other', 'count': total-grouped['count'][:10].sum(
-        ), 'prc': 100 - grouped['prc'][:10].sum()}, ignore_index=True)
-        # sort data again so 'other' row takes correct place
-        grouped = grouped.sort_values('prc', ascending=False)
-
-        piechart = go.Figure(data=[go.Pie(
-            labels=grouped[:11]['spc_common'],
-            values=grouped[:11]['count'],
-        )],
-            layout=go.Layout(
-                paper_bgcolor=colors['background'],
-                plot_bgcolor=colors['background'],
-                font={
-                    'color': colors['text2'],
-                    'size': 14
-                },
-                title='Pie-chart of Tree Species by ' + title_part))
-        piechart.update_traces(hoverinfo='label+value', textinfo='text+percent', opacity=0.9,
-                               marker=dict(colors=px.colors.qualitative.Prism, line=dict(color='#000000', width=1)))
-
-    if choiceRG != 'tree_speices':
-        figure = {
-            'data': data,
-            'layout': {
-                'hovermode': 'closest',
-                'transition': {'duration': 500},
-                'title': title,
-                'plot_bgcolor': colors['background'],
-                'paper_bgcolor': colors['background'],
-                'font': {
-                    'color': colors['text2'],
-                    'size': 12
-                },
-                'xaxis': dict(
-                    title=title_x,
-                    titlefont=dict(
-                        size=14,
-                        color=colors['text2']
-                    )),
-                'yaxis': dict(
-                    title=title_y,
-                    titlefont=dict(
-                        size=14,
-                        color=colors['text2']
-                    )),
-            },
+            figure = piechart
+
+    return figure
+
 
+if RIGHT_GRAPH_MODE == 'clientside':
+    # charts that are not bar charts, rendered for the current selection
+    SERVER_CHARTS = ['trees_properties_sqmile', 'tree_speices']
+
+    def server_chart(choiceRG):
+        """The chart the server renders for ``choiceRG``, None for bar charts."""
+        return choiceRG if choiceRG in SERVER_CHARTS else None
+
+    # serverChart is the chosen chart when the server renders it and null
+    # for bar charts, written only when it changes: switching between bar
+    # charts never reaches the server
+    app.clientside_callback(
+        ClientsideFunction(namespace='rightGraph', function_name='serverChart'),
+        Output('serverChart', 'data'),
+        [Input('choiceRightGraph', 'value')],
+        [State('barData', 'data'), State('serverChart', 'data')])
+
+    @app.callback(
+        Output('rightGraphData', 'data'),
+        [
+            Input('serverChart', 'data'),
+            Input('mapGraph', 'selectedData'),
+            Input('choiceNB', 'value'),
+            Input('year', 'value'),
+        ])
+    @metrics.timed
+    @callback_cache.memoize(lambda choiceRG, selectedArea, choiceNB, year: [
+        server_chart(choiceRG), choiceNB, SELECTION_MODE, selection_key(selectedArea),
+        year_index(year)])
+    def display_selected_areas(choiceRG, selectedArea, choiceNB, year):
+        # only the server chart on display is rendered
+        view = 'neighborhoods' if choiceNB == 'neighborhoods' else 'boroughs'
+        selector = nta_selector if view == 'neighborhoods' else boro_selector
+        with metrics.phase('filter'):
+            mask = selector.mask(selectedArea, SELECTION_MODE)
+        chart = server_chart(choiceRG)
+        return {
+            'view': view,
+            'year': year_index(year),
+            'positions': None if mask is None else np.flatnonzero(mask).tolist(),
+            'figures': {} if chart is None else {
+                chart: right_graph_figure(chart, mask, choiceNB, year)},
         }
-    else:
-        figure = piechart
 
-    return figure
+    app.clientside_callback(
+        ClientsideFunction(namespace='rightGraph', function_name='figure'),
+        Output('rightGraph', 'figure'),
+        [
+            Input('choiceRightGraph', 'value'),
+            Input('rightGraphData', 'data'),
+        ],
+        [State('barData', 'data')])
+else:
+    app.callback(
+        Output('rightGraph', 'figure'),
+        [
+            Input('choiceRightGraph', 'value'),
+            Input('mapGraph', 'selectedData'),
+            Input('choiceNB', 'value'),
+            Input('year', 'value'),
+        ])(metrics.timed(display_selected_data))
+
+metrics.watch_cache('callbacks', callback_cache)
+metrics.watch_cache('map_figures', figure_cache.cache)
+metrics.watch_cache('tiles', tile_server.cache)
+if rasterizer is not None:
+    metrics.watch_cache('raster', rasterizer.cache)
+metrics.install(app)
+# after metrics.install, so the response sizes count the spliced figures
+figure_cache.install()
+
+
+def warm():
+    """Build what is otherwise built by the first requests: the common map
+    figures, the species matrices, the area contiguity, the similarity
+    index, the splom correlations (which import scipy) and the compressed
+    geometry. Run before serving: gunicorn.conf.py calls this in the master
+    process, so every worker shares the result."""
+    figure_cache.warm(itertools.product([None, 'boroughs', 'neighborhoods'], list(MAP_FEATURES),
+                                        [DEFAULT_YEAR], ['none']),
+                      zooms=[9, 11, 13, 15])
+    for view in ('neighborhoods', 'boroughs'):
+        species_matrix(view)
+        autocorrelation_engine(view)
+        splom_view(view)[3].annotations(None, SPLOM_FONT)
+    similarity_index(DEFAULT_YEAR)
+    geojson_store.warm()
 
 
 if __name__ == '__main__':
 
+    warm()
     app.run_server(debug=True)
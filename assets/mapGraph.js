@@ -0,0 +1,64 @@
+/*
+ * The map figure, with the neighborhoods most similar to the clicked one.
+ *
+ * mapFigure holds the figure of display_map; similarData holds the
+ * SIMILAR_K most similar neighborhoods of every neighborhood (rows of the
+ * table, nearest first), or null in the borough view. A click on an area
+ * only looks up its row, so marking its similar areas costs no round trip.
+ * The markers go below the trace that carries hover and selection.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    mapGraph: {
+        figure: function (base, similar, clickData, current) {
+            if (!base) {
+                return current;
+            }
+            var point = clickData && clickData.points && clickData.points[0];
+            if (!similar || !point || typeof point.customdata !== 'number') {
+                return base;
+            }
+            var row = point.customdata - similar.offset;
+            // a click on a borough, or before a view change took effect
+            if (row < 0 || row >= similar.names.length) {
+                return base;
+            }
+            var rows = similar.neighbors[row];
+            var text = rows.map(function (other, rank) {
+                return (rank + 1) + '. ' + similar.names[other] +
+                    ' (distance ' + similar.distances[row][rank] + ')';
+            });
+            var marked = {
+                type: 'scattermapbox',
+                lat: rows.map(function (other) { return similar.lat[other]; }),
+                lon: rows.map(function (other) { return similar.lon[other]; }),
+                text: text,
+                hoverinfo: 'text',
+                mode: 'markers',
+                marker: {size: 14, color: '#f9ed69', opacity: 0.9},
+                showlegend: false
+            };
+            var clicked = {
+                type: 'scattermapbox',
+                lat: [similar.lat[row]],
+                lon: [similar.lon[row]],
+                hoverinfo: 'skip',
+                mode: 'markers',
+                marker: {size: 18, color: '#2cfec1', opacity: 0.9},
+                showlegend: false
+            };
+            var data = base.data.slice(0, -1).concat(
+                [clicked, marked, base.data[base.data.length - 1]]);
+            var annotations = (base.layout.annotations || []).concat([{
+                showarrow: false,
+                align: 'left',
+                text: 'Most similar to ' + similar.names[row] + ':<br>' + text.join('<br>'),
+                font: {color: '#f9ed69'},
+                bgcolor: '#1f2630',
+                x: 0.05,
+                y: 0.05
+            }]);
+            var layout = Object.assign({}, base.layout, {annotations: annotations});
+            return {data: data, layout: layout};
+        }
+    }
+});
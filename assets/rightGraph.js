@@ -0,0 +1,72 @@
+/*
+ * Clientside rendering of the rightGraph bar charts (RIGHT_GRAPH_MODE =
+ * 'clientside' in Map_test.py).
+ *
+ * barData holds the columns of both views and is sent once with the page;
+ * with several years it holds the values of each. serverChart is the
+ * chosen chart when only the server can render it, null for bar charts.
+ * rightGraphData holds the positions of the selected areas and the server
+ * chart, if any; it changes with the map selection, the year and
+ * serverChart. Switching between bar charts, filtering and sorting happen
+ * here without a server round trip; switching to or away from a server
+ * chart is one request.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    rightGraph: {
+        serverChart: function (choiceRG, barData, current) {
+            var chart = barData && barData.charts[choiceRG || 'land_price'] ? null : choiceRG;
+            // an unchanged store triggers no server callback
+            return chart === (current || null) ? window.dash_clientside.no_update : chart;
+        },
+        figure: function (choiceRG, selection, barData) {
+            if (!selection || !barData) {
+                return {data: [], layout: {}};
+            }
+            var choice = choiceRG || 'land_price';
+            var chart = barData.charts[choice];
+            if (!chart) {
+                // empty until the server has rendered the newly chosen chart
+                return selection.figures[choice] || {data: [], layout: {}};
+            }
+            var columns = barData.views[selection.view];
+            var year = columns.years ? columns.years[selection.year] : columns;
+            var values = year.metrics[chart.metric];
+            var rows = selection.positions;
+            if (!rows) {
+                rows = values.map(function (value, i) { return i; });
+            }
+            // stable ascending order, as numpy's argsort(kind='stable')
+            rows = rows.slice().sort(function (a, b) {
+                return values[a] - values[b] || a - b;
+            });
+            var pick = function (column) {
+                return rows.map(function (i) { return column[i]; });
+            };
+            var colors = barData.colors;
+            var titlePart = ' ' + selection.view;
+            return {
+                data: [{
+                    x: pick(columns.key),
+                    y: pick(values),
+                    type: 'bar',
+                    text: pick(year.hover),
+                    marker: {
+                        color: pick(columns.color),
+                        opacity: 0.8,
+                        line: {color: colors.border, width: 1}
+                    }
+                }],
+                layout: {
+                    hovermode: 'closest',
+                    transition: {duration: 500},
+                    title: chart.title + titlePart,
+                    plot_bgcolor: colors.background,
+                    paper_bgcolor: colors.background,
+                    font: {color: colors.text2, size: 12},
+                    xaxis: {title: titlePart, titlefont: {size: 14, color: colors.text2}},
+                    yaxis: {title: chart.title_y, titlefont: {size: 14, color: colors.text2}}
+                }
+            };
+        }
+    }
+});
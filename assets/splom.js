@@ -0,0 +1,31 @@
+/*
+ * Clientside selection of the scatter matrix (SPLOM_MODE = 'clientside' in
+ * Map_test.py).
+ *
+ * splomFigure holds the splom of every area of a view and changes only with
+ * the view and the year; splomSelection holds the positions of the selected areas and
+ * their annotations, and changes with the map selection. The dimension
+ * arrays are passed on unchanged, so plotly only restyles the selected
+ * points and the axis ranges stay where they are.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    splom: {
+        figure: function (base, selection) {
+            if (!base) {
+                return {data: [], layout: {}};
+            }
+            var figure = base.figure;
+            // a selection of another view or year is stale until its callback returns
+            if (!selection || selection.view !== base.view || selection.year !== base.year) {
+                return figure;
+            }
+            var trace = Object.assign({}, figure.data[0], {
+                selectedpoints: selection.positions
+            });
+            var layout = Object.assign({}, figure.layout, {
+                annotations: selection.annotations
+            });
+            return {data: [trace], layout: layout};
+        }
+    }
+});
@@ -0,0 +1,86 @@
+"""Time of Moran's I and the LISA clusters with permutation p-values.
+
+    python benchmarks/autocorrelation.py [--permutations 9999] [--grid 0 40 100]
+
+Runs on the neighborhoods of data/ (the contiguity is built once, as in
+the app) and on synthetic square lattices of ``--grid`` x ``--grid``
+areas with a smooth random field, so the scaling with the number of areas
+shows. Times are the best of ``--repeat`` runs.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyctrees.autocorrelation import AutocorrelationEngine  # noqa: E402
+
+METRICS = ['trees/sq.mile', 'avg.landprice_thous$/acre', 'health']
+
+
+def best(call, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def lattice(size):
+    """Unit squares of a ``size`` x ``size`` grid, as closed integer rings."""
+    polygons = []
+    for row in range(size):
+        for col in range(size):
+            ring = np.array([[col, row], [col + 1, row], [col + 1, row + 1],
+                             [col, row + 1], [col, row]], dtype=np.int64)
+            polygons.append([ring])
+    return polygons
+
+
+def report(label, engine, values, repeat):
+    moran_s, moran = best(lambda: engine.moran(values), repeat)
+    lisa_s, lisa = best(lambda: engine.lisa(values), repeat)
+    print('{:<36} {:>6} areas  moran {:7.1f} ms  lisa {:7.1f} ms  I {:6.3f} '
+          'p {:.4f}  {:>4} significant'.format(
+              label, len(values), 1000 * moran_s, 1000 * lisa_s, moran.I, moran.p_sim,
+              int((lisa.clusters > 0).sum())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--permutations', type=int, default=9999)
+    parser.add_argument('--grid', type=int, nargs='*', default=[40],
+                        help='sizes of synthetic lattices (0 for none)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from nyctrees.choropleth import ChoroplethEngine
+    from nyctrees.data import DATA_DIR, load_snapshot
+
+    df = load_snapshot().nta
+    geometry = ChoroplethEngine(DATA_DIR / 'NeighborhoodTabulationAreas.geojson', 'ntaname')
+    start = time.perf_counter()
+    engine = AutocorrelationEngine.from_engine(geometry, df['ntaname'].astype(str),
+                                               permutations=args.permutations)
+    print('queen contiguity of {} areas: {:.1f} ms, {:.1f} neighbors on average'.format(
+        engine.contiguity.shape[0], 1000 * (time.perf_counter() - start),
+        engine.neighbors().mean()))
+    for metric in METRICS:
+        report(metric, engine, df[metric].values, args.repeat)
+
+    rng = np.random.RandomState(0)
+    for size in args.grid:
+        if not size:
+            continue
+        engine = AutocorrelationEngine(lattice(size), permutations=args.permutations)
+        # white noise smoothed along both axes: clustered, like the real areas
+        field = rng.randn(size + 4, size + 4).cumsum(axis=0).cumsum(axis=1)[4:, 4:]
+        report('lattice {0}x{0}'.format(size), engine, field.ravel(), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Latency, peak memory and payload size of the Dash callbacks as data grows.
+
+    python benchmarks/callbacks.py [--scales 195 2000 40000] [--repeat 20]
+                                   [--payloads recorded.json] [--out callbacks.json]
+
+Every scale runs in its own process with the app pointed at a data
+directory: 195 is data/ itself, larger scales are written by
+:mod:`synthetic`. The callbacks are called directly, without Dash, with
+the result cache cleared before every call (``miss``) and again right
+after it (``hit``). Selections are synthetic lassos, boxes and clicks
+built from the area centers; ``--payloads`` adds recorded ``selectedData``
+objects (a JSON object of name -> payload, as the browser sends them).
+
+The JSON output holds p50/p99 latency in milliseconds, the peak memory
+allocated during one call (tracemalloc) and the serialized size of the
+result, per scale, callback and payload, so two revisions can be diffed.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+SCALES = [195, 2000, 40000]
+# share of the areas a synthetic lasso covers
+LASSO_SHARES = {'lasso_small': 0.01, 'lasso_medium': 0.1, 'lasso_large': 0.5}
+VIEWS = ['neighborhoods', 'boroughs']
+# rightGraph charts drawn by the server rather than from barData
+OTHER_CHARTS = ['trees_properties_sqmile', 'tree_speices']
+MAP_ZOOM = 11
+
+
+def lasso(centers, ids, hover, share, segments=64):
+    """``selectedData`` of a round lasso around the middle of the areas."""
+    middle = np.median(centers, axis=0)
+    distance = np.hypot(*(centers - middle).T)
+    radius = np.quantile(distance, share) if len(distance) else 0.0
+    angle = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    ring = middle + radius * np.column_stack([np.cos(angle), np.sin(angle)])
+    return dict(points=_points(centers, ids, hover, np.flatnonzero(distance <= radius)),
+                lassoPoints={'mapbox': ring.tolist()})
+
+
+def box(centers, ids, hover):
+    """``selectedData`` of a box over the lower left quarter of the areas."""
+    (x0, y0), (x1, y1) = centers.min(axis=0), np.median(centers, axis=0)
+    inside = np.flatnonzero((centers[:, 0] <= x1) & (centers[:, 1] <= y1))
+    return dict(points=_points(centers, ids, hover, inside),
+                range={'mapbox': [[x0, y1], [x1, y0]]})
+
+
+def click(centers, ids, hover):
+    return dict(points=_points(centers, ids, hover, [0]))
+
+
+def _points(centers, ids, hover, rows):
+    return [dict(curveNumber=0, pointNumber=int(i), pointIndex=int(i),
+                 lon=float(centers[i, 0]), lat=float(centers[i, 1]),
+                 text=str(hover[i]), customdata=int(ids[i])) for i in rows]
+
+
+def payloads(app, view, recorded):
+    df = app.view_table(view)
+    index = app.nta_index if view == 'neighborhoods' else app.boro_index
+    centers = df[['centerLong', 'centerLat']].values.astype(np.float64)
+    hover = df['hover'].values
+    result = {'none': None, 'click': click(centers, index.ids, hover),
+              'box': box(centers, index.ids, hover)}
+    for name, share in LASSO_SHARES.items():
+        result[name] = lasso(centers, index.ids, hover, share)
+    result.update(recorded)
+    return result
+
+
+def find_callback(app, output):
+    """The function registered for ``output``, below Dash's wrapper."""
+    for key, entry in app.app.callback_map.items():
+        if output in key.split('...') and 'callback' in entry:
+            return entry['callback'].__wrapped__
+    return None
+
+
+def measure(call, caches, repeat):
+    """p50/p99 latency of misses and hits, peak memory and output size.
+
+    Misses start with ``caches`` cleared. Latencies include encoding the
+    result, as Dash does before responding.
+    """
+    import plotly
+
+    def respond():
+        return json.dumps(call(), cls=plotly.utils.PlotlyJSONEncoder)
+
+    misses, hits = [], []
+    for _ in range(repeat):
+        for cache in caches:
+            cache.clear()
+        start = time.perf_counter()
+        body = respond()
+        misses.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        respond()
+        hits.append(time.perf_counter() - start)
+    for cache in caches:
+        cache.clear()
+    tracemalloc.start()
+    respond()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'miss_ms': {'p50': 1000 * float(np.percentile(misses, 50)),
+                    'p99': 1000 * float(np.percentile(misses, 99))},
+        'hit_ms': {'p50': 1000 * float(np.percentile(hits, 50)),
+                   'p99': 1000 * float(np.percentile(hits, 99))},
+        'peak_bytes': int(peak),
+        'result_bytes': len(body),
+    }
+
+
+def run_scale(repeat, recorded):
+    """Measure every callback in this process (the data is set by the caller)."""
+    start = time.perf_counter()
+    import Map_test as app
+    startup = time.perf_counter() - start
+
+    cache = app.callback_cache
+    map_figure = find_callback(app, 'mapFigure.data')
+    similar = find_callback(app, 'similarData.data')
+    splom = find_callback(app, 'scatter_matrix.figure')
+    # SPLOM_MODE = 'clientside': the figure per view, then selections only
+    splom_figure = find_callback(app, 'splomFigure.data')
+    splom_selection = find_callback(app, 'splomSelection.data')
+    right_data = find_callback(app, 'rightGraphData.data')
+    figure = {'layout': {'mapbox': {'center': {'lat': 40.7, 'lon': -73.9}, 'zoom': MAP_ZOOM}}}
+    # display_map keeps its figures in the figure cache
+    map_caches = (cache, app.figure_cache.cache)
+
+    results = []
+
+    def add(callback, view, payload, call, caches=(cache,)):
+        entry = dict(callback=callback, view=view, payload=payload)
+        entry.update(measure(call, caches, repeat))
+        results.append(entry)
+
+    for view in VIEWS:
+        for feature in app.MAP_FEATURES:
+            if app.feature_available(view, feature):
+                add('display_map[{}]'.format(feature), view, None,
+                    lambda: map_figure(view, feature, None, 'none', figure), map_caches)
+        # moving the year slider: the same figure from the arrays of another year
+        for year, label in enumerate(app.YEARS):
+            add('display_map[year {}]'.format(label), view, None,
+                lambda: map_figure(view, app.DEFAULT_FEATURE, year, 'none', figure), map_caches)
+        if splom_figure is not None:
+            add('splomFigure', view, None, lambda: splom_figure(view, None))
+        if similar is not None:
+            add('similarData', view, None, lambda: similar(view, None))
+        for name, payload in payloads(app, view, recorded).items():
+            if splom is not None:
+                add('scatter_matrix', view, name, lambda: splom(payload, view, None))
+            if splom_selection is not None:
+                add('splomSelection', view, name, lambda: splom_selection(payload, view, None))
+            if right_data is not None:
+                # a bar chart (positions only), then each chart the server renders
+                for choice in [None] + OTHER_CHARTS:
+                    add('rightGraphData[{}]'.format(choice or 'bars'), view, name,
+                        lambda: right_data(choice, payload, view, None))
+            for choice in list(app.BAR_CHARTS) + OTHER_CHARTS:
+                add('rightGraph[{}]'.format(choice), view, name,
+                    lambda: app.display_selected_data(choice, payload, view, None))
+
+    return {
+        'areas': len(app.df_trees_properties),
+        'startup_s': startup,
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'callbacks': results,
+    }
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES,
+                        help='numbers of neighborhood areas; 195 is the real data')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--payloads', help='JSON object of recorded selectedData')
+    parser.add_argument('--out', default='callbacks.json')
+    parser.add_argument('--worker', metavar='OUT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    recorded = {}
+    if args.payloads:
+        with open(args.payloads) as f:
+            recorded = json.load(f)
+
+    if args.worker:
+        result = run_scale(args.repeat, recorded)
+        with open(args.worker, 'w') as f:
+            json.dump(result, f)
+        return
+
+    from synthetic import scale_tables
+    from nyctrees.data import DATA_DIR
+
+    report = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'repeat': args.repeat,
+        'scales': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.scales:
+            data_dir = str(DATA_DIR)
+            if n != 195:
+                data_dir = str(scale_tables(n, os.path.join(tmp, 'data{}'.format(n))))
+            env = dict(os.environ, NYCTREES_DATA_DIR=data_dir,
+                       NYCTREES_CACHE_DIR=os.path.join(tmp, 'cache{}'.format(n)))
+            out = os.path.join(tmp, 'scale{}.json'.format(n))
+            command = [sys.executable, os.path.abspath(__file__), '--worker', out,
+                       '--repeat', str(args.repeat)]
+            if args.payloads:
+                command += ['--payloads', os.path.abspath(args.payloads)]
+            print('{:,} areas ...'.format(n), file=sys.stderr)
+            subprocess.check_call(command, env=env, cwd=ROOT)
+            with open(out) as f:
+                report['scales'][str(n)] = result = json.load(f)
+            for entry in result['callbacks']:
+                print('  {:<38} {:<14} {:<13} miss p50 {:>9.1f} ms  p99 {:>9.1f} ms  '
+                      'peak {:>7.1f} MB  {:>9,} bytes'.format(
+                          entry['callback'], entry['view'], str(entry['payload']),
+                          entry['miss_ms']['p50'], entry['miss_ms']['p99'],
+                          entry['peak_bytes'] / 2 ** 20, entry['result_bytes']),
+                      file=sys.stderr)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print('written to {}'.format(args.out), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
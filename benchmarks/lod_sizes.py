@@ -0,0 +1,40 @@
+"""Bytes and vertex counts of every level of detail of the area polygons.
+
+    python benchmarks/lod_sizes.py
+"""
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyctrees.choropleth import load_geometry  # noqa: E402
+from nyctrees.data import DATA_DIR  # noqa: E402
+from nyctrees.lod import LODPyramid  # noqa: E402
+
+SOURCES = [
+    ('neighborhoods', 'NeighborhoodTabulationAreas.geojson', 'ntaname'),
+    ('boroughs', 'BoroughBoundaries.geojson', 'boro_name'),
+]
+
+
+def main():
+    for view, filename, name_property in SOURCES:
+        raw = (DATA_DIR / filename).read_bytes()
+        start = time.perf_counter()
+        pyramid = LODPyramid(load_geometry(DATA_DIR / filename, name_property))
+        elapsed = time.perf_counter() - start
+        print('{}: source {:,} bytes ({:,} gzip), pyramid built in {:.2f}s'.format(
+            view, len(raw), len(zlib.compress(raw, 9)), elapsed))
+        print('  {:>5} {:>8} {:>10} {:>12} {:>10}'.format(
+            'level', 'zoom', 'vertices', 'bytes', 'gzip'))
+        for level, zoom in enumerate(pyramid.zooms):
+            body = pyramid.dumps(level).encode()
+            print('  {:>5} {:>8} {:>10,} {:>12,} {:>10,}'.format(
+                level, '<= {}'.format(zoom) if zoom is not None else 'full',
+                pyramid.vertex_count(level), len(body), len(zlib.compress(body, 9))))
+
+
+if __name__ == '__main__':
+    main()
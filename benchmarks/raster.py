@@ -0,0 +1,76 @@
+"""Render time of the tree raster tiles.
+
+    python benchmarks/raster.py [--points 1000000] [--workers N] [--repeat 5]
+
+Trees are drawn from a normal distribution around midtown (or read from
+``data/treepoints.npz`` with ``--data``). Every encoding is rendered for
+the tile over midtown at several zooms; the coarsest tile holds every
+point. Times are the best of ``--repeat`` renders, with the per zoom
+opacity scale computed beforehand, as it is once per process in the app.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyctrees.data import DATA_DIR  # noqa: E402
+from nyctrees.raster import ENCODINGS, TREE_POINTS_FILE, Rasterizer, TreePoints  # noqa: E402
+
+CENTER = (-73.97, 40.75)
+ZOOMS = [9, 11, 13, 15, 17]
+
+
+def tile_of(lon, lat, z):
+    n = 2 ** z
+    lat = math.radians(lat)
+    return (int((lon + 180) / 360 * n),
+            int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n))
+
+
+def synthetic(n, seed=0):
+    rng = np.random.RandomState(seed)
+    species = ['species {}'.format(i) for i in range(120)]
+    return TreePoints.from_lonlat(rng.normal(CENTER[0], 0.08, n), rng.normal(CENTER[1], 0.06, n),
+                                  rng.choice([0, 5, 10, 15], n, p=[0.05, 0.1, 0.15, 0.7]),
+                                  rng.choice(species, n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--data', action='store_true',
+                        help='use the trees of data/ instead of synthetic ones')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='also render with a thread pool of this size')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    points = TreePoints.load(DATA_DIR / TREE_POINTS_FILE) if args.data else synthetic(args.points)
+    print('{:,} trees'.format(len(points)))
+    rasterizers = [('1 thread', Rasterizer(points))]
+    if args.workers and args.workers > 1:
+        rasterizers.append(('{} threads'.format(args.workers),
+                            Rasterizer(points, workers=args.workers)))
+
+    for z in ZOOMS:
+        x, y = tile_of(CENTER[0], CENTER[1], z)
+        start, end = points.band(z, y)
+        for label, rasterizer in rasterizers:
+            rasterizer.saturation(z)
+            for encoding in ENCODINGS:
+                times = []
+                for _ in range(args.repeat):
+                    begin = time.perf_counter()
+                    png = rasterizer.render(z, x, y, encoding)
+                    times.append(time.perf_counter() - begin)
+                print('z{:<2} {:>9,} rows in band  {:<10} {:<8} {:7.1f} ms  {:>8,} bytes'.format(
+                    z, end - start, label, encoding, 1000 * min(times), len(png)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Time of the 'find similar neighborhoods' index and of its queries.
+
+    python benchmarks/similarity.py [--k 5] [--areas 0 10000 100000]
+
+Builds the index of the neighborhoods of data/ as the app does (the
+KD-tree and the top-``k`` table of every area), then times a lookup in
+the precomputed table, a tree query for more neighbors than the table
+holds and a search from raw metric values. The same runs on ``--areas``
+synthetic areas with correlated metrics, so the scaling shows. Build
+times are the best of ``--repeat`` runs; query times are per query, over
+``--queries`` queries.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyctrees.similarity import SimilarityIndex  # noqa: E402
+
+METRICS = ['trees/sq.mile', 'avg.landprice_thous$/acre', 'properties/sq.mile', 'health']
+
+
+def best(call, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def per_query(call, rows):
+    start = time.perf_counter()
+    for row in rows:
+        call(row)
+    return (time.perf_counter() - start) / len(rows)
+
+
+def report(label, values, k, repeat, queries):
+    build_s, index = best(lambda: SimilarityIndex(values, k=k), repeat)
+    rows = np.random.RandomState(0).randint(0, len(values), queries)
+    lookup = per_query(index.query, rows)
+    tree = per_query(lambda row: index.query(row, 2 * k), rows)
+    search = per_query(lambda row: index.search(values[row], k), rows)
+    print('{:<28} {:>7} areas  build + top-{} table {:8.1f} ms  lookup {:6.2f} us  '
+          'tree query (k={}) {:6.1f} us  search {:6.1f} us'.format(
+              label, len(values), k, 1000 * build_s, 1e6 * lookup, 2 * k, 1e6 * tree,
+              1e6 * search))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--areas', type=int, nargs='*', default=[10000, 100000],
+                        help='sizes of synthetic tables (0 for none)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    from nyctrees.data import load_snapshot
+
+    df = load_snapshot().nta
+    report('neighborhoods', df[METRICS].values, args.k, args.repeat, args.queries)
+
+    rng = np.random.RandomState(0)
+    mixing = rng.randn(len(METRICS), len(METRICS))
+    for n in args.areas:
+        if not n:
+            continue
+        report('synthetic', rng.randn(n, len(METRICS)).dot(mixing), args.k, args.repeat,
+               args.queries)
+
+
+if __name__ == '__main__':
+    main()
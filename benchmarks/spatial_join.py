@@ -0,0 +1,91 @@
+"""Throughput and correctness of the NTA spatial join.
+
+    python benchmarks/spatial_join.py [--points 1000000] [--workers N] [--check 20000]
+
+Points are uniform over the bounding box of the NTAs (about two thirds fall
+outside every NTA). A sample is checked against a reference join: shapely
+when it is installed, otherwise one brute force ray casting test per
+polygon over all of its edges.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyctrees.data import DATA_DIR  # noqa: E402
+from nyctrees.geometry import points_in_polygon, ring_edges  # noqa: E402
+from nyctrees.spatial import SpatialJoin, feature_rings  # noqa: E402
+
+SOURCE = DATA_DIR / 'NeighborhoodTabulationAreas.geojson'
+
+
+def reference_join(features, x, y):
+    """Lowest index of the polygon containing every point, -1 for none."""
+    result = np.full(len(x), -1, dtype=np.int64)
+    try:
+        import shapely
+        from shapely.geometry import shape
+    except ImportError:
+        for i in reversed(range(len(features))):
+            edges = ring_edges(feature_rings(features[i]['geometry']))
+            result[points_in_polygon(x, y, *edges)] = i
+        return result
+    tree = shapely.STRtree([shape(feature['geometry']) for feature in features])
+    point, polygon = tree.query(shapely.points(x, y), predicate='within')
+    order = np.lexsort((polygon, point))
+    point, polygon = point[order], polygon[order]
+    first = np.r_[True, point[1:] != point[:-1]]
+    result[point[first]] = polygon[first]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--check', type=int, default=20000,
+                        help='points compared with the reference join')
+    args = parser.parse_args()
+
+    with open(str(SOURCE)) as f:
+        features = json.load(f)['features']
+
+    start = time.perf_counter()
+    join = SpatialJoin.from_geojson(SOURCE, 'ntaname')
+    print('index: {} polygons, {:,} edges, built in {:.2f}s'.format(
+        join.count, len(join.edges.owner), time.perf_counter() - start))
+
+    g = join.grid
+    rng = np.random.RandomState(0)
+    x = rng.uniform(g.xmin, g.xmin + g.nx * g.dx, args.points)
+    y = rng.uniform(g.ymin, g.ymin + g.ny * g.dy, args.points)
+
+    start = time.perf_counter()
+    found = join.locate(x, y)
+    elapsed = time.perf_counter() - start
+    print('locate: {:,} points in {:.2f}s ({:,.0f} points/s), {:.1%} inside an NTA'.format(
+        args.points, elapsed, args.points / elapsed, (found >= 0).mean()))
+
+    if args.workers and args.workers > 1:
+        start = time.perf_counter()
+        parallel = join.locate_parallel(x, y, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print('locate_parallel ({} workers): {:.2f}s, same result: {}'.format(
+            args.workers, elapsed, bool((parallel == found).all())))
+
+    n = min(args.check, args.points)
+    start = time.perf_counter()
+    expected = reference_join(features, x[:n], y[:n])
+    elapsed = time.perf_counter() - start
+    mismatches = int((expected != found[:n]).sum())
+    print('reference join of {:,} points in {:.2f}s: {} mismatches'.format(n, elapsed, mismatches))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Import time and memory of the app, as a gunicorn worker pays them.
+
+    python benchmarks/startup.py [--repeat 3] [--workers 2] [--out startup.json]
+
+``import Map_test`` runs ``--repeat`` times under ``python -X importtime``
+in a fresh interpreter; reported are the best total, the slowest modules
+by cumulative time and which of the heavy analytics modules (``HEAVY``)
+got imported at all. Another interpreter then records its peak RSS after
+the import and after ``Map_test.warm()``, and forks ``--workers``
+processes from there, as gunicorn does with ``preload_app``; each reports
+its proportional (PSS) and private memory from ``/proc/self/smaps_rollup``
+(Linux only), so the memory a worker shares with the master shows up as
+the difference.
+
+The JSON output can be diffed between two revisions like the one of
+``callbacks.py``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules that should only load when a request needs them, if at all
+HEAVY = ['statsmodels', 'sklearn', 'plotly.express', 'scipy.stats', 'scipy.sparse',
+         'scipy.special']
+TOP_MODULES = 15
+
+MEMORY_SCRIPT = r'''
+import gc, json, os, resource, sys, time
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def smaps():
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line and 'kB' in line)
+    except OSError:
+        return None
+    kb = lambda name: int(fields[name].split()[0]) * 1024
+    return {'rss': kb('Rss'), 'pss': kb('Pss'),
+            'private': kb('Private_Clean') + kb('Private_Dirty')}
+
+start = time.perf_counter()
+import Map_test
+result = {'import_s': time.perf_counter() - start, 'import_rss': rss(),
+          'heavy_loaded': sorted(m for m in json.loads(sys.argv[2]) if m in sys.modules)}
+start = time.perf_counter()
+Map_test.warm()
+gc.freeze()
+result.update(warm_s=time.perf_counter() - start, warm_rss=rss(), workers=[])
+pipes = []
+for _ in range(int(sys.argv[1])):
+    read, write = os.pipe()
+    if os.fork() == 0:
+        os.close(read)
+        # a request's worth of work touches what the worker reads
+        Map_test.display_map('neighborhoods', Map_test.DEFAULT_FEATURE, None, 'none', None)
+        os.write(write, json.dumps(smaps()).encode())
+        os._exit(0)
+    os.close(write)
+    pipes.append(read)
+for read in pipes:
+    data = b''
+    chunk = os.read(read, 65536)
+    while chunk:
+        data += chunk
+        chunk = os.read(read, 65536)
+    result['workers'].append(json.loads(data.decode()))
+    os.wait()
+result['master'] = smaps()
+print(json.dumps(result))
+'''
+
+
+def parse_importtime(stderr):
+    """(module, self us, cumulative us, depth) per line of ``-X importtime``."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative), depth))
+    return rows
+
+
+def import_times(repeat, env):
+    best = None
+    for _ in range(repeat):
+        run = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import Map_test'],
+                             cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        rows = parse_importtime(run.stderr)
+        total = sum(self_us for _, self_us, _, _ in rows)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    modules = {name for name, _, _, _ in rows}
+    slowest = sorted((row for row in rows if row[0] != 'Map_test'),
+                     key=lambda row: -row[2])[:TOP_MODULES]
+    return {
+        'total_ms': total / 1000,
+        'map_test_self_ms': sum(s for name, s, _, _ in rows if name == 'Map_test') / 1000,
+        'modules': len(modules),
+        'heavy_imported': [name for name in HEAVY if name in modules],
+        'slowest': [{'module': name, 'cumulative_ms': cumulative / 1000, 'depth': depth}
+                    for name, _, cumulative, depth in slowest],
+    }
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='processes forked after warm() to measure shared memory')
+    parser.add_argument('--out', default='startup.json')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    # a cold callback cache, away from the one of the app
+    env = dict(os.environ, NYCTREES_CACHE_DIR=tmp.name)
+    report = {'revision': revision(), 'python': platform.python_version()}
+    report['imports'] = imports = import_times(args.repeat, env)
+    print('import Map_test: {:.0f} ms, of which the module itself {:.0f} ms; {} modules'.format(
+        imports['total_ms'], imports['map_test_self_ms'], imports['modules']), file=sys.stderr)
+    print('heavy modules imported: {}'.format(', '.join(imports['heavy_imported']) or 'none'),
+          file=sys.stderr)
+    for entry in imports['slowest']:
+        print('  {:<48} {:8.1f} ms'.format('  ' * entry['depth'] + entry['module'],
+                                           entry['cumulative_ms']), file=sys.stderr)
+
+    run = subprocess.run([sys.executable, '-c', MEMORY_SCRIPT, str(args.workers),
+                          json.dumps(HEAVY)], cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                         universal_newlines=True, check=True)
+    report['memory'] = memory = json.loads(run.stdout.strip().splitlines()[-1])
+    print('after import {:.0f} MB peak RSS ({:.2f} s), after warm() {:.0f} MB ({:.2f} s)'.format(
+        memory['import_rss'] / 2 ** 20, memory['import_s'],
+        memory['warm_rss'] / 2 ** 20, memory['warm_s']), file=sys.stderr)
+    for i, worker in enumerate(memory['workers']):
+        if worker:
+            print('  worker {}: RSS {:.0f} MB, PSS {:.0f} MB, private {:.0f} MB'.format(
+                i, worker['rss'] / 2 ** 20, worker['pss'] / 2 ** 20,
+                worker['private'] / 2 ** 20), file=sys.stderr)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print('written to {}'.format(args.out), file=sys.stderr)
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Synthetic scale-up of the neighborhood table for benchmarks.
+
+    python benchmarks/synthetic.py 40000 /tmp/nyctrees-40000
+
+writes a copy of data/ in which the 195 NTAs are replaced by ``n`` square
+areas (2,000 ~ census tracts, 40,000 ~ census blocks) tiling the same
+footprint. Every square takes the metrics of the NTA its center lies in,
+with some noise, and a species mix drawn from that NTA's trees. The
+borough tables are copied unchanged. Point the app at the result with
+``NYCTREES_DATA_DIR``.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyctrees.data import DATA_DIR, SCHEMAS  # noqa: E402
+from nyctrees.etl import _hover  # noqa: E402
+from nyctrees.spatial import SpatialJoin  # noqa: E402
+
+NTA_GEOJSON = 'NeighborhoodTabulationAreas.geojson'
+MILES_PER_DEGREE = 69.17
+# relative spread of the metrics around their NTA's value
+NOISE = 0.15
+
+
+def square_cells(join, n, rng, allowed):
+    """Centers, NTA and size of ``n`` grid squares whose centers lie in an
+    ``allowed`` NTA."""
+    g = join.grid
+    width, height = g.nx * g.dx, g.ny * g.dy
+    probe_x = rng.uniform(g.xmin, g.xmin + width, 20000)
+    probe_y = rng.uniform(g.ymin, g.ymin + height, 20000)
+    probe = join.locate(probe_x, probe_y)
+    covered = max(((probe >= 0) & allowed[probe]).mean(), 1e-3)
+    size = np.sqrt(width * height * covered / n)
+    while True:
+        xs = g.xmin + (np.arange(int(width / size)) + 0.5) * size
+        ys = g.ymin + (np.arange(int(height / size)) + 0.5) * size
+        x, y = [a.ravel() for a in np.meshgrid(xs, ys)]
+        parent = join.locate(x, y)
+        inside = np.flatnonzero((parent >= 0) & allowed[parent])
+        if len(inside) >= n:
+            break
+        size *= 0.95
+    keep = np.sort(rng.choice(inside, n, replace=False))
+    return x[keep], y[keep], parent[keep], size
+
+
+def scale_tables(n, out_dir, data_dir=DATA_DIR, seed=0):
+    """Write a data directory with ``n`` synthetic areas; returns its path."""
+    data_dir, out_dir = Path(data_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    nta_file = SCHEMAS['nta'][0]
+    species_file = SCHEMAS['species'][0]
+
+    nta = pd.read_csv(str(data_dir / nta_file), index_col=0)
+    row_of = pd.Series(np.arange(len(nta)), index=nta['ntaname'].values)
+    row_of = row_of[~row_of.index.duplicated()]
+    join = SpatialJoin.from_geojson(data_dir / NTA_GEOJSON, 'ntaname')
+    # NTAs without a table row (parks, cemeteries) get no squares
+    polygon_rows = row_of.reindex(join.names).values
+    x, y, parent, size = square_cells(join, n, rng, ~np.isnan(polygon_rows))
+    rows = polygon_rows[parent].astype(np.int64)
+
+    df = nta.iloc[rows].reset_index(drop=True)
+    df['ntaname'] = ['{} {}'.format(name, i) for i, name in enumerate(join.names[parent])]
+    for column in ['trees/sq.mile', 'avg.landprice_thous$/acre',
+                   'avg.propvalue_thous$/acre', 'properties/sq.mile']:
+        df[column] = df[column] * rng.lognormal(0, NOISE, len(df))
+    df['health'] = np.clip(df['health'] * rng.lognormal(0, NOISE / 10, len(df)), 0, 15)
+    df = df.round(2)
+    df['area'] = (size * MILES_PER_DEGREE) ** 2 * np.cos(np.radians(y))
+    df['centerLong'], df['centerLat'] = x, y
+    df['hover'] = _hover(df, with_borough=True)
+    df.to_csv(str(out_dir / nta_file))
+
+    # every square gets Poisson(trees/sq.mile * area) trees of its NTA's species mix
+    species = pd.read_csv(str(data_dir / species_file), index_col=0)
+    mix = species.groupby('ntaname')
+    trees = rng.poisson(df['trees/sq.mile'].values * df['area'].values)
+    parts = []
+    for name, group in mix:
+        members = np.flatnonzero(nta['ntaname'].values[rows] == name)
+        if not len(members):
+            continue
+        p = group['count'].values / group['count'].sum()
+        counts = np.array([rng.multinomial(trees[i], p) for i in members])
+        member, kind = np.nonzero(counts)
+        squares = members[member]
+        parts.append(pd.DataFrame({
+            'ntaname': df['ntaname'].values[squares],
+            'borough': group['borough'].values[kind],
+            'spc_common': group['spc_common'].values[kind],
+            'count': counts[member, kind],
+            'area': df['area'].values[squares],
+            'total': trees[squares],
+        }))
+    species = pd.concat(parts, ignore_index=True)
+    species['spc_per'] = species['count'] / species['total'] * 100
+    species.to_csv(str(out_dir / species_file))
+
+    with open(str(data_dir / NTA_GEOJSON)) as f:
+        template = json.load(f)
+    half = size / 2
+    features = []
+    for name, cx, cy in zip(df['ntaname'], x, y):
+        ring = [[cx - half, cy - half], [cx + half, cy - half], [cx + half, cy + half],
+                [cx - half, cy + half], [cx - half, cy - half]]
+        features.append({'type': 'Feature', 'properties': {'ntaname': name},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    template['features'] = features
+    with open(str(out_dir / NTA_GEOJSON), 'w') as f:
+        json.dump(template, f)
+
+    for name in os.listdir(str(data_dir)):
+        if not (out_dir / name).exists() and (data_dir / name).is_file():
+            shutil.copyfile(str(data_dir / name), str(out_dir / name))
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('areas', type=int)
+    parser.add_argument('out')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    scale_tables(args.areas, args.out, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""gunicorn settings for serving the app.
+
+    gunicorn -c gunicorn.conf.py Map_test:server
+
+With ``preload_app`` the master imports ``Map_test`` once and runs its
+``warm()`` before forking, so the tables, geometry, tiles layers and
+warmed caches are shared by every worker copy-on-write instead of being
+built again in each. ``gc.freeze()`` keeps the collector from touching
+(and so copying) those objects in the workers.
+
+Set ``NYCTREES_PRELOAD=0`` to import the app in every worker instead,
+e.g. to reload code with ``--reload``; each worker then warms its own
+caches.
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get('NYCTREES_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+preload_app = os.environ.get('NYCTREES_PRELOAD', '1') == '1'
+timeout = 120
+
+
+def when_ready(server):
+    # runs in the master after the app was loaded, before the first fork
+    app = sys.modules.get('Map_test')
+    if app is not None and preload_app:
+        app.warm()
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    # without preload_app the worker imported the app itself
+    app = sys.modules.get('Map_test')
+    if app is not None and not preload_app:
+        app.warm()
@@ -0,0 +1 @@
+"""Data and geometry helpers behind the NYC Trees & Properties dashboard."""
@@ -0,0 +1,227 @@
+"""Spatial autocorrelation of area metrics: global Moran's I and LISA.
+
+Neighboring areas have similar values, so correlations and tests that
+treat areas as independent overstate significance. :func:`contiguity`
+derives the neighbors of every area once from its polygons: areas are
+queen neighbors when their borders share a vertex and rook neighbors when
+they share an edge. The polygons come from the level of detail pyramid
+(:mod:`nyctrees.lod`), whose vertices are quantized and whose shared
+borders are identical arcs, so both tests are exact integer joins.
+
+Weights are row standardized. Pseudo p-values come from random
+permutations of the values, all drawn at once as one ``(permutations, n)``
+array: the global statistic of every permutation is a single sparse
+product, and the local statistics use conditional permutations (the value
+of an area stays, its neighbors are drawn from the other areas) computed
+for blocks of areas at a time.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# LISA quadrants: value above / below the mean, and its neighbors' too
+NOT_SIGNIFICANT, HIGH_HIGH, LOW_HIGH, LOW_LOW, HIGH_LOW = range(5)
+QUADRANT_LABELS = ['not significant', 'high-high', 'low-high', 'low-low', 'high-low']
+PERMUTATIONS = 9999
+# areas whose local permutations are evaluated together
+BLOCK = 16
+
+Moran = namedtuple('Moran', 'I expected z p_sim')
+LISA = namedtuple('LISA', 'local quadrant p_sim clusters')
+
+
+def _vertex_keys(rings):
+    """int64 key of every vertex of integer ``(x, y)`` rings."""
+    xy = np.concatenate(rings).astype(np.int64)
+    return ((xy[:, 0] + (1 << 30)) << 32) | (xy[:, 1] + (1 << 30))
+
+
+def contiguity(polygons, kind='queen'):
+    """Symmetric binary ``(n, n)`` sparse matrix of the areas sharing a
+    border vertex (``'queen'``) or edge (``'rook'``).
+
+    ``polygons[i]`` is the list of closed integer rings of area ``i`` (empty
+    for an area without geometry, which gets no neighbors).
+    """
+    from scipy import sparse
+
+    parts = []
+    for area, rings in enumerate(polygons):
+        for ring in rings:
+            keys = _vertex_keys([ring[:-1]])
+            if kind == 'queen':
+                parts.append(pd.DataFrame({'a': keys, 'b': 0, 'area': area}))
+            else:
+                following = np.roll(keys, -1)
+                parts.append(pd.DataFrame({'a': np.minimum(keys, following),
+                                           'b': np.maximum(keys, following), 'area': area}))
+    n = len(polygons)
+    if not parts:
+        return sparse.csr_matrix((n, n))
+    owners = pd.concat(parts, ignore_index=True).drop_duplicates()
+    pairs = owners.merge(owners, on=['a', 'b'])
+    pairs = pairs[pairs['area_x'] != pairs['area_y']].drop_duplicates(['area_x', 'area_y'])
+    return sparse.csr_matrix((np.ones(len(pairs)), (pairs['area_x'].values,
+                                                    pairs['area_y'].values)), shape=(n, n))
+
+
+def engine_polygons(engine, names, level=-1):
+    """Integer rings of the areas ``names`` in a ChoroplethEngine's geometry."""
+    features = engine.lod.levels[level]['features']
+    polygons = []
+    for name in names:
+        feature = engine.index.get(name)
+        polygons.append([] if feature is None else
+                        [ring for polygon in features[feature] for ring in polygon])
+    return polygons
+
+
+def row_standardize(w):
+    """``w`` with every row summing to one (rows without neighbors stay zero)."""
+    from scipy import sparse
+
+    degree = np.asarray(w.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(degree > 0, 1.0 / degree, 0.0)
+    return sparse.diags(scale).dot(w).tocsr()
+
+
+def _centered(values):
+    z = np.asarray(values, dtype=np.float64)
+    return z - z.mean()
+
+
+def _pseudo_p(simulated, observed, permutations):
+    """Folded pseudo p-value: the share of permutations at least as extreme
+    on the side of the observed value."""
+    larger = (simulated >= observed).sum(axis=0)
+    larger = np.minimum(larger, permutations - larger)
+    return (larger + 1.0) / (permutations + 1.0)
+
+
+def _permutations(rng, permutations, n):
+    return np.argsort(rng.random_sample((permutations, n)), axis=1)
+
+
+def moran(values, w, permutations=PERMUTATIONS, seed=0):
+    """Global Moran's I of ``values`` under the row standardized weights ``w``."""
+    z = _centered(values)
+    n = len(z)
+    s0 = w.sum()
+    scale = n / s0 / z.dot(z)
+    observed = scale * z.dot(w.dot(z))
+    expected = -1.0 / (n - 1)
+    if not permutations:
+        return Moran(observed, expected, np.nan, np.nan)
+    rng = np.random.RandomState(seed)
+    shuffled = z[_permutations(rng, permutations, n)]
+    # one sparse product lags every permutation
+    simulated = scale * (shuffled * w.dot(shuffled.T).T).sum(axis=1)
+    std = simulated.std()
+    return Moran(observed, expected, (observed - simulated.mean()) / std if std else np.nan,
+                 float(_pseudo_p(simulated, observed, permutations)))
+
+
+def lisa(values, w, permutations=PERMUTATIONS, seed=0, alpha=0.05):
+    """Local Moran's I of every area, its quadrant, pseudo p-value and
+    cluster (the quadrant where ``p_sim <= alpha``, ``NOT_SIGNIFICANT``
+    elsewhere). ``w`` is row standardized."""
+    z = _centered(values)
+    n = len(z)
+    m2 = z.dot(z) / n
+    lag = w.dot(z)
+    local = z * lag / m2
+    quadrant = np.where(z > 0, np.where(lag > 0, HIGH_HIGH, HIGH_LOW),
+                        np.where(lag > 0, LOW_HIGH, LOW_LOW))
+    degree = np.diff(w.indptr)
+    p_sim = np.ones(n)
+    k = int(degree.max()) if n else 0
+    if permutations and k and n > 1:
+        rng = np.random.RandomState(seed)
+        # the same draws of k of the other n - 1 areas serve every area: an
+        # index at or past area i stands for the area after it
+        draws = _permutations(rng, permutations, n - 1)[:, :k]
+        base = z[draws]
+        # a neighbor weight per area (row standardized: 1 / degree)
+        weight = np.asarray(w.sum(axis=1)).ravel() / np.maximum(degree, 1)
+        first_k = np.cumsum(base, axis=1)
+        shift = z[draws + 1] - base
+        simulated = np.empty((permutations, n))
+        for start in range(0, n, BLOCK):
+            rows = np.arange(start, min(start + BLOCK, n))
+            counts = degree[rows]
+            take = np.arange(k)[None, :] < counts[:, None]
+            # (rows, permutations, k): draws that skip over the area itself
+            moved = (draws[None, :, :] >= rows[:, None, None]) & take[:, None, :]
+            sums = (first_k[:, np.maximum(counts - 1, 0)].T +
+                    np.einsum('rpk,pk->rp', moved, shift))
+            sums[counts == 0] = 0
+            simulated[:, rows] = (z[rows, None] * weight[rows, None] * sums / m2).T
+        p_sim = _pseudo_p(simulated, local, permutations)
+        p_sim[degree == 0] = 1.0
+    clusters = np.where(p_sim <= alpha, quadrant, NOT_SIGNIFICANT)
+    return LISA(local, quadrant, p_sim, clusters)
+
+
+class AutocorrelationEngine:
+    """Moran's I and LISA of any metric of one view's areas.
+
+    The contiguity of the areas is computed once; each call standardizes
+    the weights of the areas where the metric is defined. ``rows`` maps the
+    rows of the values to their areas when several rows share an area: such
+    rows count once, with their mean value, and share its results.
+    """
+
+    def __init__(self, polygons, kind='queen', permutations=PERMUTATIONS, seed=0, rows=None):
+        self.contiguity = contiguity(polygons, kind)
+        self.kind = kind
+        self.permutations = permutations
+        self.seed = seed
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+
+    @classmethod
+    def from_engine(cls, engine, names, **kwargs):
+        """Engine of the areas ``names``; a name on several rows (an NTA in
+        two boroughs) is one area, not two neighbors sharing a polygon."""
+        rows, unique = pd.factorize(pd.Series(list(names), dtype=object).astype(str))
+        return cls(engine_polygons(engine, unique), rows=rows, **kwargs)
+
+    def neighbors(self):
+        """Number of neighbors of every area."""
+        return np.diff(self.contiguity.indptr)
+
+    def _areas(self, values):
+        """``values`` per area: the mean of the defined values of its rows."""
+        values = np.asarray(values, dtype=np.float64)
+        if self.rows is None:
+            return values
+        n = self.contiguity.shape[0]
+        defined = np.isfinite(values)
+        counts = np.bincount(self.rows[defined], minlength=n)
+        sums = np.bincount(self.rows[defined], values[defined], minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def _weights(self, values):
+        values = self._areas(values)
+        defined = np.flatnonzero(np.isfinite(values))
+        w = self.contiguity[defined][:, defined]
+        return values[defined], row_standardize(w), defined
+
+    def moran(self, values):
+        values, w, _ = self._weights(values)
+        return moran(values, w, self.permutations, self.seed)
+
+    def lisa(self, values):
+        """:func:`lisa` for every area; undefined values are not significant."""
+        defined_values, w, defined = self._weights(values)
+        result = lisa(defined_values, w, self.permutations, self.seed)
+        n = self.contiguity.shape[0]
+        full = [np.full(n, np.nan), np.zeros(n, dtype=np.int64), np.ones(n),
+                np.full(n, NOT_SIGNIFICANT, dtype=np.int64)]
+        for column, part in zip(full, result):
+            column[defined] = part
+        if self.rows is not None:
+            full = [column[self.rows] for column in full]
+        return LISA(*full)
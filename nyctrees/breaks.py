@@ -0,0 +1,173 @@
+"""Class breaks computed from the data: quantile, equal interval and Jenks.
+
+Breaks are inclusive upper bounds, as :func:`nyctrees.choropleth.classify`
+expects, truncated to the number of decimals the metric is shown with.
+Jenks natural breaks minimize the within-class sum of squared deviations
+(Fisher's exact dynamic program). The optimal start of the last class
+never moves left as the classified prefix grows, so each of the ``k``
+rounds is solved by divide and conquer, vectorized over every
+subproblem of one recursion depth: ``O(k log n)`` array operations.
+"""
+import numpy as np
+
+from nyctrees.cache import LRUCache
+
+
+def decimals_for(values, resolution=100):
+    """Decimals needed to tell ``resolution`` steps of the value range apart."""
+    values = np.asarray(values, dtype=np.float64)
+    spread = np.ptp(values) if len(values) else 0.0
+    if not spread > 0:
+        return 0
+    return max(0, int(np.ceil(-np.log10(spread / resolution))))
+
+
+def truncate(values, decimals):
+    """``values`` truncated to ``decimals`` places, in units of the last place."""
+    scaled = np.asarray(values, dtype=np.float64) * 10.0 ** decimals
+    # rounding first keeps 14.32 * 100 (or float32 14.3199997) from flooring to 1431
+    return np.floor(np.round(scaled, 3))
+
+
+def quantile_breaks(values, k):
+    """Upper bounds of ``k`` classes holding equal numbers of values."""
+    x = np.sort(np.asarray(values, dtype=np.float64))
+    n = len(x)
+    ranks = np.ceil(np.arange(1, k) * n / k).astype(np.int64) - 1
+    return x[np.clip(ranks, 0, n - 1)]
+
+
+def equal_interval_breaks(values, k):
+    """Upper bounds of ``k`` classes of equal width."""
+    x = np.asarray(values, dtype=np.float64)
+    return x.min() + np.arange(1, k) * (x.max() - x.min()) / k
+
+
+def _segment_cost(s1, s2, w, i, j):
+    """Sum of squared deviations of the values ``i..j-1`` (prefix sums)."""
+    total = s1[j] - s1[i]
+    return s2[j] - s2[i] - total * total / (w[j] - w[i])
+
+
+def jenks_breaks(values, k):
+    """Upper bounds of the ``k`` classes with the least squared deviation."""
+    x, counts = np.unique(np.asarray(values, dtype=np.float64), return_counts=True)
+    m = len(x)
+    k = min(k, m)
+    if k < 2:
+        return np.zeros(0)
+    # distinct values weighted by their counts; ties never straddle a break
+    w = np.r_[0, np.cumsum(counts)].astype(np.float64)
+    s1 = np.r_[0, np.cumsum(counts * x)]
+    s2 = np.r_[0, np.cumsum(counts * x * x)]
+
+    ends = np.arange(m + 1)
+    cost = np.full(m + 1, np.inf)
+    cost[1:] = _segment_cost(s1, s2, w, 0, ends[1:])
+    # start[c][j]: first value of the last class when values 0..j-1 form c + 1 classes
+    start = []
+    for c in range(1, k):
+        previous, cost = cost, np.full(m + 1, np.inf)
+        best = np.zeros(m + 1, dtype=np.int64)
+        # subproblems: ends lo..hi, whose optimal starts lie in first..last
+        lo, hi = np.array([c + 1]), np.array([m])
+        first, last = np.array([c]), np.array([m - 1])
+        while len(lo):
+            mid = (lo + hi) // 2
+            top = np.minimum(last, mid - 1)
+            n = top - first + 1
+            owner = np.repeat(np.arange(len(mid)), n)
+            offset = np.cumsum(n) - n
+            i = first[owner] + np.arange(n.sum()) - offset[owner]
+            total = previous[i] + _segment_cost(s1, s2, w, i, mid[owner])
+            lowest = np.minimum.reduceat(total, offset)
+            # leftmost minimum of every subproblem
+            hit = np.flatnonzero(total <= lowest[owner])
+            choice = i[hit[np.r_[True, owner[hit][1:] != owner[hit][:-1]]]]
+            cost[mid], best[mid] = lowest, choice
+            left, right = mid - 1 >= lo, mid + 1 <= hi
+            lo = np.r_[lo[left], mid[right] + 1]
+            hi = np.r_[mid[left] - 1, hi[right]]
+            first, last = np.r_[first[left], choice[right]], np.r_[choice[left], last[right]]
+        start.append(best)
+
+    bounds = []
+    j = m
+    for best in reversed(start):
+        j = best[j]
+        bounds.append(x[j - 1])
+    return np.array(bounds[::-1])
+
+
+METHODS = {
+    'quantile': quantile_breaks,
+    'equal': equal_interval_breaks,
+    'jenks': jenks_breaks,
+}
+
+
+class Classes:
+    """Breaks of one metric, with the legend labels of its classes."""
+
+    def __init__(self, breaks, decimals, low, high):
+        self.decimals = decimals
+        self.breaks = [b / 10.0 ** decimals for b in breaks]
+        self.low = low
+        self.high = high
+
+    def __len__(self):
+        return len(self.breaks) + 1
+
+    def labels(self):
+        """``"0-500"``, ``"501-1000"``, ...: every class's truncated range."""
+        step = 10.0 ** -self.decimals
+        lows = [self.low] + [b + step for b in self.breaks]
+        highs = self.breaks + [self.high]
+        fmt = '{:.%df}' % self.decimals
+        return [fmt.format(lo) if fmt.format(lo) == fmt.format(hi)
+                else fmt.format(lo) + '-' + fmt.format(hi) for lo, hi in zip(lows, highs)]
+
+
+def class_breaks(values, method='jenks', k=7, decimals=None):
+    """:class:`Classes` of ``values`` (non finite values are ignored)."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if decimals is None:
+        decimals = decimals_for(values)
+    if not len(values):
+        return Classes([], decimals, 0.0, 0.0)
+    scaled = truncate(values, decimals)
+    breaks = truncate(METHODS[method](values, k), decimals) if k > 1 else []
+    # empty and repeated classes are dropped; the last one ends at the maximum
+    breaks = [int(b) for b in np.unique(breaks) if scaled.min() <= b < scaled.max()]
+    unit = 10.0 ** decimals
+    return Classes(breaks, decimals, scaled.min() / unit, scaled.max() / unit)
+
+
+def palette(colors, n):
+    """``n`` colors spread evenly over a sequential palette."""
+    if n <= 1:
+        return list(colors[-1:])
+    return [colors[i] for i in np.round(np.linspace(0, len(colors) - 1, n)).astype(int)]
+
+
+class BreaksCache:
+    """:func:`class_breaks` per (view, metric, method, k), kept per data version.
+
+    ``version`` (the data snapshot hash) is part of every key, so breaks are
+    recomputed only when the tables change.
+    """
+
+    def __init__(self, version='', maxsize=256):
+        self.version = version
+        self.cache = LRUCache(maxsize)
+
+    def get(self, view, metric, values, method='jenks', k=7):
+        return self.cache.get_or_compute(
+            (self.version, view, metric, method, k),
+            lambda: class_breaks(values, method, k))
+
+    def invalidate(self, version):
+        if version != self.version:
+            self.version = version
+            self.cache.clear()
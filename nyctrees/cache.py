@@ -0,0 +1,176 @@
+"""Small caches shared by the servers in this package.
+
+:class:`LRUCache` lives in one process; :class:`SharedCache` keeps encoded
+callback results in a SQLite file that every worker on the host reads and
+writes, so a figure built by one gunicorn worker is served by all others.
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import plotly
+
+PACKAGE_DIR = Path(__file__).resolve().parent
+
+
+def code_version(*files):
+    """Hash of ``files`` and of every module of this package, for versions
+    of caches that outlive the process: a change to any of them misses."""
+    digest = hashlib.sha1()
+    for path in list(map(Path, files)) + sorted(PACKAGE_DIR.glob('*.py')):
+        digest.update(path.name.encode() + b'\0' + path.read_bytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread safe mapping that keeps at most ``maxsize`` recent entries."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCache:
+    """Callback results in a SQLite file, with LRU and TTL eviction.
+
+    Values are JSON encoded (with plotly's encoder) and come back as plain
+    dicts, which Dash accepts as figures. ``hits`` and ``misses`` count the
+    lookups of this process. When the database cannot be opened or written
+    the cache steps aside and results are simply computed.
+    """
+
+    def __init__(self, path, maxsize=4096, ttl=24 * 3600, version=''):
+        self.path = str(path)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite connections must not cross a fork, so they are per process
+        # (and per thread)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, value BLOB, created REAL, used REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _key(self, name, key):
+        return json.dumps([self.version, name, key], separators=(',', ':'), default=str)
+
+    def get(self, name, key):
+        """Cached value for ``key`` of callback ``name``, or None."""
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute('SELECT value, created FROM entries WHERE key = ?',
+                           (self._key(name, key),)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        conn.execute('UPDATE entries SET used = ? WHERE key = ?', (now, self._key(name, key)))
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode())
+
+    def put(self, name, key, value):
+        now = time.time()
+        blob = zlib.compress(
+            json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode(), 1)
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                     (self._key(name, key), blob, now, now))
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM entries WHERE created < ?', (now - self.ttl,))
+        conn.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries '
+                     'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM entries')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def memoize(self, key):
+        """Decorator caching a callback under ``key(*args)``.
+
+        ``key`` turns the callback arguments into a JSON-able value that
+        identifies the result, e.g. the rounded lasso instead of the raw
+        ``selectedData``.
+        """
+
+        def decorator(func):
+            name = func.__module__ + '.' + func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                try:
+                    cache_key = key(*args)
+                    value = self.get(name, cache_key)
+                except (sqlite3.Error, OSError):
+                    # no usable database (e.g. a read-only cache directory)
+                    return func(*args)
+                if value is None:
+                    value = func(*args)
+                    try:
+                        self.put(name, cache_key, value)
+                    except (sqlite3.Error, OSError):
+                        pass
+                return value
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,235 @@
+"""Area-weighted centroids and interior label points of polygon features.
+
+All rings of all features are flattened into one coordinate array, so the
+centroids of every part, hole and feature come out of a few bincounts.
+Label points are poles of inaccessibility (the interior point farthest
+from the boundary), found for all features at once by refining a grid of
+candidate cells, as polylabel does with a priority queue.
+
+    python -m nyctrees.centroids
+
+rewrites ``centerLong``/``centerLat`` of the area tables in data/.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from nyctrees.data import DATA_DIR
+
+# candidate cells per side of a feature's bounding box, and the number of
+# most promising cells refined per feature and round
+GRID = 8
+BEAM = 8
+# label points are exact to this fraction of the feature's size
+PRECISION = 1e-3
+# markers stay on the centroid unless it is outside the feature or much
+# closer to its boundary than the label point
+CENTROID_DEPTH = 0.5
+
+SOURCES = [
+    ('Trees_Properties_With_Centroids.csv', 'NeighborhoodTabulationAreas.geojson',
+     'ntaname', 'ntaname'),
+    ('Trees_Properties_With_Centroids_Boro.csv', 'BoroughBoundaries.geojson',
+     'boro_name', 'borough'),
+]
+
+
+class Rings:
+    """The rings of ``features`` in one ``(n, 2)`` coordinate array.
+
+    Ring ``r`` is ``coords[offsets[r]:offsets[r + 1]]``, belongs to
+    feature ``feature[r]`` and is a hole when ``hole[r]``.
+    """
+
+    def __init__(self, features):
+        coords, feature, hole = [], [], []
+        for i, item in enumerate(features):
+            geometry = item['geometry']
+            polygons = geometry['coordinates']
+            if geometry['type'] == 'Polygon':
+                polygons = [polygons]
+            for polygon in polygons:
+                for k, ring in enumerate(polygon):
+                    coords.append(np.asarray(ring, dtype=np.float64))
+                    feature.append(i)
+                    hole.append(k > 0)
+        self.count = len(features)
+        self.coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+        self.offsets = np.r_[0, np.cumsum([len(ring) for ring in coords])].astype(np.int64)
+        self.feature = np.asarray(feature, dtype=np.int64)
+        self.hole = np.asarray(hole, dtype=bool)
+
+        # edges join consecutive vertices of the same ring
+        ring_of_vertex = np.repeat(np.arange(len(coords)), np.diff(self.offsets))
+        start = np.flatnonzero(np.r_[ring_of_vertex[1:] == ring_of_vertex[:-1], False])
+        self.edge_ring = ring_of_vertex[start]
+        self.edge_feature = self.feature[self.edge_ring]
+        self.x0, self.y0 = self.coords[start, 0], self.coords[start, 1]
+        self.x1, self.y1 = self.coords[start + 1, 0], self.coords[start + 1, 1]
+        # edges are grouped by feature: edges of feature f are
+        # edge_offsets[f]:edge_offsets[f + 1]
+        self.edge_offsets = np.searchsorted(self.edge_feature, np.arange(self.count + 1))
+
+    @classmethod
+    def from_geojson(cls, path):
+        with open(str(path)) as f:
+            return cls(json.load(f)['features'])
+
+    def bounds(self):
+        """``(xmin, ymin, xmax, ymax)`` arrays per feature (NaN without rings)."""
+        out = np.full((4, self.count), np.nan)
+        vertex_feature = np.repeat(self.feature, np.diff(self.offsets))
+        for k, (axis, reduce) in enumerate([(0, np.fmin), (1, np.fmin),
+                                            (0, np.fmax), (1, np.fmax)]):
+            reduce.at(out[k], vertex_feature, self.coords[:, axis])
+        return out
+
+
+def area_centroids(rings):
+    """``(lon, lat, area)`` of every feature; holes subtract, every part counts."""
+    cross = rings.x0 * rings.y1 - rings.x1 * rings.y0
+    n = len(rings.hole)
+    twice_area = np.bincount(rings.edge_ring, cross, minlength=n)
+    moment_x = np.bincount(rings.edge_ring, (rings.x0 + rings.x1) * cross, minlength=n)
+    moment_y = np.bincount(rings.edge_ring, (rings.y0 + rings.y1) * cross, minlength=n)
+    # ring orientation is not trusted: exteriors add, holes subtract
+    sign = np.where(rings.hole, -1.0, 1.0) * np.sign(twice_area)
+    area = sign * twice_area / 2
+    total = np.bincount(rings.feature, area, minlength=rings.count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lon = np.bincount(rings.feature, sign * moment_x / 6, minlength=rings.count) / total
+        lat = np.bincount(rings.feature, sign * moment_y / 6, minlength=rings.count) / total
+    return lon, lat, total
+
+
+def signed_distance(rings, px, py, pf, max_pairs=1 << 21):
+    """Distance of every point to the boundary of feature ``pf``; positive
+    inside the feature, negative outside (-inf for features without rings)."""
+    px, py, pf = np.asarray(px, np.float64), np.asarray(py, np.float64), np.asarray(pf)
+    result = np.full(len(px), -np.inf)
+    counts = np.diff(rings.edge_offsets)[pf]
+    todo = np.flatnonzero(counts > 0)
+    # chunks of points whose (point, edge) pairs fit in max_pairs
+    cum = np.cumsum(counts[todo])
+    bounds = np.searchsorted(cum, np.arange(0, cum[-1] if len(cum) else 0, max_pairs),
+                             side='right')
+    for lo, hi in zip(bounds, np.r_[bounds[1:], len(todo)]):
+        hi = max(hi, lo + 1)
+        points = todo[lo:hi]
+        n = counts[points]
+        pair_point = np.repeat(np.arange(len(points)), n)
+        first = np.cumsum(n) - n
+        edge = rings.edge_offsets[pf[points]][pair_point] + np.arange(n.sum()) - first[pair_point]
+        x, y = px[points][pair_point], py[points][pair_point]
+        x0, y0, x1, y1 = rings.x0[edge], rings.y0[edge], rings.x1[edge], rings.y1[edge]
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.where(length2 > 0, ((x - x0) * dx + (y - y0) * dy) / length2, 0), 0, 1)
+            crossing = ((y0 > y) != (y1 > y)) & (x < x0 + (y - y0) * dx / dy)
+        distance2 = (x0 + t * dx - x) ** 2 + (y0 + t * dy - y) ** 2
+        nearest = np.sqrt(np.minimum.reduceat(distance2, first))
+        inside = np.logical_xor.reduceat(crossing, first)
+        result[points] = np.where(inside, nearest, -nearest)
+    return result
+
+
+def _best_per_feature(pf, score, count):
+    """Index of the highest ``score`` per feature (-1 where none)."""
+    best = np.full(count, -1, dtype=np.int64)
+    order = np.lexsort((-score, pf))
+    first = np.r_[True, pf[order][1:] != pf[order][:-1]] if len(order) else order.astype(bool)
+    best[pf[order][first]] = order[first]
+    return best
+
+
+def label_points(rings, grid=GRID, beam=BEAM, precision=PRECISION):
+    """``(lon, lat, depth)`` of the pole of inaccessibility of every feature.
+
+    ``depth`` is the distance from the point to the feature's boundary.
+    """
+    xmin, ymin, xmax, ymax = rings.bounds()
+    size = np.fmax(xmax - xmin, ymax - ymin)
+    valid = np.flatnonzero(size > 0)
+
+    # seed with the centroids, then a grid over each bounding box
+    lon, lat, _ = area_centroids(rings)
+    best_x, best_y = lon.copy(), lat.copy()
+    best_d = np.full(rings.count, -np.inf)
+    best_d[valid] = signed_distance(rings, lon[valid], lat[valid], valid)
+
+    steps = (np.arange(grid) + 0.5) / grid
+    pf = np.repeat(valid, grid * grid)
+    h = size[pf] / grid
+    px = xmin[pf] + np.tile(np.repeat(steps, grid), len(valid)) * size[pf]
+    py = ymin[pf] + np.tile(np.tile(steps, grid), len(valid)) * size[pf]
+
+    while len(pf):
+        d = signed_distance(rings, px, py, pf)
+        best = _best_per_feature(pf, d, rings.count)
+        found = np.flatnonzero(best >= 0)
+        better = found[d[best[found]] > best_d[found]]
+        best_d[better] = d[best[better]]
+        best_x[better], best_y[better] = px[best[better]], py[best[better]]
+
+        # a cell can hold a point at most half its diagonal deeper than its center
+        potential = d + h * np.sqrt(0.5)
+        keep = (potential > best_d[pf] + precision * size[pf]) & (h / 2 > precision * size[pf])
+        pf, px, py, h, potential = pf[keep], px[keep], py[keep], h[keep], potential[keep]
+        order = np.lexsort((-potential, pf))
+        group_start = np.searchsorted(pf[order], pf[order], side='left')
+        top = order[np.arange(len(order)) - group_start < beam]
+        pf, px, py, h = pf[top], px[top], py[top], h[top] / 2
+        quarter = h / 2
+        pf = np.repeat(pf, 4)
+        px = np.repeat(px, 4) + np.tile([-1, 1, -1, 1], len(h)) * np.repeat(quarter, 4)
+        py = np.repeat(py, 4) + np.tile([-1, -1, 1, 1], len(h)) * np.repeat(quarter, 4)
+        h = np.repeat(h, 4)
+    return best_x, best_y, best_d
+
+
+def feature_centers(path, name_property, key):
+    """Centroid, label point and marker position of every feature of a geojson
+    file, by the lowercase ``name_property`` in column ``key``."""
+    with open(str(path)) as f:
+        features = json.load(f)['features']
+    rings = Rings(features)
+    lon, lat, _ = area_centroids(rings)
+    label_lon, label_lat, depth = label_points(rings)
+    centroid_depth = signed_distance(rings, lon, lat, np.arange(rings.count))
+    use_centroid = centroid_depth >= CENTROID_DEPTH * depth
+    return pd.DataFrame({
+        key: [feature['properties'][name_property].lower() for feature in features],
+        'centroidLong': lon,
+        'centroidLat': lat,
+        'labelLong': label_lon,
+        'labelLat': label_lat,
+        'centerLong': np.where(use_centroid, lon, label_lon),
+        'centerLat': np.where(use_centroid, lat, label_lat),
+    })
+
+
+def update_tables(data_dir=DATA_DIR, geometry_dir=DATA_DIR):
+    """Replace ``centerLong``/``centerLat`` of the area tables in place."""
+    for table, geojson, name_property, key in SOURCES:
+        path = data_dir / table
+        df = pd.read_csv(str(path), index_col=0)
+        centers = feature_centers(geometry_dir / geojson, name_property, key)
+        centers = centers.drop_duplicates(key).set_index(key)
+        for column in ('centerLong', 'centerLat'):
+            df[column] = df[key].map(centers[column]).fillna(df[column])
+        df.to_csv(str(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data', default=str(DATA_DIR), help='directory with the tables')
+    args = parser.parse_args()
+    update_tables(Path(args.data), Path(args.data))
+
+
+if __name__ == '__main__':
+    main()
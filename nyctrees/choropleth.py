@@ -0,0 +1,109 @@
+"""Choropleth traces built at runtime from one copy of the area geometry.
+
+Replaces the per-bin GeoJSON files written by ``GeojsonFactory.ipynb``:
+the polygons are loaded once, keyed by their lowercase area name, and any
+metric column is turned into class indices with ``np.digitize``.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+from nyctrees.breaks import truncate
+from nyctrees.data import CACHE_DIR
+from nyctrees.lod import LEVEL_ZOOMS, cached_pyramid
+
+
+def load_geometry(path, name_property):
+    """Read a FeatureCollection, keep only geometry and set ``id`` to the
+    lowercase ``name_property`` (matching ``ntaname``/``borough`` in the
+    tables)."""
+    with open(path) as f:
+        collection = json.load(f)
+    features = []
+    for feature in collection['features']:
+        name = feature['properties'][name_property].lower()
+        features.append({
+            'type': 'Feature',
+            'id': name,
+            'properties': {'name': name},
+            'geometry': feature['geometry'],
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def classify(values, breaks, decimals=0):
+    """Class index of every value.
+
+    ``breaks`` are inclusive upper bounds, as in the old bin labels: with
+    breaks ``[500, 1000]`` values up to 500 are class 0, 501-1000 class 1
+    and everything above class 2. Values are truncated to ``decimals``
+    places first, as the notebook did with ``int(x)``.
+    """
+    return np.digitize(truncate(values, decimals), truncate(breaks, decimals), right=True)
+
+
+def stepped_colorscale(colors):
+    """Plotly colorscale that paints integer class ``i`` with ``colors[i]``."""
+    n = len(colors)
+    scale = []
+    for i, color in enumerate(colors):
+        scale.append([i / n, color])
+        scale.append([(i + 1) / n, color])
+    return scale
+
+
+class ChoroplethEngine:
+    """Geometry for one view (neighborhoods or boroughs) indexed by name.
+
+    If a :class:`~nyctrees.geoserve.GeoJSONStore` is given the geometry is
+    published there once and traces reference it by url, so the browser
+    downloads (and caches) it a single time for every metric. The geometry
+    is published as a level of detail pyramid (see :mod:`nyctrees.lod`);
+    traces pick the level matching the map zoom.
+    """
+
+    def __init__(self, path, name_property, store=None, store_name=None,
+                 zooms=LEVEL_ZOOMS, cache_dir=CACHE_DIR):
+        self.geojson = load_geometry(path, name_property)
+        self.names = [f['id'] for f in self.geojson['features']]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.lod = cached_pyramid(self.geojson, cache_dir, zooms)
+        self.store = store
+        self.store_name = store_name or Path(path).stem
+        if store is not None:
+            for level in range(len(self.lod.zooms)):
+                store.add(self.level_name(level), self.lod.dumps(level).encode())
+
+    def level_name(self, level):
+        return '{}.lod{}.geojson'.format(self.store_name, level)
+
+    def source(self, zoom=None):
+        level = len(self.lod.zooms) - 1 if zoom is None else self.lod.level_for_zoom(zoom)
+        if self.store is None:
+            return self.lod.geojson(level)
+        return self.store.url(self.level_name(level))
+
+    def trace(self, names, values, breaks, colors, opacity=0.8,
+              outline="#afafaf", zoom=None, decimals=0):
+        """A single ``choroplethmapbox`` trace coloring ``names`` by class.
+
+        Areas without a value are left out (drawn in no class), as on the
+        tiles, instead of falling into the top class.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        defined = np.isfinite(values)
+        classes = classify(values[defined], breaks, decimals)
+        return dict(
+            type="choroplethmapbox",
+            geojson=self.source(zoom),
+            featureidkey="id",
+            locations=[name for name, keep in zip(names, defined) if keep],
+            z=classes,
+            zmin=-0.5,
+            zmax=len(colors) - 0.5,
+            colorscale=stepped_colorscale(colors),
+            showscale=False,
+            hoverinfo="skip",
+            marker=dict(opacity=opacity, line=dict(color=outline, width=0.5)),
+        )
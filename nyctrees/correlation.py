@@ -0,0 +1,130 @@
+"""Correlations of area metrics for any selection, from sufficient statistics.
+
+Per area the engine keeps the centered metric vector and its outer
+product; the moments of a selection (n, sums, sums of products) are one
+masked sum, and the whole Pearson matrix follows from them. Spearman
+correlations re-rank the selection using each metric's precomputed sort
+order, so no sorting happens per selection either. Areas without every
+metric (missing in a year) are left out of every selection.
+"""
+import numpy as np
+
+
+def _pearson_from_moments(n, sums, products):
+    mean = sums / n
+    cov = products / n - np.outer(mean, mean)
+    std = np.sqrt(np.clip(np.diag(cov), 0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = cov / np.outer(std, std)
+    return np.clip(r, -1.0, 1.0)
+
+
+def _p_values(r, n):
+    """Two sided p-values of Pearson coefficients (as scipy.stats.pearsonr)."""
+    if n <= 2:
+        return np.ones_like(r)
+    # scipy.special imports far faster than scipy.stats, and only when needed
+    from scipy.special import stdtr
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt((n - 2) / (1.0 - r ** 2))
+    return 2 * stdtr(n - 2, -np.abs(t))
+
+
+def _average_ranks(sorted_values):
+    """1-based ranks of an already sorted array, ties sharing their mean rank."""
+    n = len(sorted_values)
+    starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    ends = np.r_[starts[1:], n]
+    return np.repeat((starts + ends + 1) / 2.0, ends - starts)
+
+
+class CorrelationEngine:
+    """Pearson and Spearman matrices of ``metrics`` for row masks of ``df``."""
+
+    def __init__(self, df, metrics):
+        self.metrics = list(metrics)
+        values = np.column_stack([np.asarray(df[m], dtype=np.float64) for m in self.metrics])
+        self.values = values
+        self.finite = np.isfinite(values).all(axis=1)
+        # centering keeps the sums of products well conditioned
+        self.center = (values[self.finite].mean(axis=0) if self.finite.any()
+                       else np.zeros(len(self.metrics)))
+        # rows with a missing metric add nothing to any sum
+        centered = np.where(self.finite[:, None], values - self.center, 0.0)
+        self.first = centered
+        self.second = centered[:, :, None] * centered[:, None, :]
+        self.order = np.argsort(values, axis=0, kind='stable')
+
+    def _rows(self, mask):
+        """``mask`` (all rows if None) without the rows missing a metric."""
+        return self.finite if mask is None else mask & self.finite
+
+    def moments(self, mask=None):
+        """(n, sums, sums of products) of the selected rows."""
+        if mask is None:
+            return int(self.finite.sum()), self.first.sum(axis=0), self.second.sum(axis=0)
+        mask = self._rows(mask)
+        weights = mask.astype(np.float64)
+        return (int(mask.sum()), weights.dot(self.first),
+                np.tensordot(weights, self.second, axes=1))
+
+    def pearson(self, mask=None):
+        """(r, p, n): correlation and p-value matrices and the row count."""
+        n, sums, products = self.moments(mask)
+        if n < 2:
+            k = len(self.metrics)
+            return np.full((k, k), np.nan), np.full((k, k), np.nan), n
+        r = _pearson_from_moments(n, sums, products)
+        return r, _p_values(r, n), n
+
+    def spearman(self, mask=None):
+        """Spearman correlation matrix of the selected rows."""
+        mask = self._rows(mask)
+        n = int(mask.sum())
+        k = len(self.metrics)
+        if n < 2:
+            return np.full((k, k), np.nan)
+        ranks = np.empty((n, k))
+        # position of every selected row among the selected rows
+        selected_rows = np.flatnonzero(mask)
+        slot = np.full(len(mask), -1)
+        slot[selected_rows] = np.arange(n)
+        for j in range(k):
+            order = self.order[:, j]
+            order = order[mask[order]]
+            ranks[slot[order], j] = _average_ranks(self.values[order, j])
+        return _pearson_from_moments(n, ranks.sum(axis=0), ranks.T.dot(ranks))
+
+    def annotations(self, mask=None, font=None, spearman=True):
+        """Scatter matrix annotations, one per off-diagonal cell.
+
+        Cell (row i, column j) of a plotly splom uses axes ``x{j+1}``/``y{i+1}``;
+        the text is placed in the top right of the selected data range.
+        """
+        r, p, n = self.pearson(mask)
+        if n < 2:
+            return []
+        rho = self.spearman(mask) if spearman else None
+        values = self.values[self._rows(mask)]
+        low, high = values.min(axis=0), values.max(axis=0)
+        anchor = low + 0.8 * (high - low)
+        ann = []
+        k = len(self.metrics)
+        for i in range(k):
+            for j in range(k):
+                if i == j:
+                    continue
+                text = "PCC: " + str(round(r[i, j], 2)) + "<br>p: " + '{:0.1e}'.format(p[i, j])
+                if rho is not None:
+                    text += "<br>SCC: " + str(round(rho[i, j], 2))
+                ann.append(dict(
+                    x=anchor[j],
+                    y=anchor[i],
+                    xref="x{}".format(j + 1),
+                    yref="y{}".format(i + 1),
+                    font=font,
+                    text=text,
+                    showarrow=False,
+                ))
+        return ann
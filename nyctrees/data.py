@@ -0,0 +1,213 @@
+"""Local-first loading of the dashboard tables.
+
+The CSV files in ``data/`` are the source of truth. The first start parses
+them into a typed columnar snapshot (``.npy`` files plus a ``meta.json``)
+under the cache directory; later starts memory-map the snapshot instead of
+parsing CSV, so no worker ever needs the network.
+
+Each run of numeric columns of one dtype is stored as one ``(columns,
+rows)`` array, which is the layout of a pandas block, and categorical
+columns as their codes in the dtype pandas keeps them in; the loaded
+frames wrap these memory maps without copying them. Only text columns
+(the hover labels) are decoded into Python strings.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = Path(os.environ.get('NYCTREES_DATA_DIR', ROOT_DIR / 'data'))
+CACHE_DIR = Path(os.environ.get('NYCTREES_CACHE_DIR', ROOT_DIR / '.cache'))
+
+# bump when the on-disk layout or the schemas below change
+SNAPSHOT_VERSION = 2
+
+# concat copies its inputs unless told not to; pandas 3 never copies
+# (copy-on-write) and deprecates the keyword
+_NO_COPY = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+
+# column name -> storage kind, per table
+SCHEMAS = {
+    'nta': ('Trees_Properties_With_Centroids.csv', {
+        'ntaname': 'category',
+        'borough': 'category',
+        'area': 'float32',
+        'health': 'float32',
+        'trees/sq.mile': 'float32',
+        'avg.landprice_thous$/acre': 'float32',
+        'avg.propvalue_thous$/acre': 'float32',
+        'properties/sq.mile': 'float32',
+        'centerLong': 'float64',
+        'centerLat': 'float64',
+        'hover': 'str',
+    }),
+    'boro': ('Trees_Properties_With_Centroids_Boro.csv', {
+        'borough': 'category',
+        'area': 'float32',
+        'health': 'float32',
+        'trees/sq.mile': 'float32',
+        'avg.landprice_thous$/acre': 'float32',
+        'properties/sq.mile': 'float32',
+        'centerLong': 'float64',
+        'centerLat': 'float64',
+        'hover': 'str',
+    }),
+    'species': ('GroupedTreesDataSpecies.csv', {
+        'ntaname': 'category',
+        'borough': 'category',
+        'spc_common': 'category',
+        'count': 'int32',
+        'area': 'float32',
+        'total': 'float32',
+        'spc_per': 'float32',
+    }),
+}
+
+
+class Snapshot:
+    """Typed tables loaded from one consistent version of ``data/``.
+
+    ``hash`` identifies the content of the source files and is what
+    derived caches should key on.
+    """
+
+    def __init__(self, tables, content_hash):
+        self.tables = tables
+        self.hash = content_hash
+
+    @property
+    def nta(self):
+        return self.tables['nta']
+
+    @property
+    def boro(self):
+        return self.tables['boro']
+
+    @property
+    def species(self):
+        return self.tables['species']
+
+
+def content_hash(data_dir=DATA_DIR):
+    """Hash of every source file plus the snapshot version."""
+    digest = hashlib.sha1(str(SNAPSHOT_VERSION).encode())
+    for name in sorted(SCHEMAS):
+        filename = SCHEMAS[name][0]
+        digest.update(filename.encode())
+        digest.update((Path(data_dir) / filename).read_bytes())
+    return digest.hexdigest()
+
+
+def _read_csv(path, schema):
+    df = pd.read_csv(path, usecols=list(schema))
+    return df[list(schema)]
+
+
+def _runs(schema):
+    """The columns of ``schema`` as [(kind, names)]: consecutive numeric
+    columns of one kind form one run, every other column a run of its own."""
+    runs = []
+    for column, kind in schema.items():
+        if runs and kind == runs[-1][0] and kind not in ('category', 'str'):
+            runs[-1][1].append(column)
+        else:
+            runs.append((kind, [column]))
+    return runs
+
+
+def _write_table(df, schema, table_dir):
+    table_dir.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for i, (kind, names) in enumerate(_runs(schema)):
+        entry = {'names': names, 'kind': kind, 'file': '{}.npy'.format(i)}
+        if kind == 'category':
+            cat = pd.Categorical(df[names[0]])
+            entry['categories'] = [str(c) for c in cat.categories]
+            array = np.asarray(cat.codes)
+        elif kind == 'str':
+            array = np.asarray(df[names[0]].astype(str).tolist(), dtype=np.str_)
+        else:
+            array = np.ascontiguousarray(df[names].to_numpy(dtype=kind).T)
+        np.save(str(table_dir / entry['file']), array)
+        entries.append(entry)
+    return entries
+
+
+def _read_table(table_dir, entries, mmap_mode):
+    frames = []
+    for entry in entries:
+        array = np.load(str(table_dir / entry['file']), mmap_mode=mmap_mode)
+        names = entry['names']
+        if entry['kind'] == 'category':
+            column = pd.Categorical.from_codes(array, categories=entry['categories'])
+            frames.append(pd.DataFrame({names[0]: column}, copy=False))
+        elif entry['kind'] == 'str':
+            frames.append(pd.DataFrame({names[0]: array.astype(object)}, copy=False))
+        else:
+            frames.append(pd.DataFrame(array.T, columns=names, copy=False))
+    return pd.concat(frames, axis=1, **_NO_COPY)
+
+
+def build_snapshot(data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """Parse the CSV files and write a fresh snapshot; returns its hash."""
+    data_dir, cache_dir = Path(data_dir), Path(cache_dir)
+    digest = content_hash(data_dir)
+    target = cache_dir / 'snapshot'
+    tmp = cache_dir / 'snapshot.{}.tmp'.format(os.getpid())
+    meta = {'version': SNAPSHOT_VERSION, 'hash': digest, 'tables': {}}
+    try:
+        for name, (filename, schema) in SCHEMAS.items():
+            df = _read_csv(data_dir / filename, schema)
+            meta['tables'][name] = _write_table(df, schema, tmp / name)
+        (tmp / 'meta.json').write_text(json.dumps(meta))
+
+        # swap the whole directory so concurrently booting workers never see
+        # a half written snapshot
+        if target.exists():
+            old = cache_dir / 'snapshot.{}.old'.format(os.getpid())
+            target.rename(old)
+            tmp.rename(target)
+            shutil.rmtree(str(old), ignore_errors=True)
+        else:
+            tmp.rename(target)
+    finally:
+        # left behind only when the build failed part way
+        shutil.rmtree(str(tmp), ignore_errors=True)
+    return digest
+
+
+def _read_meta(snapshot_dir):
+    try:
+        return json.loads((snapshot_dir / 'meta.json').read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def load_snapshot(data_dir=DATA_DIR, cache_dir=CACHE_DIR, mmap_mode='r'):
+    """Return a :class:`Snapshot`, building it first if it is stale."""
+    data_dir, cache_dir = Path(data_dir), Path(cache_dir)
+    snapshot_dir = cache_dir / 'snapshot'
+    digest = content_hash(data_dir)
+    meta = _read_meta(snapshot_dir)
+    if meta is None or meta.get('hash') != digest:
+        try:
+            build_snapshot(data_dir, cache_dir)
+        except OSError:
+            # another worker won the race to rename; use its snapshot
+            pass
+        meta = _read_meta(snapshot_dir)
+    if meta is None or meta.get('hash') != digest:
+        # read-only checkout: fall back to parsing the CSV files
+        tables = {name: _read_csv(data_dir / filename, schema).astype(
+            {c: ('object' if k == 'str' else k) for c, k in schema.items()})
+            for name, (filename, schema) in SCHEMAS.items()}
+        return Snapshot(tables, digest)
+
+    tables = {name: _read_table(snapshot_dir / name, entries, mmap_mode)
+              for name, entries in meta['tables'].items()}
+    return Snapshot(tables, digest)
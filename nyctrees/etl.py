@@ -0,0 +1,529 @@
+"""Rebuild the tables in data/ from the raw census files.
+
+Inputs are the 2015 street tree census (one row per tree, with the NTA
+name, borough and NTA ``shape_area`` joined in) and the Property Valuation
+and Assessment dataset (one row per lot and year). Both are split into
+byte ranges at line boundaries; worker processes parse their ranges with
+explicit dtypes and reduce them to per-(ntaname, borough[, species]) sums,
+which the parent adds up as they arrive. Memory stays bounded by the block
+size times the number of blocks in flight, whatever the input size; the
+individual trees, which do not reduce, go to one scratch file per block
+and are only gathered, as compact fixed point arrays, at the end.
+
+    python -m nyctrees.etl --trees 2015_carto_table.csv \\
+        --properties Property_Valuation_and_Assessment_Data.csv
+
+Lots without an NTA column are assigned to NTAs by their coordinates
+(:mod:`nyctrees.spatial`). Written are every table ``Map_test.py`` and the
+notebooks read (see ``OUTPUTS``) and, in a second pass over the same
+blocks, the hexagonal bins of the individual trees and geocoded lots
+(:mod:`nyctrees.hexbin`) and the trees themselves for the raster layer
+(:mod:`nyctrees.raster`). Every valuation year is also aggregated into
+the per year store of :mod:`nyctrees.timeseries`, each with the tree
+census of that year or the latest one before it (``--tree-census``; other
+censuses are read with the columns of the 2015 one, ``TREE_COLUMNS``).
+Fields are not expected to contain quoted line breaks.
+"""
+import argparse
+import csv
+import io
+import operator
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from nyctrees.centroids import feature_centers
+from nyctrees.data import DATA_DIR
+from nyctrees.hexbin import HEXBINS_FILE, RESOLUTIONS, HexBins, bin_points
+from nyctrees.raster import TREE_POINTS_FILE, TreePoints
+from nyctrees.timeseries import YEARS_DIR, write_years
+from nyctrees.spatial import SpatialJoin
+
+BLOCK_SIZE = 32 << 20
+SQFT_PER_SQMILE = 27878400
+HEALTH_LEVEL = {'good': 15, 'fair': 10, 'poor': 5, 'dead': 0}
+PROPERTY_YEAR = '2015/16'
+# year of the census given as --trees
+TREE_CENSUS_YEAR = 2015
+ZSCORE_LIMIT = 4
+# species of trees recorded without one (stumps, dead trees); they count
+# towards the NTA totals of the species table only
+NO_SPECIES = ''
+
+# column -> dtype, by lowercased header name
+TREE_COLUMNS = {
+    'ntaname': 'category',
+    'borough': 'category',
+    'spc_common': 'category',
+    'health': 'category',
+    'shape_area': 'float64',
+}
+PROPERTY_COLUMNS = {
+    'nta': 'category',
+    'borough': 'category',
+    'year': 'category',
+    'fullval': 'float64',
+    'avland': 'float64',
+    'avtot': 'float64',
+}
+# read instead of 'nta' when the lots only carry coordinates
+PROPERTY_COORDINATES = {
+    'latitude': 'float64',
+    'longitude': 'float64',
+}
+# read for the hexagonal bins of the individual trees
+TREE_POINT_COLUMNS = {
+    'spc_common': 'category',
+    'health': 'category',
+    'latitude': 'float64',
+    'longitude': 'float64',
+}
+
+OUTPUTS = (
+    'GroupedTreesData.csv',
+    'GroupedTreesDataSpecies.csv',
+    'GroupedPropertiesData.csv',
+    'MergedTreesPropertiesData.csv',
+    'MergedTreesPropertiesDataNoOutliers.csv',
+    'MergedTreesPropertiesDataBoro.csv',
+    'Trees_Properties_With_Centroids.csv',
+    'Trees_Properties_With_Centroids_Boro.csv',
+)
+
+
+# reading
+
+def read_header(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+
+def byte_ranges(path, block_size=BLOCK_SIZE):
+    """``(start, end)`` offsets covering the rows of ``path`` in whole lines."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + block_size, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_block(path, start, end, header, columns):
+    """Rows in ``[start, end)`` of ``path``, with ``columns`` (by lowercased
+    name) parsed to their dtypes and renamed to lowercase."""
+    actual = {name.lower(): name for name in header}
+    missing = [c for c in columns if c not in actual]
+    if missing:
+        raise ValueError('{}: missing columns {}'.format(path, ', '.join(missing)))
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(data), header=None, names=header,
+                     usecols=[actual[c] for c in columns],
+                     dtype={actual[c]: kind for c, kind in columns.items()})
+    return df.rename(columns={actual[c]: c for c in columns})
+
+
+def lower(values):
+    """Lowercase a categorical by its categories instead of its rows."""
+    cat = pd.Categorical(values)
+    if not len(cat.categories):
+        return cat
+    lowered, inverse = np.unique(np.asarray(cat.categories.str.lower(), dtype=object),
+                                 return_inverse=True)
+    codes = np.where(cat.codes >= 0, inverse[cat.codes], -1)
+    return pd.Categorical.from_codes(codes, categories=lowered)
+
+
+# per block sums
+
+def _sums(df, keys, columns):
+    grouped = df.groupby(keys, observed=True)
+    sums = grouped[columns].sum()
+    sums.insert(0, 'count', grouped.size())
+    # plain string levels, so blocks with other categories line up
+    sums.index = pd.MultiIndex.from_arrays(
+        [sums.index.get_level_values(i).astype(str) for i in range(len(keys))], names=keys)
+    return sums
+
+
+def tree_sums(path, start, end, header):
+    """Trees, NTA area and health points per (ntaname, borough, spc_common)."""
+    df = read_block(path, start, end, header, TREE_COLUMNS)
+    for column in ('ntaname', 'borough', 'spc_common', 'health'):
+        df[column] = lower(df[column])
+    # trees without a health rating are dead
+    health = df['health'].map(HEALTH_LEVEL).astype('float64')
+    df['health'] = health.where(df['health'].notna(), 0.0)
+    species = df['spc_common']
+    if NO_SPECIES not in species.cat.categories:
+        species = species.cat.add_categories([NO_SPECIES])
+    df['spc_common'] = species.fillna(NO_SPECIES)
+    df = df.dropna()
+    return _sums(df, ['ntaname', 'borough', 'spc_common'], ['shape_area', 'health'])
+
+
+_joins = {}
+
+
+def nta_join(path):
+    """The NTA :class:`SpatialJoin` of this process, built on first use."""
+    if path not in _joins:
+        _joins[path] = SpatialJoin.from_geojson(path, 'ntaname')
+    return _joins[path]
+
+
+def property_sums(path, start, end, header, year=PROPERTY_YEAR, nta_geojson=None):
+    """Lots and summed valuations per (ntaname, borough) for one year, or
+    per (year, ntaname, borough) for every year when ``year`` is None.
+
+    Without an NTA column the lots are joined to the NTA polygons of
+    ``nta_geojson`` by their coordinates.
+    """
+    columns = dict(PROPERTY_COLUMNS)
+    located = 'nta' not in {name.lower() for name in header}
+    if located:
+        del columns['nta']
+        columns.update(PROPERTY_COORDINATES)
+    df = read_block(path, start, end, header, columns)
+    df = (df if year is None else df[df['year'] == year]).dropna()
+    if located:
+        join = nta_join(str(nta_geojson))
+        index = join.locate(df['longitude'].values, df['latitude'].values)
+        df = df.drop(columns=['latitude', 'longitude'])
+        df['nta'] = join.names_of(index)
+        df = df.dropna()
+    df = df.rename(columns={'nta': 'ntaname'})
+    for column in ('ntaname', 'borough'):
+        df[column] = lower(df[column])
+    keys = ['ntaname', 'borough'] if year is not None else ['year', 'ntaname', 'borough']
+    return _sums(df, keys, ['fullval', 'avland', 'avtot'])
+
+
+def tree_points(path, start, end, header):
+    """Coordinates, health points and species of the trees with a species."""
+    df = read_block(path, start, end, header, TREE_POINT_COLUMNS)
+    # as in the NTA tables, only trees with a species count
+    df = df[df['spc_common'].notna()].dropna(subset=['latitude', 'longitude'])
+    health = pd.Series(lower(df['health'])).map(HEALTH_LEVEL).astype('float64')
+    return pd.DataFrame({
+        'longitude': df['longitude'].values,
+        'latitude': df['latitude'].values,
+        'health': health.fillna(0.0).values,
+        'spc_common': np.asarray(lower(df['spc_common']).astype(str)),
+    })
+
+
+def tree_point_block(path, start, end, header, scratch_dir):
+    """Writes the trees of one block (see :func:`tree_points`) to
+    ``scratch_dir`` as a :class:`TreePoints` file; returns
+    ``[(start, file, trees)]``."""
+    df = tree_points(path, start, end, header)
+    points = TreePoints.from_lonlat(df['longitude'].values, df['latitude'].values,
+                                    df['health'].values, df['spc_common'].values)
+    file = Path(scratch_dir) / '{}.npz'.format(start)
+    points.save(file)
+    return [(start, str(file), len(points))]
+
+
+def gather_tree_points(blocks):
+    """One :class:`TreePoints` of the block files of :func:`tree_point_block`,
+    filled in place one block at a time."""
+    blocks = sorted(blocks)
+    total = sum(trees for _, _, trees in blocks)
+    x, y = np.empty(total, dtype=np.uint32), np.empty(total, dtype=np.uint32)
+    health = np.empty(total, dtype=np.uint8)
+    species = np.empty(total, dtype=np.int16)
+    names = {}
+    position = 0
+    for _, file, trees in blocks:
+        part = TreePoints.load(file)
+        codes = np.array([names.setdefault(name, len(names)) for name in part.species_names] +
+                         [-1], dtype=np.int16)
+        rows = slice(position, position + trees)
+        x[rows], y[rows], health[rows] = part.x, part.y, part.health
+        # code -1 (no species) stays -1
+        species[rows] = codes[part.species]
+        position += trees
+    # species codes in name order, as a Categorical of every tree has them
+    order = list(names)
+    rank = np.full(len(order) + 1, -1, dtype=np.int16)
+    rank[np.argsort(order)] = np.arange(len(order))
+    return TreePoints(x, y, health, rank[species], sorted(order))
+
+
+def tree_cells(path, start, end, header, resolutions=RESOLUTIONS):
+    """Trees and health points per hexagon cell, at every resolution."""
+    df = tree_points(path, start, end, header)
+    return bin_points(df['longitude'].values, df['latitude'].values,
+                      {'trees': np.ones(len(df)), 'health': df['health'].values}, resolutions)
+
+
+def property_cells(path, start, end, header, year=PROPERTY_YEAR, resolutions=RESOLUTIONS):
+    """Lots and summed valuations per hexagon cell for one year."""
+    columns = {c: PROPERTY_COLUMNS[c] for c in ('year', 'fullval', 'avland')}
+    columns.update(PROPERTY_COORDINATES)
+    df = read_block(path, start, end, header, columns)
+    df = df[df['year'] == year].dropna()
+    return bin_points(df['longitude'].values, df['latitude'].values,
+                      {'lots': np.ones(len(df)), 'avland': df['avland'].values,
+                       'fullval': df['fullval'].values}, resolutions)
+
+
+def _add(total, part):
+    return total.add(part, fill_value=0)
+
+
+def aggregate(func, path, executor, block_size=BLOCK_SIZE, in_flight=None, combine=_add,
+              **kwargs):
+    """Sum (or another ``combine``) of ``func`` over every block of ``path``,
+    keeping at most ``in_flight`` blocks submitted at a time."""
+    header = read_header(path)
+    ranges = iter(byte_ranges(path, block_size))
+    in_flight = in_flight or 2 * (os.cpu_count() or 1)
+    pending = set()
+    total = None
+    while True:
+        for start, end in ranges:
+            pending.add(executor.submit(func, path, start, end, header, **kwargs))
+            if len(pending) >= in_flight:
+                break
+        if not pending:
+            return total
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            part = future.result()
+            total = part if total is None else combine(total, part)
+
+
+# tables
+
+def _drop_outliers(df, columns, limit=ZSCORE_LIMIT):
+    for column in columns:
+        values = df[column]
+        df = df[np.abs((values - values.mean()) / values.std(ddof=0)) <= limit]
+    return df
+
+
+def _hover(df, with_borough):
+    hover = df['ntaname'] + '<br>' + df['borough'] if with_borough else df['borough']
+    return (hover + '<br>trees/sq.mile: ' + df['trees/sq.mile'].round(2).astype(str) +
+            '<br>avg. landprice: ' + df['avg.landprice_thous$/acre'].round(2).astype(str) +
+            '<br>trees health: ' + df['health'].round(2).astype(str) + '/15')
+
+
+def build_tables(trees, properties, nta_geojson, boro_geojson):
+    """Every output table (see ``OUTPUTS``) from the summed blocks."""
+    tables = {}
+
+    species = trees.reset_index()
+    species['area'] = species['shape_area'] / species['count'] / SQFT_PER_SQMILE
+    species['total'] = species.groupby('ntaname')['count'].transform('sum')
+    species = species[species['spc_common'] != NO_SPECIES]
+    trees = trees[trees.index.get_level_values('spc_common') != NO_SPECIES]
+    species['spc_per'] = species['count'] / species['total'] * 100
+    species['count'] = species['count'].astype(np.int64)
+    species['total'] = species['total'].astype(np.int64)
+    tables['GroupedTreesDataSpecies.csv'] = species[
+        ['ntaname', 'borough', 'spc_common', 'count', 'area', 'total', 'spc_per']]
+
+    nta = trees.groupby(level=['ntaname', 'borough']).sum().reset_index()
+    nta['shape_area'] = nta['shape_area'] / nta['count'] / SQFT_PER_SQMILE
+    nta['health'] = nta['health'] / nta['count']
+    nta['trees/sq.mile'] = nta['count'] / nta['shape_area']
+    nta['count'] = nta['count'].astype(np.int64)
+    tables['GroupedTreesData.csv'] = nta
+
+    lots = properties.reset_index()
+    for column in ('fullval', 'avland', 'avtot'):
+        lots[column] = lots[column] / lots['count']
+    lots['count'] = lots['count'].astype(np.int64)
+    lots = lots.rename(columns={'avland': 'avg.land value/acre', 'fullval': 'property value'})
+    tables['GroupedPropertiesData.csv'] = lots[
+        ['ntaname', 'borough', 'count', 'avg.land value/acre', 'property value', 'avtot']]
+
+    prices = tables['GroupedPropertiesData.csv'].rename(columns={
+        'avg.land value/acre': 'avg.landprice_thous$/acre',
+        'property value': 'avg.propvalue_thous$/acre'})
+    prices['avg.landprice_thous$/acre'] /= 1000
+    prices['avg.propvalue_thous$/acre'] /= 1000
+    merged = pd.merge(nta, prices, on='ntaname', how='outer').rename(columns={
+        'borough_x': 'borough', 'shape_area': 'area', 'count_x': '#trees',
+        'count_y': '#properties'})
+    merged = merged.dropna().reset_index(drop=True)
+    merged['properties/sq.mile'] = merged['#properties'] / merged['area']
+    # downstream tables are derived from the file as written
+    merged = merged.round(2)
+    tables['MergedTreesPropertiesData.csv'] = merged
+
+    clean = merged.drop(columns=['#trees', 'borough_y', '#properties', 'avtot'])
+    clean = _drop_outliers(clean, ['health', 'trees/sq.mile', 'avg.landprice_thous$/acre',
+                                   'properties/sq.mile'])
+    clean = clean[clean['avg.landprice_thous$/acre'] > 0]
+    tables['MergedTreesPropertiesDataNoOutliers.csv'] = clean
+
+    boro = clean.groupby('borough').agg({
+        'area': 'sum', 'health': 'mean', 'trees/sq.mile': 'mean',
+        'avg.landprice_thous$/acre': 'mean', 'properties/sq.mile': 'mean'})
+    tables['MergedTreesPropertiesDataBoro.csv'] = boro
+
+    # one center per name (the first feature's, as nyctrees.centroids
+    # update_tables does), so a name on several features adds no rows
+    centers = ['centerLong', 'centerLat']
+    nta_centers = feature_centers(nta_geojson, 'ntaname', 'ntaname').drop_duplicates('ntaname')
+    with_centers = pd.merge(clean, nta_centers[['ntaname'] + centers],
+                            how='left', on='ntaname', validate='many_to_one').dropna()
+    with_centers['hover'] = _hover(with_centers, with_borough=True)
+    tables['Trees_Properties_With_Centroids.csv'] = with_centers.reset_index(drop=True)
+
+    boro_centers = feature_centers(boro_geojson, 'boro_name', 'borough').drop_duplicates('borough')
+    boro_centers = pd.merge(boro.reset_index(), boro_centers[['borough'] + centers],
+                            how='left', on='borough', validate='many_to_one').dropna()
+    boro_centers['hover'] = _hover(boro_centers, with_borough=False)
+    tables['Trees_Properties_With_Centroids_Boro.csv'] = boro_centers.reset_index(drop=True)
+    return tables
+
+
+def year_tables(by_year, census, nta_geojson, boro_geojson):
+    """Area tables of every valuation year of ``by_year``, each built with
+    the tree census (year -> tree sums) of its year or the latest before it."""
+    views = {'neighborhoods': {}, 'boroughs': {}}
+    for label in sorted(by_year.index.get_level_values('year').unique()):
+        start = int(re.match(r'\d{4}', label).group())
+        earlier = [year for year in census if year <= start]
+        trees = census[max(earlier) if earlier else min(census)]
+        tables = build_tables(trees, by_year.xs(label, level='year'), nta_geojson, boro_geojson)
+        views['neighborhoods'][label] = tables['Trees_Properties_With_Centroids.csv'].set_index(
+            'ntaname')
+        views['boroughs'][label] = tables['Trees_Properties_With_Centroids_Boro.csv'].set_index(
+            'borough')
+    return views
+
+
+def write_tables(tables, out_dir=DATA_DIR):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for filename, df in tables.items():
+        kwargs = {}
+        if filename in ('GroupedTreesData.csv', 'GroupedTreesDataSpecies.csv',
+                        'GroupedPropertiesData.csv'):
+            kwargs['index'] = False
+        elif filename == 'MergedTreesPropertiesData.csv':
+            kwargs['float_format'] = '%.2f'
+        df.to_csv(str(out_dir / filename), **kwargs)
+
+
+def has_coordinates(path):
+    return set(PROPERTY_COORDINATES) <= {name.lower() for name in read_header(path)}
+
+
+def rebuild(trees_path, properties_path, out_dir=DATA_DIR, geometry_dir=DATA_DIR,
+            workers=None, block_size=BLOCK_SIZE, year=PROPERTY_YEAR, hexbins=True,
+            points=True, years=True, tree_census=None):
+    """Aggregate both sources in parallel and write every output table, the
+    hexagonal bins unless ``hexbins`` is false, the tree points unless
+    ``points`` is false and the per year store unless ``years`` is false.
+
+    ``tree_census`` maps the years of other tree censuses to their files,
+    which need the columns of the 2015 census (``TREE_COLUMNS``).
+    """
+    for path in (tree_census or {}).values():
+        missing = set(TREE_COLUMNS) - {name.lower() for name in read_header(path)}
+        if missing:
+            raise ValueError('{} lacks the tree census columns {}'.format(
+                path, ', '.join(sorted(missing))))
+    nta_geojson = Path(geometry_dir) / 'NeighborhoodTabulationAreas.geojson'
+    boro_geojson = Path(geometry_dir) / 'BoroughBoundaries.geojson'
+    cells = []
+    trees_points = None
+    by_year = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        trees = aggregate(tree_sums, trees_path, executor, block_size)
+        if years:
+            # one pass for every year; the tables take theirs from it
+            by_year = aggregate(property_sums, properties_path, executor, block_size,
+                                year=None, nta_geojson=nta_geojson)
+            properties = by_year.xs(year, level='year')
+            census = {TREE_CENSUS_YEAR: trees}
+            for census_year, path in (tree_census or {}).items():
+                census[census_year] = aggregate(tree_sums, path, executor, block_size)
+        else:
+            properties = aggregate(property_sums, properties_path, executor, block_size,
+                                   year=year, nta_geojson=nta_geojson)
+        if hexbins:
+            cells.append(aggregate(tree_cells, trees_path, executor, block_size))
+            # lots without coordinates cannot be binned
+            if has_coordinates(properties_path):
+                cells.append(aggregate(property_cells, properties_path, executor,
+                                       block_size, year=year))
+        if points:
+            scratch_dir = tempfile.mkdtemp(prefix='treepoints.')
+            try:
+                blocks = aggregate(tree_point_block, trees_path, executor, block_size,
+                                   combine=operator.add, scratch_dir=scratch_dir)
+                trees_points = gather_tree_points(blocks or [])
+            finally:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+    tables = build_tables(trees, properties, nta_geojson, boro_geojson)
+    write_tables(tables, out_dir)
+    if by_year is not None:
+        write_years(Path(out_dir) / YEARS_DIR,
+                    year_tables(by_year, census, nta_geojson, boro_geojson), current=year)
+    if cells:
+        sums = cells[0] if len(cells) == 1 else cells[0].add(cells[1], fill_value=0)
+        HexBins.from_sums(sums.fillna(0)).save(Path(out_dir) / HEXBINS_FILE)
+    if trees_points is not None:
+        trees_points.save(Path(out_dir) / TREE_POINTS_FILE)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--trees', required=True, help='2015 street tree census csv')
+    parser.add_argument('--properties', required=True,
+                        help='Property Valuation and Assessment Data csv')
+    parser.add_argument('--out', default=str(DATA_DIR), help='output directory')
+    parser.add_argument('--geometry', default=str(DATA_DIR),
+                        help='directory with the NTA and borough geojson files')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE >> 20, metavar='MB',
+                        help='bytes of csv per task, in MB')
+    parser.add_argument('--year', default=PROPERTY_YEAR, help='valuation year to keep')
+    parser.add_argument('--no-hexbins', action='store_true',
+                        help='skip the hexagonal bins of the individual points')
+    parser.add_argument('--no-points', action='store_true',
+                        help='skip the tree points of the raster layer')
+    parser.add_argument('--no-years', action='store_true',
+                        help='skip the per year store of every valuation year')
+    parser.add_argument('--tree-census', action='append', default=[], metavar='YEAR=CSV',
+                        help='another tree census with the columns of the 2015 one, '
+                             'for the years it covers')
+    args = parser.parse_args()
+
+    tree_census = {}
+    for item in args.tree_census:
+        census_year, _, path = item.partition('=')
+        tree_census[int(census_year)] = path
+    tables = rebuild(args.trees, args.properties, args.out, args.geometry,
+                     workers=args.workers, block_size=args.block_size << 20, year=args.year,
+                     hexbins=not args.no_hexbins, points=not args.no_points,
+                     years=not args.no_years, tree_census=tree_census)
+    for filename, df in tables.items():
+        print('{:45} {:>7} rows'.format(filename, len(df)))
+
+
+if __name__ == '__main__':
+    main()
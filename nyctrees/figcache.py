@@ -0,0 +1,122 @@
+"""Rendered map figures, shared by every request with the same inputs.
+
+``display_map`` only depends on its inputs (the view, the feature, the
+year and the overlay) and, through the level of detail, the zoom bucket;
+the map center and zoom it echoes back and the host in the layer urls are
+the only per-request parts. The cache renders each combination once and
+keeps it JSON encoded with placeholders for those parts; a hit splices
+the JSON encoded request values into the template.
+
+The lookup runs inside the callback, so Dash's dispatch, validation and
+instrumentation all still apply, but the callback returns a small stand-in
+for the figure. The response hook of :meth:`FigureCache.install` replaces
+the stand-in in the encoded response by the filled in template, so a hit
+neither decodes the template nor has Dash encode the figure again.
+"""
+import json
+import re
+import uuid
+
+import plotly
+from flask import g, has_request_context
+
+from nyctrees.cache import LRUCache
+
+ROOT = 'http://__root__'
+CENTER = '__center__'
+ZOOM = '__zoom__'
+# the callback's stand-in for an encoded figure: {SPLICE: token}
+SPLICE = '__encoded_figure__'
+
+# what display_map falls back to when the map has no layout yet
+DEFAULT_CENTER = {'lat': (40.7342,), 'lon': (-73.91251,)}
+DEFAULT_ZOOM = 10
+
+
+def map_view(figure):
+    """(center, zoom) of the map figure sent back as callback state."""
+    if figure and "layout" in figure:
+        mapbox = figure["layout"]["mapbox"]
+        return ({'lat': mapbox["center"]["lat"], 'lon': mapbox["center"]["lon"]},
+                mapbox["zoom"])
+    return DEFAULT_CENTER, DEFAULT_ZOOM
+
+
+class FigureCache:
+    """Bounded cache of encoded ``build(*args, figure)`` results.
+
+    ``build`` runs in a request context of ``server`` whose root url is a
+    placeholder; ``zoom_bucket`` maps a zoom to the bucket it renders
+    identically in; ``version`` (the data snapshot hash) is part of every
+    key.
+    """
+
+    def __init__(self, server, build, zoom_bucket, version='', maxsize=64):
+        self.server = server
+        self.build = build
+        self.zoom_bucket = zoom_bucket
+        self.version = version
+        self.cache = LRUCache(maxsize)
+        self.installed = False
+
+    def key(self, args, zoom):
+        return (self.version,) + tuple(args) + (self.zoom_bucket(zoom),)
+
+    def _render(self, args, zoom):
+        state = {'layout': {'mapbox': {'center': {'lat': 0, 'lon': 0}, 'zoom': zoom}}}
+        with self.server.test_request_context(base_url=ROOT):
+            figure = self.build(*args, state)
+        figure["layout"]["mapbox"]["center"] = CENTER
+        figure["layout"]["mapbox"]["zoom"] = ZOOM
+        return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+
+    def template(self, args, zoom):
+        return self.cache.get_or_compute(self.key(args, zoom),
+                                         lambda: self._render(args, zoom))
+
+    def encoded(self, args, figure, url_root):
+        """JSON text of the figure for input values ``args``, the map
+        ``figure`` (state) and the request's ``url_root``."""
+        center, zoom = map_view(figure)
+        body = self.template(args, zoom)
+        body = body.replace(json.dumps(CENTER), json.dumps(center))
+        body = body.replace(json.dumps(ZOOM), json.dumps(zoom))
+        # the root sits inside url strings: spliced as an escaped string body
+        root = json.dumps(url_root.rstrip('/'))[1:-1]
+        return body.replace(ROOT, root)
+
+    def figure(self, args, figure, url_root):
+        """What the callback returns: in a request of an installed cache the
+        stand-in its response hook replaces by :meth:`encoded`, elsewhere
+        the decoded figure."""
+        body = self.encoded(args, figure, url_root)
+        if not (self.installed and has_request_context()):
+            return json.loads(body)
+        token = uuid.uuid4().hex
+        g.setdefault('encoded_figures', {})[token] = body
+        return {SPLICE: token}
+
+    def install(self):
+        """Splice the encoded figures into the responses of ``server``.
+
+        Flask runs the last registered response hook first: install after
+        anything that should see the final body (e.g. response metrics).
+        """
+        def splice(response):
+            figures = g.pop('encoded_figures', None)
+            if figures:
+                data = response.get_data(as_text=True)
+                for token, body in figures.items():
+                    stand_in = r'\{\s*"%s"\s*:\s*"%s"\s*\}' % (SPLICE, token)
+                    data = re.sub(stand_in, lambda _: body, data, count=1)
+                response.set_data(data)
+            return response
+
+        self.server.after_request(splice)
+        self.installed = True
+
+    def warm(self, inputs, zooms):
+        """Render every tuple of input values in ``inputs`` at ``zooms``."""
+        for args in inputs:
+            for zoom in zooms:
+                self.template(args, zoom)
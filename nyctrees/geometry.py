@@ -0,0 +1,196 @@
+"""Vectorized planar geometry on flat edge arrays.
+
+Polygons are handled as bags of directed edges (``x0, y0, x1, y1``) with
+an ``owner`` array saying which polygon each edge belongs to. Even-odd
+ray casting over all edges of a polygon treats exterior rings, holes and
+the parts of a MultiPolygon uniformly.
+"""
+import numpy as np
+
+
+def ring_edges(rings):
+    """Edges of a list of closed ``(n, 2)`` rings as four flat arrays."""
+    if not rings:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty
+    starts = np.concatenate([ring[:-1] for ring in rings])
+    ends = np.concatenate([ring[1:] for ring in rings])
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+class EdgeSet:
+    """Edges of many polygons; ``owner[i]`` is the polygon of edge ``i``."""
+
+    def __init__(self, polygons):
+        x0, y0, x1, y1, owner = [], [], [], [], []
+        bboxes = np.full((len(polygons), 4), np.nan)
+        for i, rings in enumerate(polygons):
+            if not rings:
+                continue
+            ex0, ey0, ex1, ey1 = ring_edges(rings)
+            x0.append(ex0)
+            y0.append(ey0)
+            x1.append(ex1)
+            y1.append(ey1)
+            owner.append(np.full(len(ex0), i, dtype=np.int64))
+            bboxes[i] = (ex0.min(), ey0.min(), ex0.max(), ey0.max())
+        cat = (lambda parts, dtype=np.float64:
+               np.concatenate(parts) if parts else np.zeros(0, dtype=dtype))
+        self.x0, self.y0, self.x1, self.y1 = cat(x0), cat(y0), cat(x1), cat(y1)
+        self.owner = cat(owner, np.int64)
+        self.bboxes = bboxes
+        self.count = len(polygons)
+
+    def subset(self, keep):
+        """Indices of the edges whose owner is set in the boolean ``keep``."""
+        return np.flatnonzero(keep[self.owner])
+
+
+def crossings(px, py, x0, y0, x1, y1):
+    """(points x edges) matrix of "a ray from the point towards +x crosses
+    the edge"."""
+    px, py = px[:, None], py[:, None]
+    straddle = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xcross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return straddle & (px < xcross)
+
+
+def points_in_polygon(px, py, x0, y0, x1, y1, chunk=4096):
+    """Even-odd point in polygon test of every point against one edge set."""
+    px = np.asarray(px, dtype=np.float64)
+    py = np.asarray(py, dtype=np.float64)
+    inside = np.zeros(len(px), dtype=bool)
+    for start in range(0, len(px), chunk):
+        sl = slice(start, start + chunk)
+        inside[sl] = crossings(px[sl], py[sl], x0, y0, x1, y1).sum(axis=1) % 2 == 1
+    return inside
+
+
+def point_in_polygons(px, py, edges, edge_index=None):
+    """Whether the single point ``(px, py)`` lies in each polygon of ``edges``."""
+    if edge_index is None:
+        edge_index = np.arange(len(edges.owner))
+    hit = crossings(np.array([px], dtype=np.float64), np.array([py], dtype=np.float64),
+                    edges.x0[edge_index], edges.y0[edge_index],
+                    edges.x1[edge_index], edges.y1[edge_index])[0]
+    counts = np.bincount(edges.owner[edge_index][hit], minlength=edges.count)
+    return counts % 2 == 1
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def expand(lo, hi):
+    """(owner, value) pairs for every integer in the inclusive ranges
+    ``lo[i]..hi[i]``."""
+    counts = hi - lo + 1
+    owner = np.repeat(np.arange(len(lo)), counts)
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, lo[owner] + step
+
+
+def _segment_cells(x0, y0, x1, y1, origin, size, n):
+    """(segment, cell) pairs of the cells of an ``n`` x ``n`` grid that the
+    bounding box of every segment overlaps."""
+    def span(lo, hi, axis):
+        return [np.clip((v - origin[axis]) // size[axis], 0, n - 1).astype(np.int64)
+                for v in (lo, hi)]
+    cx0, cx1 = span(np.minimum(x0, x1), np.maximum(x0, x1), 0)
+    cy0, cy1 = span(np.minimum(y0, y1), np.maximum(y0, y1), 1)
+    segment, cell_x = expand(cx0, cx1)
+    span_of, cell_y = expand(cy0[segment], cy1[segment])
+    return segment[span_of], cell_y * n + cell_x[span_of]
+
+
+def segments_cross(a, b, cells=64):
+    """For every segment of ``b`` whether it properly crosses any of ``a``.
+
+    ``a`` and ``b`` are ``(x0, y0, x1, y1)`` tuples of flat arrays. Both
+    go into a ``cells`` x ``cells`` grid over the bounding box of ``a`` by
+    their bounding boxes, and only pairs sharing a cell are tested, so the
+    work grows with the segments near each other rather than with
+    ``len(a) * len(b)``.
+    """
+    ax0, ay0, ax1, ay1 = (np.asarray(v, dtype=np.float64) for v in a)
+    bx0, by0, bx1, by1 = (np.asarray(v, dtype=np.float64) for v in b)
+    result = np.zeros(len(bx0), dtype=bool)
+    if not len(ax0) or not len(bx0):
+        return result
+    xmin, xmax = min(ax0.min(), ax1.min()), max(ax0.max(), ax1.max())
+    ymin, ymax = min(ay0.min(), ay1.min()), max(ay0.max(), ay1.max())
+    near = np.flatnonzero((np.maximum(bx0, bx1) >= xmin) & (np.minimum(bx0, bx1) <= xmax) &
+                          (np.maximum(by0, by1) >= ymin) & (np.minimum(by0, by1) <= ymax))
+    origin = (xmin, ymin)
+    size = ((xmax - xmin) / cells or 1.0, (ymax - ymin) / cells or 1.0)
+
+    # segments of a by cell, as CSR
+    segment, cell = _segment_cells(ax0, ay0, ax1, ay1, origin, size, cells)
+    order = np.argsort(cell, kind='stable')
+    a_by_cell = segment[order]
+    offsets = np.searchsorted(cell[order], np.arange(cells * cells + 1))
+
+    # every (b, a) pair sharing a cell; a pair sharing several is tested twice
+    edge, cell = _segment_cells(bx0[near], by0[near], bx1[near], by1[near],
+                                origin, size, cells)
+    pair, position = expand(offsets[cell], offsets[cell + 1] - 1)
+    i, j = near[edge[pair]], a_by_cell[position]
+    d1 = _orientation(ax0[j], ay0[j], ax1[j], ay1[j], bx0[i], by0[i])
+    d2 = _orientation(ax0[j], ay0[j], ax1[j], ay1[j], bx1[i], by1[i])
+    d3 = _orientation(bx0[i], by0[i], bx1[i], by1[i], ax0[j], ay0[j])
+    d4 = _orientation(bx0[i], by0[i], bx1[i], by1[i], ax1[j], ay1[j])
+    result[i[(d1 * d2 < 0) & (d3 * d4 < 0)]] = True
+    return result
+
+
+class GridIndex:
+    """Uniform grid over bounding boxes ``(xmin, ymin, xmax, ymax)``.
+
+    Each cell lists the boxes overlapping it; a query returns the ids of
+    the boxes in the cells it touches (a superset of the true hits).
+    """
+
+    def __init__(self, bboxes, shape=(32, 32)):
+        bboxes = np.asarray(bboxes, dtype=np.float64)
+        valid = ~np.isnan(bboxes).any(axis=1)
+        self.bboxes = bboxes
+        self.nx, self.ny = shape
+        self.xmin, self.ymin = bboxes[valid, 0].min(), bboxes[valid, 1].min()
+        xmax, ymax = bboxes[valid, 2].max(), bboxes[valid, 3].max()
+        self.dx = (xmax - self.xmin) / self.nx or 1.0
+        self.dy = (ymax - self.ymin) / self.ny or 1.0
+        ids, cells = [], []
+        for i in np.flatnonzero(valid):
+            (cx0, cy0), (cx1, cy1) = self._cells(bboxes[i, :2]), self._cells(bboxes[i, 2:])
+            xs, ys = np.meshgrid(np.arange(cx0, cx1 + 1), np.arange(cy0, cy1 + 1))
+            cells.append((ys * self.nx + xs).ravel())
+            ids.append(np.full(cells[-1].size, i, dtype=np.int64))
+        cells = np.concatenate(cells)
+        ids = np.concatenate(ids)
+        order = np.argsort(cells, kind='stable')
+        self.ids = ids[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(self.nx * self.ny + 1))
+
+    def _cells(self, xy):
+        cx = int(np.clip((xy[0] - self.xmin) // self.dx, 0, self.nx - 1))
+        cy = int(np.clip((xy[1] - self.ymin) // self.dy, 0, self.ny - 1))
+        return cx, cy
+
+    def cell_of(self, x, y):
+        """Cell number of every point, -1 outside the grid."""
+        cx = np.floor((np.asarray(x) - self.xmin) / self.dx).astype(np.int64)
+        cy = np.floor((np.asarray(y) - self.ymin) / self.dy).astype(np.int64)
+        outside = (cx < 0) | (cx >= self.nx) | (cy < 0) | (cy >= self.ny)
+        return np.where(outside, -1, cy * self.nx + cx)
+
+    def query(self, bbox):
+        """Ids of the boxes that may overlap ``bbox``."""
+        xmin, ymin, xmax, ymax = bbox
+        (cx0, cy0), (cx1, cy1) = self._cells((xmin, ymin)), self._cells((xmax, ymax))
+        found = [self.ids[self.offsets[cy * self.nx + cx0]:self.offsets[cy * self.nx + cx1 + 1]]
+                 for cy in range(cy0, cy1 + 1)]
+        found = np.unique(np.concatenate(found)) if found else np.zeros(0, np.int64)
+        b = self.bboxes[found]
+        overlap = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        return found[overlap]
@@ -0,0 +1,162 @@
+"""Serve the choropleth GeoJSON layers from the Dash Flask server.
+
+Documents (files below ``subdirs`` of ``data/``, or geometry published
+with :meth:`GeoJSONStore.add`) are compressed once (gzip always, brotli
+when the ``brotli`` package is installed) and kept in memory. Responses carry a
+strong ETag and a long ``Cache-Control``; urls built by
+:meth:`GeoJSONStore.url` embed the ETag so a changed file gets a new url.
+"""
+import hashlib
+import threading
+import zlib
+from pathlib import Path
+
+from flask import Response, abort, has_request_context, request
+
+from nyctrees.data import CACHE_DIR, DATA_DIR
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+def _gzip(raw):
+    # zlib with a gzip header gives byte-identical output on every run,
+    # unlike gzip.compress which stamps the current time
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def _brotli(raw):
+    return brotli.compress(raw, quality=9)
+
+
+ENCODERS = {'gzip': _gzip}
+if brotli is not None:
+    ENCODERS['br'] = _brotli
+
+
+class GeoJSONStore:
+    """In-memory GeoJSON documents, plus every ``*.geojson`` below ``subdirs``."""
+
+    def __init__(self, data_dir=DATA_DIR, subdirs=(),
+                 cache_dir=CACHE_DIR, url_prefix='/geojson/'):
+        self.url_prefix = url_prefix
+        self.cache_dir = Path(cache_dir) / 'geojson'
+        self._files = {}
+        self._encoded = {}
+        self._lock = threading.Lock()
+        data_dir = Path(data_dir)
+        for subdir in subdirs:
+            for path in sorted((data_dir / subdir).rglob('*.geojson')):
+                if '.ipynb_checkpoints' in path.parts:
+                    continue
+                raw = path.read_bytes()
+                name = path.relative_to(data_dir).as_posix()
+                self._files[name] = (raw, hashlib.sha1(raw).hexdigest())
+
+    def add(self, name, raw):
+        """Publish an in-memory document under ``name``."""
+        self._files[name] = (raw, hashlib.sha1(raw).hexdigest())
+        for encoding in ENCODERS:
+            self._encoded.pop((name, encoding), None)
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def etag(self, name):
+        return self._files[name][1]
+
+    def url(self, name):
+        """Absolute, cache-busting url of ``name`` (e.g. ``BoroughBoundaries.geojson``)."""
+        path = '{}{}?v={}'.format(self.url_prefix, name, self.etag(name)[:12])
+        if has_request_context():
+            # mapbox fetches sources from a web worker, so relative urls
+            # do not resolve
+            return request.url_root.rstrip('/') + path
+        return path
+
+    def body(self, name, encoding=None):
+        raw, digest = self._files[name]
+        if encoding is None:
+            return raw
+        key = (name, encoding)
+        if key not in self._encoded:
+            with self._lock:
+                if key not in self._encoded:
+                    self._encoded[key] = self._compress(raw, digest, encoding)
+        return self._encoded[key]
+
+    def _compress(self, raw, digest, encoding):
+        cached = self.cache_dir / '{}.{}'.format(digest, encoding)
+        try:
+            return cached.read_bytes()
+        except OSError:
+            pass
+        body = ENCODERS[encoding](raw)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = cached.with_suffix('.tmp')
+            tmp.write_bytes(body)
+            tmp.replace(cached)
+        except OSError:
+            pass
+        return body
+
+    def warm(self):
+        """Compress everything up front (e.g. before gunicorn forks)."""
+        for name in self._files:
+            for encoding in ENCODERS:
+                self.body(name, encoding)
+
+
+def _pick_encoding(accept_encoding, offered=('br', 'gzip')):
+    """The first of the ``offered`` encodings the client accepts, or None."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token.strip().lower()] = q
+    for encoding in offered:
+        if encoding in ENCODERS and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def register_geojson_route(server, store):
+    """Add ``<store.url_prefix><path>`` to the Flask ``server``."""
+
+    def serve_geojson(name):
+        if name not in store:
+            abort(404)
+        encoding = _pick_encoding(request.headers.get('Accept-Encoding', ''))
+        # strong validators must differ between encoded representations
+        etag = store.etag(name)
+        if encoding is not None:
+            etag += '-' + encoding
+        headers = {
+            'ETag': '"{}"'.format(etag),
+            'Cache-Control': 'public, max-age={}'.format(ONE_YEAR),
+            'Vary': 'Accept-Encoding',
+            'Access-Control-Allow-Origin': '*',
+        }
+        if etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return Response(store.body(name, encoding), headers=headers,
+                        mimetype='application/geo+json')
+
+    server.add_url_rule(store.url_prefix + '<path:name>', 'serve_geojson',
+                        serve_geojson)
@@ -0,0 +1,262 @@
+"""Hexagonal bins of individual trees and tax lots at several resolutions.
+
+Cells are pointy-top hexagons on the web mercator plane of
+:mod:`nyctrees.tiles`. At resolution ``r`` the circumradius of a cell is
+``HEX_PIXELS`` pixels of a 512px tile at zoom ``r``: every resolution
+halves the cell size of the one before it, and cells drawn at the
+resolution matching the zoom always look the same size. Cells of
+neighboring resolutions do not nest exactly; the parent of a cell is the
+coarser cell containing its center (:func:`parent`).
+
+A :class:`HexBins` store keeps, per resolution, the sorted ids of the
+occupied cells and their sums (``SUMS``) in parallel arrays, written as
+one ``.npz`` by :mod:`nyctrees.etl`. :class:`HexTileLayer` serves a metric
+of the cells as vector tiles, so a map only ever receives the cells of
+the tiles in view.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from nyctrees.choropleth import classify
+from nyctrees.tiles import EXTENT, encode_layer, lonlat_to_world
+
+RESOLUTIONS = tuple(range(8, 17))
+HEX_PIXELS = 12
+HEXBINS_FILE = 'hexbins.npz'
+
+# per cell: trees, summed health points, lots, summed land and full values
+SUMS = ('trees', 'health', 'lots', 'avland', 'fullval')
+
+SQRT3 = math.sqrt(3.0)
+EARTH_CIRCUMFERENCE_MILES = 24901.46
+# axial coordinates are stored offset, two 32 bit halves of one int64
+OFFSET = 1 << 30
+# corners of a unit pointy-top hexagon, in the order of an exterior ring of a
+# tile (positive area with y pointing south)
+CORNERS = np.array([[math.cos(math.radians(a)), math.sin(math.radians(a))]
+                    for a in range(30, 390, 60)])
+
+
+def cell_size(resolution):
+    """Circumradius of the cells of ``resolution``, in world units."""
+    return HEX_PIXELS / (512.0 * 2 ** resolution)
+
+
+def pack(q, r):
+    return ((np.asarray(q, dtype=np.int64) + OFFSET) << 32) | (
+        np.asarray(r, dtype=np.int64) + OFFSET)
+
+
+def unpack(cells):
+    cells = np.asarray(cells, dtype=np.int64)
+    return (cells >> 32) - OFFSET, (cells & 0xFFFFFFFF) - OFFSET
+
+
+def world_cells(x, y, resolution):
+    """Ids of the cells containing the world points ``x``, ``y``."""
+    size = cell_size(resolution)
+    q = (SQRT3 / 3 * np.asarray(x) - np.asarray(y) / 3) / size
+    r = 2.0 / 3 * np.asarray(y) / size
+    s = -q - r
+    # round in cube coordinates and fix the component that moved most
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return pack(rq, rr)
+
+
+def lonlat_cells(lon, lat, resolution):
+    """Ids of the cells containing the points ``lon``, ``lat`` (degrees)."""
+    world = lonlat_to_world(np.column_stack([lon, lat]).astype(np.float64))
+    return world_cells(world[:, 0], world[:, 1], resolution)
+
+
+def cell_centers(cells, resolution):
+    """World coordinates of the centers of ``cells``, as an ``(n, 2)`` array."""
+    q, r = unpack(cells)
+    size = cell_size(resolution)
+    return np.column_stack([size * SQRT3 * (q + r / 2.0), size * 1.5 * r])
+
+
+def parent(cells, resolution, parent_resolution):
+    """Cells of ``parent_resolution`` containing the centers of ``cells``."""
+    centers = cell_centers(cells, resolution)
+    return world_cells(centers[:, 0], centers[:, 1], parent_resolution)
+
+
+def cell_area(cells, resolution):
+    """Area of ``cells`` in square miles (mercator scale at their centers)."""
+    y = cell_centers(cells, resolution)[:, 1]
+    lat = np.arctan(np.sinh(np.pi * (1 - 2 * y)))
+    world_miles = EARTH_CIRCUMFERENCE_MILES * np.cos(lat)
+    return 1.5 * SQRT3 * (cell_size(resolution) * world_miles) ** 2
+
+
+def bin_points(lon, lat, weights, resolutions=RESOLUTIONS):
+    """Sums of ``weights`` (column -> values) per ``(resolution, cell)``.
+
+    Points with non finite coordinates are skipped. The result adds up
+    across blocks with ``DataFrame.add(other, fill_value=0)``.
+    """
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    keep = np.isfinite(lon) & np.isfinite(lat)
+    lon, lat = lon[keep], lat[keep]
+    weights = {name: np.asarray(values, dtype=np.float64)[keep]
+               for name, values in weights.items()}
+    world = lonlat_to_world(np.column_stack([lon, lat]))
+    parts = []
+    for resolution in resolutions:
+        cells, inverse = np.unique(world_cells(world[:, 0], world[:, 1], resolution),
+                                   return_inverse=True)
+        part = pd.DataFrame({name: np.bincount(inverse, values, minlength=len(cells))
+                             for name, values in weights.items()})
+        part.index = pd.MultiIndex.from_arrays(
+            [np.full(len(cells), resolution), cells], names=['resolution', 'cell'])
+        parts.append(part)
+    return pd.concat(parts)
+
+
+def _ratio(numerator, denominator, scale=1.0):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator / scale, np.nan)
+
+
+# the app's metric columns, computed from the sums of a cell
+METRICS = {
+    'trees/sq.mile': lambda level, area: _ratio(level['trees'], area),
+    'health': lambda level, area: _ratio(level['health'], level['trees']),
+    'properties/sq.mile': lambda level, area: _ratio(level['lots'], area),
+    'avg.landprice_thous$/acre': lambda level, area: _ratio(level['avland'], level['lots'], 1000),
+    'avg.propvalue_thous$/acre': lambda level, area: _ratio(level['fullval'], level['lots'],
+                                                            1000),
+}
+# sums a metric needs to be defined anywhere
+METRIC_SUMS = {
+    'trees/sq.mile': 'trees',
+    'health': 'trees',
+    'properties/sq.mile': 'lots',
+    'avg.landprice_thous$/acre': 'lots',
+    'avg.propvalue_thous$/acre': 'lots',
+}
+
+
+class HexBins:
+    """Per resolution: sorted ``cell`` ids and the ``SUMS`` of every cell."""
+
+    def __init__(self, levels):
+        self.levels = levels
+        self._centers = {}
+
+    @classmethod
+    def from_sums(cls, sums):
+        """From the (resolution, cell) indexed frame of :func:`bin_points`."""
+        sums = sums.sort_index()
+        levels = {}
+        for resolution, part in sums.groupby(level='resolution'):
+            level = {'cell': part.index.get_level_values('cell').values.astype(np.int64)}
+            for name in SUMS:
+                values = part[name].values if name in part else np.zeros(len(part))
+                # health points are whole numbers; valuations keep 7 digits
+                kind = np.float32 if name in ('avland', 'fullval') else np.int32
+                level[name] = np.round(values).astype(kind)
+            levels[int(resolution)] = level
+        return cls(levels)
+
+    def save(self, path):
+        arrays = {'r{}_{}'.format(resolution, name): values
+                  for resolution, level in self.levels.items()
+                  for name, values in level.items()}
+        with open(str(path), 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        levels = {}
+        with np.load(str(path)) as arrays:
+            for key in arrays.files:
+                resolution, name = key[1:].split('_', 1)
+                levels.setdefault(int(resolution), {})[name] = arrays[key]
+        return cls(levels)
+
+    @property
+    def resolutions(self):
+        return sorted(self.levels)
+
+    def resolution_for_zoom(self, zoom):
+        """The resolution drawn at ``zoom``: the one of its size, within range."""
+        resolutions = self.resolutions
+        return int(min(max(math.floor(zoom), resolutions[0]), resolutions[-1]))
+
+    def has(self, metric):
+        """Whether any cell has the sums ``metric`` needs."""
+        name = METRIC_SUMS[metric]
+        return any(level[name].any() for level in self.levels.values())
+
+    def centers(self, resolution):
+        if resolution not in self._centers:
+            self._centers[resolution] = cell_centers(self.levels[resolution]['cell'],
+                                                     resolution)
+        return self._centers[resolution]
+
+    def cells_in(self, resolution, xmin, ymin, xmax, ymax):
+        """Rows of the cells of ``resolution`` overlapping a world box."""
+        pad = cell_size(resolution)
+        x, y = self.centers(resolution).T
+        return np.flatnonzero((x >= xmin - pad) & (x <= xmax + pad) &
+                              (y >= ymin - pad) & (y <= ymax + pad))
+
+    def values(self, resolution, metric, rows=None):
+        """``metric`` of the cells (NaN where it is undefined)."""
+        level = self.levels[resolution]
+        if rows is not None:
+            level = {name: values[rows] for name, values in level.items()}
+        return METRICS[metric](level, cell_area(level['cell'], resolution))
+
+
+class HexTileLayer:
+    """One metric of a :class:`HexBins` store, classified like a ``TileLayer``.
+
+    Tiles of zoom ``z`` draw the cells of ``bins.resolution_for_zoom(z)``;
+    every class is its own source layer, as in :class:`nyctrees.tiles.TileLayer`.
+    """
+
+    def __init__(self, bins, metric, breaks, decimals=0):
+        self.bins = bins
+        self.metric = metric
+        self.breaks = list(breaks)
+        self.classes = len(self.breaks) + 1
+        self.decimals = decimals
+
+    def render(self, z, x, y):
+        scale = 2 ** z
+        resolution = self.bins.resolution_for_zoom(z)
+        rows = self.bins.cells_in(resolution, x / scale, y / scale,
+                                  (x + 1) / scale, (y + 1) / scale)
+        values = self.bins.values(resolution, self.metric, rows)
+        defined = np.isfinite(values)
+        rows, values = rows[defined], values[defined]
+        if not len(rows):
+            return b''
+        classes = classify(values, self.breaks, self.decimals)
+        trees = self.bins.levels[resolution]['trees'][rows]
+        corners = (self.bins.centers(resolution)[rows, None, :] +
+                   cell_size(resolution) * CORNERS[None])
+        pixels = np.round((corners * scale - (x, y)) * EXTENT).astype(np.int64)
+
+        by_class = [[] for _ in range(self.classes)]
+        for row, cls, value, n, ring in zip(rows, classes, values, trees, pixels):
+            attributes = {self.metric: float(value), 'trees': int(n)}
+            by_class[int(cls)].append((int(row), attributes, [[ring]]))
+        return b''.join(encode_layer('class{}'.format(cls), features)
+                        for cls, features in enumerate(by_class) if features)
+
+    def bounds(self):
+        """World bounding box of the cell centers of the coarsest resolution."""
+        centers = self.bins.centers(self.bins.resolutions[0])
+        pad = cell_size(self.bins.resolutions[0])
+        return centers.min(axis=0) - pad, centers.max(axis=0) + pad
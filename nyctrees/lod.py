@@ -0,0 +1,322 @@
+"""Zoom dependent level of detail for the area polygons.
+
+The source polygons are at survey resolution; at the zoom levels the map
+is normally used at most of their vertices fall inside one pixel. A
+:class:`LODPyramid` holds a few simplified copies of a FeatureCollection:
+
+* coordinates are quantized to an integer grid, so vertices shared by
+  neighboring areas compare equal;
+* rings are cut into arcs at junctions (vertices where the set of
+  neighbors changes) and every arc is simplified once with
+  Douglas-Peucker. Neighboring areas therefore share the exact same
+  simplified border and no gaps or overlaps open up between them;
+* each level keeps only as many decimals as its zoom range needs.
+
+Levels are stored quantized and delta encoded (``encode``/``decode``) so
+the pyramid can be cached on disk and rebuilt without redoing the
+simplification.
+"""
+import hashlib
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+# source coordinates are snapped to 1e-6 degrees (about 0.1 m)
+GRID = 10 ** 6
+
+# a level is used up to and including its zoom; None is full resolution
+LEVEL_ZOOMS = (10, 12, 14, None)
+
+
+def pixel_degrees(zoom):
+    """Width of one 512px mapbox tile pixel, in degrees of longitude."""
+    return 360.0 / (512 * 2 ** zoom)
+
+
+def level_params(max_zoom):
+    """(tolerance in grid units, decimals) for a level."""
+    if max_zoom is None:
+        return 0, 6
+    pixel = pixel_degrees(max_zoom)
+    decimals = min(6, int(math.ceil(-math.log10(pixel))) + 1)
+    return pixel / 2 * GRID, decimals
+
+
+def douglas_peucker(points, tolerance):
+    """Boolean mask of the vertices of an open polyline to keep."""
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    if n < 3 or tolerance <= 0:
+        keep[:] = True
+        return keep
+    pts = points.astype(np.float64)
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = pts[first], pts[last]
+        seg = pts[first + 1:last]
+        dx, dy = b - a
+        norm = math.hypot(dx, dy)
+        if norm == 0:
+            dist = np.hypot(seg[:, 0] - a[0], seg[:, 1] - a[1])
+        else:
+            dist = np.abs(dx * (seg[:, 1] - a[1]) - dy * (seg[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def _rings(geometry):
+    """Polygons of a (Multi)Polygon as lists of rings."""
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+class Topology:
+    """Quantized rings of a FeatureCollection decomposed into shared arcs.
+
+    ``features[f][p][r]`` is a list of ``(arc index, reversed)`` pairs that
+    walk ring ``r`` of polygon ``p`` of feature ``f``.
+    """
+
+    def __init__(self, geojson):
+        self.ids = []
+        rings = []
+        shape = []
+        for feature in geojson['features']:
+            self.ids.append(feature.get('id'))
+            parts = []
+            for polygon in _rings(feature['geometry']):
+                part = []
+                for ring in polygon:
+                    q = np.round(np.asarray(ring, dtype=np.float64) * GRID).astype(np.int64)
+                    if len(q) > 1 and (q[0] == q[-1]).all():
+                        q = q[:-1]
+                    # drop repeated vertices
+                    q = q[np.any(q != np.roll(q, 1, axis=0), axis=1)]
+                    part.append(len(rings))
+                    rings.append(q)
+                parts.append(part)
+            shape.append(parts)
+
+        junctions = self._junctions(rings)
+        self.arcs = []
+        self._arc_index = {}
+        ring_arcs = [self._cut(ring, junctions) for ring in rings]
+        self.features = [[[ring_arcs[r] for r in part] for part in parts]
+                         for parts in shape]
+
+    @staticmethod
+    def _junctions(rings):
+        neighbors = {}
+        junctions = set()
+        for ring in rings:
+            pts = list(map(tuple, ring.tolist()))
+            n = len(pts)
+            for i, p in enumerate(pts):
+                pair = frozenset((pts[i - 1], pts[(i + 1) % n]))
+                seen = neighbors.get(p)
+                if seen is None:
+                    neighbors[p] = pair
+                elif seen != pair:
+                    junctions.add(p)
+        return junctions
+
+    def _add_arc(self, points):
+        key = points.tobytes()
+        if key in self._arc_index:
+            return self._arc_index[key], False
+        rkey = points[::-1].tobytes()
+        if rkey in self._arc_index:
+            return self._arc_index[rkey], True
+        self._arc_index[key] = len(self.arcs)
+        self.arcs.append(points)
+        return len(self.arcs) - 1, False
+
+    def _cut(self, ring, junctions):
+        pts = list(map(tuple, ring.tolist()))
+        cuts = [i for i, p in enumerate(pts) if p in junctions]
+        if not cuts:
+            # a closed ring shared as a whole (e.g. an island and the hole
+            # around it): rotate and orient it canonically so both copies
+            # become the same arc, then cut it at the farthest vertex
+            start = min(range(len(pts)), key=pts.__getitem__)
+            ring = np.roll(ring, -start, axis=0)
+            if tuple(ring[-1]) < tuple(ring[1]):
+                ring = np.concatenate([ring[:1], ring[:0:-1]])
+            far = int(np.argmax(((ring - ring[0]) ** 2).sum(axis=1)))
+            far = max(far, 1)
+            closed = np.concatenate([ring, ring[:1]])
+            return [self._add_arc(closed[:far + 1]),
+                    self._add_arc(closed[far:])]
+        ring = np.roll(ring, -cuts[0], axis=0)
+        cuts = [c - cuts[0] for c in cuts] + [len(ring)]
+        closed = np.concatenate([ring, ring[:1]])
+        return [self._add_arc(closed[a:b + 1]) for a, b in zip(cuts, cuts[1:])]
+
+    def vertex_count(self):
+        return sum(len(arc) for arc in self.arcs)
+
+
+class LODPyramid:
+    """Simplified copies of a FeatureCollection, one per entry of ``zooms``."""
+
+    def __init__(self, geojson, zooms=LEVEL_ZOOMS):
+        self.zooms = tuple(zooms)
+        self.topology = Topology(geojson)
+        self.ids = self.topology.ids
+        self.properties = [f.get('properties', {}) for f in geojson['features']]
+        self.levels = [self._build(z) for z in self.zooms]
+
+    def level_for_zoom(self, zoom):
+        for i, max_zoom in enumerate(self.zooms):
+            if max_zoom is None or zoom <= max_zoom:
+                return i
+        return len(self.zooms) - 1
+
+    def _build(self, max_zoom):
+        tolerance, decimals = level_params(max_zoom)
+        # snap kept vertices to the level's decimals, still in grid units
+        step = 10 ** (6 - decimals)
+        arcs = []
+        for arc in self.topology.arcs:
+            kept = arc[douglas_peucker(arc, tolerance)]
+            kept = np.round(kept / step).astype(np.int64) * step
+            arcs.append(kept)
+
+        features = []
+        for parts in self.topology.features:
+            polygons = []
+            for part in parts:
+                rings = [self._ring(arcs, ring) for ring in part]
+                if rings[0] is None:
+                    continue
+                polygons.append([r for r in rings if r is not None])
+            if not polygons:
+                # never lose an area: keep its largest exterior unsimplified
+                exterior = max((part[0] for part in parts), key=lambda ring: sum(
+                    len(self.topology.arcs[index]) for index, _ in ring))
+                polygons = [[self._ring(self.topology.arcs, exterior)]]
+            features.append(polygons)
+        return {'decimals': decimals, 'features': features}
+
+    @staticmethod
+    def _ring(arcs, ring_arcs):
+        pieces = []
+        for index, reverse in ring_arcs:
+            arc = arcs[index][::-1] if reverse else arcs[index]
+            pieces.append(arc[:-1])
+        ring = np.concatenate(pieces)
+        ring = ring[np.any(ring != np.roll(ring, 1, axis=0), axis=1)]
+        if len(ring) < 3:
+            return None
+        return np.concatenate([ring, ring[:1]])
+
+    def vertex_count(self, level):
+        return sum(len(ring) for polygons in self.levels[level]['features']
+                   for polygon in polygons for ring in polygon)
+
+    def geojson(self, level):
+        """The level as a GeoJSON FeatureCollection of MultiPolygons."""
+        decimals = self.levels[level]['decimals']
+        features = []
+        for fid, props, polygons in zip(self.ids, self.properties,
+                                        self.levels[level]['features']):
+            coordinates = [[np.round(ring / GRID, decimals).tolist()
+                            for ring in polygon] for polygon in polygons]
+            feature = {'type': 'Feature', 'properties': props,
+                       'geometry': {'type': 'MultiPolygon',
+                                    'coordinates': coordinates}}
+            if fid is not None:
+                feature['id'] = fid
+            features.append(feature)
+        return {'type': 'FeatureCollection', 'features': features}
+
+    def dumps(self, level):
+        return json.dumps(self.geojson(level), separators=(',', ':'))
+
+    def encode(self, level):
+        """Quantized, delta encoded arrays of a level.
+
+        ``coords`` holds each ring's first vertex in grid units followed by
+        the differences to the previous vertex; the offset arrays delimit
+        rings, polygons and features (CSR style).
+        """
+        coords, ring_offsets, polygon_offsets, feature_offsets = [], [0], [0], [0]
+        for polygons in self.levels[level]['features']:
+            for polygon in polygons:
+                for ring in polygon:
+                    delta = np.diff(ring, axis=0, prepend=np.zeros((1, 2), np.int64))
+                    coords.append(delta)
+                    ring_offsets.append(ring_offsets[-1] + len(ring))
+                polygon_offsets.append(len(ring_offsets) - 1)
+            feature_offsets.append(len(polygon_offsets) - 1)
+        return {
+            'coords': np.concatenate(coords).astype(np.int32),
+            'rings': np.asarray(ring_offsets, dtype=np.int32),
+            'polygons': np.asarray(polygon_offsets, dtype=np.int32),
+            'features': np.asarray(feature_offsets, dtype=np.int32),
+            'decimals': np.int32(self.levels[level]['decimals']),
+        }
+
+    @staticmethod
+    def decode(encoded):
+        """Inverse of :meth:`encode`, as the per-level structure."""
+        coords = encoded['coords'].astype(np.int64)
+        rings, polygons, features = (encoded['rings'], encoded['polygons'],
+                                     encoded['features'])
+        out = []
+        for f in range(len(features) - 1):
+            feature = []
+            for p in range(features[f], features[f + 1]):
+                feature.append([np.cumsum(coords[rings[r]:rings[r + 1]], axis=0)
+                                for r in range(polygons[p], polygons[p + 1])])
+            out.append(feature)
+        return {'decimals': int(encoded['decimals']), 'features': out}
+
+    def save(self, path):
+        arrays = {}
+        for level in range(len(self.levels)):
+            for name, array in self.encode(level).items():
+                arrays['{}_{}'.format(level, name)] = array
+        np.savez(str(path), **arrays)
+
+    def load_levels(self, path):
+        with np.load(str(path)) as archive:
+            self.levels = [self.decode({name: archive['{}_{}'.format(level, name)]
+                                        for name in ('coords', 'rings', 'polygons',
+                                                     'features', 'decimals')})
+                           for level in range(len(self.zooms))]
+
+
+def cached_pyramid(geojson, cache_dir, zooms=LEVEL_ZOOMS):
+    """:class:`LODPyramid` of ``geojson``, reusing levels saved under
+    ``cache_dir`` when the geometry has not changed."""
+    raw = json.dumps(geojson, sort_keys=True).encode()
+    digest = hashlib.sha1(raw + repr(zooms).encode()).hexdigest()
+    path = Path(cache_dir) / 'lod' / '{}.npz'.format(digest)
+    pyramid = LODPyramid.__new__(LODPyramid)
+    pyramid.zooms = tuple(zooms)
+    pyramid.topology = None
+    pyramid.ids = [f.get('id') for f in geojson['features']]
+    pyramid.properties = [f.get('properties', {}) for f in geojson['features']]
+    try:
+        pyramid.load_levels(path)
+    except (OSError, KeyError, ValueError):
+        pyramid = LODPyramid(geojson, zooms)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pyramid.save(path)
+        except OSError:
+            pass
+    return pyramid
@@ -0,0 +1,256 @@
+"""Callback instrumentation exposed in the Prometheus text format.
+
+Callbacks mark their phases::
+
+    with metrics.phase('filter'):
+        mask = selector.mask(selectedArea)
+
+and :meth:`Metrics.install` wraps every registered Dash callback to time
+the whole call and, from the time spent in the callback function itself
+(see :meth:`Metrics.timed`), the serialization Dash does afterwards.
+Response sizes are counted for every ``_dash-update-component`` response.
+``GET /metrics`` returns the histograms and counters plus the hit ratios
+of the watched caches; ``GET /metrics?profile=5`` samples the stacks of
+every thread of the process for 5 seconds and returns them collapsed, one
+``frame;frame;frame count`` line per stack (flamegraph.pl, speedscope).
+
+Metrics live in the process that serves the request; with several
+gunicorn workers every scrape sees one worker. When disabled, ``phase``
+returns a shared no-op context manager and nothing is wrapped.
+"""
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, abort, request
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 60
+
+
+class _NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_PHASE = _NoPhase()
+
+
+class _Phase:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()) + '}'
+
+
+class Metrics:
+    """Phase timers, response sizes and cache hit ratios of Dash callbacks."""
+
+    def __init__(self, enabled=False, profiler=False, endpoint='_dash-update-component'):
+        self.enabled = enabled
+        self.profiler = profiler
+        self.endpoint = endpoint
+        self.phases = defaultdict(Histogram)
+        self.requests = Counter()
+        self.response_bytes = Counter()
+        self.caches = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock()
+
+    @property
+    def current(self):
+        """Output of the callback running in this thread, or None."""
+        return getattr(self._local, 'callback', None)
+
+    def phase(self, name):
+        """Context manager timing ``name`` for the running callback."""
+        if not self.enabled or self.current is None:
+            return NO_PHASE
+        return _Phase(self, name)
+
+    def observe(self, name, seconds, callback=None):
+        with self._lock:
+            self.phases[callback or self.current, name].observe(seconds)
+
+    def timed(self, func):
+        """Decorator for callback functions: times the function itself."""
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.inner = getattr(self._local, 'inner', 0.0) + (
+                    time.perf_counter() - start)
+
+        return wrapper
+
+    def watch_cache(self, name, cache):
+        """Export the ``hits``/``misses`` counters of ``cache``."""
+        self.caches[name] = cache
+
+    def install(self, app):
+        """Wrap every registered server side callback of ``app`` and count
+        the bytes of its responses. Call after the callbacks are registered."""
+        register_metrics_route(app.server, self)
+        if not self.enabled:
+            return
+        for output, entry in app.callback_map.items():
+            if 'callback' in entry:
+                entry['callback'] = self._wrap(output.strip('.'), entry['callback'])
+
+        def count_response(response):
+            if request.method == 'POST' and request.path.endswith(self.endpoint):
+                output = (request.get_json(silent=True) or {}).get('output', '')
+                output = output.strip('.')
+                with self._lock:
+                    self.requests[output] += 1
+                    self.response_bytes[output] += response.calculate_content_length() or 0
+            return response
+
+        app.server.after_request(count_response)
+
+    def _wrap(self, output, dispatch):
+        @functools.wraps(dispatch)
+        def wrapper(*args, **kwargs):
+            local = self._local
+            outer, local.callback, local.inner = getattr(local, 'callback', None), output, 0.0
+            start = time.perf_counter()
+            try:
+                return dispatch(*args, **kwargs)
+            finally:
+                total = time.perf_counter() - start
+                self.observe('total', total)
+                if local.inner:
+                    self.observe('callback', local.inner)
+                    # Dash encodes the figure after the function returns
+                    self.observe('serialize', total - local.inner)
+                local.callback = outer
+
+        return wrapper
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = [
+            '# HELP nyctrees_callback_phase_seconds Time per callback and phase.',
+            '# TYPE nyctrees_callback_phase_seconds histogram',
+        ]
+        with self._lock:
+            phases = sorted(self.phases.items())
+            requests = sorted(self.requests.items())
+            response_bytes = dict(self.response_bytes)
+        for (callback, phase), histogram in phases:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append('nyctrees_callback_phase_seconds_bucket{} {}'.format(
+                    _labels(callback=callback, phase=phase, le=bound), cumulative))
+            labels = _labels(callback=callback, phase=phase)
+            lines.append('nyctrees_callback_phase_seconds_sum{} {!r}'.format(
+                labels, histogram.sum))
+            lines.append('nyctrees_callback_phase_seconds_count{} {}'.format(
+                labels, histogram.count))
+
+        lines += ['# HELP nyctrees_callback_requests_total Dash update requests per output.',
+                  '# TYPE nyctrees_callback_requests_total counter']
+        lines += ['nyctrees_callback_requests_total{} {}'.format(_labels(callback=output), n)
+                  for output, n in requests]
+        lines += ['# HELP nyctrees_callback_response_bytes_total Bytes of Dash responses.',
+                  '# TYPE nyctrees_callback_response_bytes_total counter']
+        lines += ['nyctrees_callback_response_bytes_total{} {}'.format(
+            _labels(callback=output), response_bytes[output]) for output, _ in requests]
+
+        lines += ['# HELP nyctrees_cache_requests_total Cache lookups by result.',
+                  '# TYPE nyctrees_cache_requests_total counter']
+        ratios = ['# HELP nyctrees_cache_hit_ratio Share of cache lookups that hit.',
+                  '# TYPE nyctrees_cache_hit_ratio gauge']
+        for name, cache in sorted(self.caches.items()):
+            hits, misses = cache.hits, cache.misses
+            lines.append('nyctrees_cache_requests_total{} {}'.format(
+                _labels(cache=name, result='hit'), hits))
+            lines.append('nyctrees_cache_requests_total{} {}'.format(
+                _labels(cache=name, result='miss'), misses))
+            ratios.append('nyctrees_cache_hit_ratio{} {!r}'.format(
+                _labels(cache=name), hits / (hits + misses) if hits + misses else 0.0))
+        return '\n'.join(lines + ratios) + '\n'
+
+    def profile(self, seconds, interval=PROFILE_INTERVAL):
+        """Collapsed stacks of every other thread, sampled for ``seconds``."""
+        stacks = Counter()
+        me = threading.get_ident()
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stacks[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return ''.join('{} {}\n'.format(stack, n) for stack, n in stacks.most_common())
+
+
+def register_metrics_route(server, metrics, path='/metrics'):
+    """Add ``path`` (Prometheus text, or ``?profile=SECONDS``) to the Flask ``server``."""
+
+    def serve_metrics():
+        seconds = request.args.get('profile', type=float)
+        if seconds is None:
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+        if not metrics.profiler:
+            abort(404)
+        # one profile at a time per process
+        if not metrics._profiling.acquire(blocking=False):
+            abort(409)
+        try:
+            body = metrics.profile(min(max(seconds, 0.0), MAX_PROFILE_SECONDS))
+        finally:
+            metrics._profiling.release()
+        return Response(body, mimetype='text/plain')
+
+    server.add_url_rule(path, 'serve_metrics', serve_metrics)
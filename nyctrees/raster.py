@@ -0,0 +1,245 @@
+"""Raster tiles of every individual tree, shaded on the server.
+
+A :class:`TreePoints` store holds the census trees as fixed point web
+mercator coordinates (``uint32``, ``x * 2**32``) sorted by ``y``, with
+their health points and species codes; :mod:`nyctrees.etl` writes it.
+:class:`Rasterizer` renders a 256px tile by slicing the rows of its
+latitude band with ``searchsorted``, binning them into pixels with
+integer shifts and ``bincount``, and shading the pixels by tree count,
+mean health or dominant species (``ENCODINGS``). Tiles are encoded as
+PNG with zlib only and kept in an LRU per ``(encoding, z, x, y)``; the map
+draws them as a mapbox raster layer, so the browser only ever receives
+the pixels of the viewport.
+
+Opacity follows the count of trees in a pixel on a log scale saturating
+at the 99th percentile of the whole city at that zoom, so neighboring
+tiles shade alike.
+"""
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from flask import Response, abort, has_request_context, request
+
+from nyctrees.cache import LRUCache
+from nyctrees.tiles import MAX_ZOOM, lonlat_to_world
+
+TREE_POINTS_FILE = 'treepoints.npz'
+TILE_BITS = 8
+TILE_SIZE = 1 << TILE_BITS
+# rows per thread when rendering with workers
+CHUNK = 1 << 18
+TOP_SPECIES = 10
+
+COUNT_COLORS = ['#98ffe0', '#45d0a5', '#2a9d78', '#145c45']
+HEALTH_COLORS = ['#d7191c', '#fdae61', '#ffffbf', '#a6d96a', '#1a9641']
+SPECIES_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                  '#8c564b', '#e377c2', '#bcbd22', '#17becf', '#f9ed69']
+OTHER_SPECIES_COLOR = '#9e9e9e'
+ENCODINGS = ('count', 'health', 'species')
+
+
+def _rgb(colors):
+    return np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colors], dtype=np.float64)
+
+
+def color_ramp(colors, n=256):
+    """``(n, 3)`` uint8 lookup table interpolating ``colors`` evenly."""
+    rgb = _rgb(colors)
+    stops = np.linspace(0, 1, len(colors))
+    t = np.linspace(0, 1, n)
+    return np.column_stack([np.interp(t, stops, rgb[:, i]) for i in range(3)]).astype(np.uint8)
+
+
+def encode_png(rgba):
+    """PNG bytes of an ``(h, w, 4)`` uint8 array."""
+    h, w = rgba.shape[:2]
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+class TreePoints:
+    """Trees as fixed point mercator ``x``/``y`` (sorted by ``y``), health
+    points (0-15) and species codes into ``species_names``."""
+
+    def __init__(self, x, y, health, species, species_names):
+        order = np.argsort(y, kind='stable')
+        self.x = np.asarray(x, dtype=np.uint32)[order]
+        self.y = np.asarray(y, dtype=np.uint32)[order]
+        self.health = np.asarray(health, dtype=np.uint8)[order]
+        self.species = np.asarray(species, dtype=np.int16)[order]
+        self.species_names = list(species_names)
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def from_lonlat(cls, lon, lat, health, species):
+        """From degrees, health points and species names (or a Categorical)."""
+        world = lonlat_to_world(np.column_stack([lon, lat]).astype(np.float64))
+        fixed = np.clip(np.floor(world * 2.0 ** 32), 0, 2 ** 32 - 1)
+        species = pd.Categorical(species)
+        return cls(fixed[:, 0], fixed[:, 1], health, species.codes,
+                   [str(name) for name in species.categories])
+
+    def save(self, path):
+        with open(str(path), 'wb') as f:
+            np.savez_compressed(f, x=self.x, y=self.y, health=self.health,
+                                species=self.species,
+                                species_names=np.array(self.species_names, dtype=np.str_))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(str(path)) as arrays:
+            return cls(arrays['x'], arrays['y'], arrays['health'], arrays['species'],
+                       arrays['species_names'].tolist())
+
+    def band(self, z, ty):
+        """Rows of the trees in tile row ``ty`` of zoom ``z``."""
+        shift = 32 - z
+        start = np.searchsorted(self.y, ty << shift)
+        end = len(self.y) if (ty + 1) << shift >= 2 ** 32 else np.searchsorted(
+            self.y, (ty + 1) << shift)
+        return start, end
+
+
+class Rasterizer:
+    """Rendered and cached PNG tiles of a :class:`TreePoints` store."""
+
+    def __init__(self, points, maxsize=2048, workers=None, version='', url_prefix='/raster/'):
+        self.points = points
+        self.cache = LRUCache(maxsize)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers) if workers and workers > 1 else None
+        self.version = version
+        self.url_prefix = url_prefix
+        self._saturation = {}
+        self._empty = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+        # the most common species get their own color, the rest share one
+        counts = np.bincount(points.species[points.species >= 0],
+                             minlength=len(points.species_names))
+        top = np.argsort(-counts, kind='stable')[:TOP_SPECIES]
+        self.top_species = [points.species_names[i] for i in top]
+        self._species_slot = np.full(len(points.species_names) + 1, len(top), dtype=np.int64)
+        self._species_slot[top] = np.arange(len(top))
+        self._ramps = {'count': color_ramp(COUNT_COLORS), 'health': color_ramp(HEALTH_COLORS)}
+        self._species_colors = _rgb(SPECIES_COLORS[:len(top)] +
+                                    [OTHER_SPECIES_COLOR]).astype(np.uint8)
+
+    def saturation(self, z):
+        """Trees per pixel at which a pixel of zoom ``z`` is fully opaque."""
+        if z not in self._saturation:
+            shift = 32 - z - TILE_BITS
+            pixels = ((self.points.x >> shift).astype(np.uint64) << np.uint64(32)) | (
+                self.points.y >> shift)
+            _, counts = np.unique(pixels, return_counts=True)
+            self._saturation[z] = max(float(np.percentile(counts, 99)), 1.0) if len(
+                counts) else 1.0
+        return self._saturation[z]
+
+    def _bin(self, z, x, start, end, encoding):
+        """Per pixel sums of rows ``start:end`` that fall in tile column ``x``."""
+        p = self.points
+        tx = p.x[start:end]
+        inside = (tx >> (32 - z)) == x if z else np.ones(len(tx), dtype=bool)
+        shift = 32 - z - TILE_BITS
+        mask = TILE_SIZE - 1
+        px = (tx[inside] >> shift) & mask
+        py = (p.y[start:end][inside] >> shift) & mask
+        pixel = (py.astype(np.int64) << TILE_BITS) | px
+        n = TILE_SIZE * TILE_SIZE
+        sums = [np.bincount(pixel, minlength=n)]
+        if encoding == 'health':
+            sums.append(np.bincount(pixel, p.health[start:end][inside], minlength=n))
+        elif encoding == 'species':
+            slots = len(self.top_species) + 1
+            slot = self._species_slot[p.species[start:end][inside]]
+            sums.append(np.bincount(pixel * slots + slot, minlength=n * slots).reshape(n, slots))
+        return sums
+
+    def render(self, z, x, y, encoding='count'):
+        """PNG bytes of one tile."""
+        start, end = self.points.band(z, y)
+        if self._executor is not None and end - start > CHUNK:
+            bounds = list(range(start, end, CHUNK)) + [end]
+            parts = list(self._executor.map(lambda a, b: self._bin(z, x, a, b, encoding),
+                                            bounds[:-1], bounds[1:]))
+            sums = [sum(part[i] for part in parts) for i in range(len(parts[0]))]
+        else:
+            sums = self._bin(z, x, start, end, encoding)
+        counts = sums[0]
+        occupied = counts > 0
+        if not occupied.any():
+            return self._empty
+
+        rgba = np.zeros((TILE_SIZE * TILE_SIZE, 4), dtype=np.uint8)
+        level = np.log1p(counts[occupied]) / np.log1p(self.saturation(z))
+        level = np.clip(level, 0, 1)
+        # a single tree stays visible
+        rgba[occupied, 3] = np.round(255 * (0.35 + 0.65 * level)).astype(np.uint8)
+        if encoding == 'count':
+            rgba[occupied, :3] = self._ramps['count'][np.round(255 * level).astype(np.int64)]
+        elif encoding == 'health':
+            mean = sums[1][occupied] / counts[occupied] / 15.0
+            rgba[occupied, :3] = self._ramps['health'][np.round(255 * mean).astype(np.int64)]
+        else:
+            dominant = sums[1][occupied].argmax(axis=1)
+            rgba[occupied, :3] = self._species_colors[dominant]
+        return encode_png(rgba.reshape(TILE_SIZE, TILE_SIZE, 4))
+
+    def tile(self, encoding, z, x, y):
+        return self.cache.get_or_compute((encoding, z, x, y),
+                                         lambda: self.render(z, x, y, encoding))
+
+    def url(self, encoding):
+        path = '{}{}/{{z}}/{{x}}/{{y}}.png?v={}'.format(self.url_prefix, encoding, self.version)
+        if has_request_context():
+            return request.url_root.rstrip('/') + path
+        return path
+
+    def mapbox_layers(self, encoding, opacity=1.0, minzoom=None, maxzoom=None):
+        """plotly ``layout.mapbox.layers`` drawing the trees shaded by ``encoding``."""
+        layer = dict(
+            sourcetype="raster",
+            source=[self.url(encoding)],
+            type="raster",
+            opacity=opacity,
+        )
+        if minzoom is not None:
+            layer['minzoom'] = minzoom
+        if maxzoom is not None:
+            layer['maxzoom'] = maxzoom
+        return [layer]
+
+    def species_legend(self):
+        """``(species, color)`` of the species colored by the species encoding."""
+        return list(zip(self.top_species, SPECIES_COLORS)) + [('other', OTHER_SPECIES_COLOR)]
+
+
+def register_raster_route(server, rasterizer):
+    """Add ``<url_prefix><encoding>/<z>/<x>/<y>.png`` to the Flask ``server``."""
+
+    def serve_raster(encoding, z, x, y):
+        if encoding not in ENCODINGS or z > MAX_ZOOM or not (
+                0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            abort(404)
+        headers = {
+            'Cache-Control': 'public, max-age=86400',
+            'Access-Control-Allow-Origin': '*',
+        }
+        return Response(rasterizer.tile(encoding, z, x, y), headers=headers,
+                        mimetype='image/png')
+
+    server.add_url_rule(rasterizer.url_prefix + '<encoding>/<int:z>/<int:x>/<int:y>.png',
+                        'serve_raster', serve_raster)
@@ -0,0 +1,188 @@
+"""Map selections as boolean masks over a stable area index.
+
+Every marker on the map carries an integer id in ``customdata``. A lasso
+or box selection is resolved by reading those ids back, which does not
+depend on the hover text format and costs no string handling. Ids of the
+two views live in disjoint ranges (``offset``), so a selection made in one
+view never resolves to rows of the other.
+
+:class:`PolygonSelector` goes further and intersects the lasso (or box)
+itself with the area polygons, so an area whose marker the lasso misses
+is still selected when the lasso covers part of it.
+"""
+import numpy as np
+
+from nyctrees.geometry import (EdgeSet, GridIndex, point_in_polygons,
+                               points_in_polygon, ring_edges, segments_cross)
+from nyctrees.lod import GRID
+
+SELECTION_MODES = ('intersects', 'contains', 'centroid')
+
+
+class AreaIndex:
+    """Positions of the areas of one view, in table row order."""
+
+    def __init__(self, names, offset=0):
+        self.names = np.asarray(list(names), dtype=object)
+        self.offset = offset
+        self.positions = {}
+        for i, name in enumerate(self.names):
+            self.positions.setdefault(name, i)
+        # a few names appear on more than one row; every row points at the
+        # first row with its name
+        self.first = np.fromiter((self.positions[name] for name in self.names),
+                                 dtype=np.int64, count=len(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def ids(self):
+        """Values to put in the map trace's ``customdata``."""
+        return np.arange(self.offset, self.offset + len(self), dtype=np.int64)
+
+    def lookup(self, names):
+        """Position of every name (its first row), -1 where the area is unknown."""
+        return np.fromiter((self.positions.get(name, -1) for name in names),
+                           dtype=np.int64)
+
+    def mask(self, selectedData):
+        """Boolean mask of the selected areas, or None without a selection."""
+        if selectedData is None:
+            return None
+        points = selectedData.get("points") or []
+        ids = np.fromiter((point["customdata"] for point in points
+                           if isinstance(point.get("customdata"), int)),
+                          dtype=np.int64) - self.offset
+        mask = np.zeros(len(self), dtype=bool)
+        mask[ids[(ids >= 0) & (ids < len(self))]] = True
+        return mask
+
+    def by_name(self, mask):
+        """``mask`` moved onto the first row of every name, to match
+        positions returned by :meth:`lookup`."""
+        if mask is None:
+            return None
+        folded = np.zeros(len(self), dtype=bool)
+        folded[self.first[mask]] = True
+        return folded
+
+
+def selection_key(selectedData, decimals=6):
+    """JSON-able key of a selection, cheap enough to compute before a
+    cache lookup: the lasso or box rounded to ``decimals`` places (about
+    0.1 m at 6), or the sorted marker ids of a selection without one, e.g.
+    a click. No selection is ``'all'``.
+    """
+    if selectedData is None:
+        return 'all'
+    ring = selection_polygon(selectedData)
+    if ring is not None:
+        return np.round(ring[:-1], decimals).ravel().tolist()
+    points = selectedData.get("points") or []
+    return sorted(point["customdata"] for point in points
+                  if isinstance(point.get("customdata"), int))
+
+
+def selection_polygon(selectedData):
+    """The lasso or box of a mapbox selection as a closed lon/lat ring."""
+    lasso = (selectedData.get("lassoPoints") or {}).get("mapbox")
+    if lasso:
+        ring = np.asarray(lasso, dtype=np.float64)
+    else:
+        box = (selectedData.get("range") or {}).get("mapbox")
+        if not box:
+            return None
+        (x0, y0), (x1, y1) = box
+        ring = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float64)
+    if len(ring) < 3:
+        return None
+    return np.vstack([ring, ring[:1]])
+
+
+class PolygonSelector:
+    """Selects the areas of an :class:`AreaIndex` by their polygons.
+
+    ``polygons[i]`` is the list of closed lon/lat rings of area ``i`` (all
+    parts and holes; empty when the area has no geometry, in which case its
+    centroid is used). Polygon bounding boxes go into a :class:`GridIndex`
+    once, so a selection only looks at the edges of nearby areas.
+    """
+
+    def __init__(self, area_index, polygons, centroids):
+        self.area_index = area_index
+        self.edges = EdgeSet(polygons)
+        self.grid = GridIndex(self.edges.bboxes)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.has_geometry = ~np.isnan(self.edges.bboxes).any(axis=1)
+        # one vertex of every ring: when no edge crosses the lasso, each
+        # ring is either entirely inside or entirely outside of it
+        self.ring_vertex = np.array([ring[0] for rings in polygons for ring in rings]
+                                    ).reshape(-1, 2)
+        self.ring_owner = np.repeat(np.arange(len(polygons)),
+                                    [len(rings) for rings in polygons])
+        self.ring_count = np.bincount(self.ring_owner, minlength=len(polygons))
+
+    @classmethod
+    def from_engine(cls, area_index, engine, centroids, level=1):
+        """Selector over a level of detail of a ChoroplethEngine's geometry."""
+        features = engine.lod.levels[level]['features']
+        polygons = []
+        for name in area_index.names:
+            feature = engine.index.get(name)
+            if feature is None:
+                polygons.append([])
+                continue
+            polygons.append([ring / GRID for polygon in features[feature]
+                             for ring in polygon])
+        return cls(area_index, polygons, centroids)
+
+    def mask(self, selectedData, mode='intersects'):
+        """Boolean mask of the selected areas, or None without a selection.
+
+        ``mode`` is one of ``SELECTION_MODES``: areas touching the lasso,
+        areas entirely inside it, or areas whose centroid is inside it.
+        Selections without a lasso or box (e.g. clicks) fall back to the
+        marker ids.
+        """
+        if mode not in SELECTION_MODES:
+            raise ValueError('unknown selection mode {!r}'.format(mode))
+        if selectedData is None:
+            return None
+        ring = selection_polygon(selectedData)
+        if ring is None:
+            return self.area_index.mask(selectedData)
+        lasso = ring_edges([ring])
+
+        by_centroid = points_in_polygon(self.centroids[:, 0], self.centroids[:, 1], *lasso)
+        if mode == 'centroid':
+            return by_centroid
+
+        xmin, ymin = ring.min(axis=0)
+        xmax, ymax = ring.max(axis=0)
+        candidates = self.grid.query((xmin, ymin, xmax, ymax))
+        keep = np.zeros(len(self.area_index), dtype=bool)
+        keep[candidates] = True
+        edge_index = self.edges.subset(keep)
+
+        # segments_cross only pairs lasso segments and edges in the same
+        # cell of a grid over the lasso
+        e = self.edges
+        hit = segments_cross(lasso, (e.x0[edge_index], e.y0[edge_index],
+                                     e.x1[edge_index], e.y1[edge_index]))
+        crossed = np.zeros(len(self.area_index), dtype=bool)
+        crossed[e.owner[edge_index][hit]] = True
+
+        rings = np.flatnonzero(keep[self.ring_owner])
+        ring_inside = points_in_polygon(self.ring_vertex[rings, 0],
+                                        self.ring_vertex[rings, 1], *lasso)
+        inside_count = np.bincount(self.ring_owner[rings][ring_inside],
+                                   minlength=len(self.area_index))
+
+        if mode == 'contains':
+            selected = (inside_count == self.ring_count) & ~crossed
+        else:
+            lasso_inside = point_in_polygons(ring[0, 0], ring[0, 1], e, edge_index)
+            selected = crossed | (inside_count > 0) | lasso_inside
+        selected &= keep
+        return np.where(self.has_geometry, selected, by_centroid)
@@ -0,0 +1,91 @@
+"""Nearest neighbors of the areas in the space of their metrics.
+
+Every metric is standardized (zero mean, unit variance over the areas, a
+missing value counts as the mean) and scaled by the square root of its
+weight, so the euclidean distance between two areas is the weighted
+distance of their z-scores. A KD-tree over these points answers a query in
+``O(log n)``; the ``k`` nearest neighbors of every area are queried once,
+in one batch, when the index is built, so looking up the areas similar to
+one area is an index into that table.
+"""
+import numpy as np
+import pandas as pd
+
+NEIGHBORS = 10
+
+
+def standardize(values):
+    """z-scores of the columns of ``values``; NaN (and constant columns) become 0."""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0)
+    std = np.where(std > 0, std, 1.0)
+    z = (values - mean) / std
+    return np.where(np.isfinite(z), z, 0.0), mean, std
+
+
+class SimilarityIndex:
+    """The ``k`` most similar areas of every area, by the weighted distance
+    of their standardized metrics.
+
+    ``values`` is an ``(areas, metrics)`` array and ``weights`` one weight
+    per metric (all 1 by default); a weight of 0 leaves a metric out.
+    """
+
+    def __init__(self, values, weights=None, k=NEIGHBORS):
+        from scipy.spatial import cKDTree
+
+        z, self.mean, self.std = standardize(values)
+        n, m = z.shape
+        self.weights = np.ones(m) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.scale = np.sqrt(self.weights)
+        self.points = z * self.scale
+        self.tree = cKDTree(self.points)
+        self.k = max(min(k, n - 1), 0)
+        self.neighbors, self.distances = self._batch(self.k)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _batch(self, k):
+        n = len(self.points)
+        if not k:
+            return np.empty((n, 0), dtype=np.int64), np.empty((n, 0))
+        distances, neighbors = self.tree.query(self.points, k + 1)
+        # every area is its own nearest neighbor, unless another area has the
+        # same values: drop the area itself, or the last neighbor without it
+        own = neighbors == np.arange(n)[:, None]
+        own[~own.any(axis=1), -1] = True
+        return (neighbors[~own].reshape(n, k).astype(np.int64),
+                distances[~own].reshape(n, k))
+
+    def query(self, row, k=None):
+        """(rows, distances) of the ``k`` areas most similar to area ``row``,
+        nearest first."""
+        if k is None or k <= self.k:
+            return self.neighbors[row, :k], self.distances[row, :k]
+        k = min(k, len(self) - 1)
+        distances, neighbors = self.tree.query(self.points[row], k + 1)
+        keep = neighbors != row
+        return neighbors[keep][:k], distances[keep][:k]
+
+    def search(self, values, k=NEIGHBORS):
+        """(rows, distances) of the ``k`` areas nearest to raw metric
+        ``values`` (one point, or an array of points)."""
+        z = (np.asarray(values, dtype=np.float64) - self.mean) / self.std
+        z = np.where(np.isfinite(z), z, 0.0)
+        distances, neighbors = self.tree.query(z * self.scale, min(k, len(self)))
+        return neighbors, distances
+
+    def table(self, names, k=None):
+        """The top-``k`` table of every area: one row per (area, rank)."""
+        k = self.k if k is None else min(k, self.k)
+        names = np.asarray(names, dtype=object)
+        n = len(self)
+        return pd.DataFrame({
+            'area': np.repeat(names, k),
+            'rank': np.tile(np.arange(1, k + 1), n),
+            'similar': names[self.neighbors[:, :k].ravel()],
+            'distance': self.distances[:, :k].ravel(),
+        })
@@ -0,0 +1,184 @@
+"""Spatial join of lon/lat points to the polygons that contain them.
+
+A uniform grid is laid over the polygons. Cells that no polygon edge
+passes through are resolved once, when the index is built: every point
+in such a cell lies in the same polygon (or none). Points in the other
+cells are tested by even-odd ray casting, vectorized per cell, against
+only the edges of the cell's candidate polygons in the cell's row of the
+grid. Exterior rings, holes and the parts of a MultiPolygon all go
+through the same parity count (see :mod:`nyctrees.geometry`).
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from nyctrees.geometry import EdgeSet, GridIndex, crossings, expand
+
+# cell_owner value of cells that have polygon edges in them
+BOUNDARY = -2
+
+
+def feature_rings(geometry):
+    """Every ring of a Polygon or MultiPolygon as ``(n, 2)`` arrays."""
+    polygons = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    return [np.asarray(ring, dtype=np.float64) for polygon in polygons for ring in polygon]
+
+
+class SpatialJoin:
+    """Index of ``polygons`` (lists of closed rings) for point location."""
+
+    def __init__(self, polygons, names=None, shape=(256, 256)):
+        self.names = None if names is None else np.asarray(list(names), dtype=object)
+        self.edges = e = EdgeSet(polygons)
+        self.grid = g = GridIndex(e.bboxes, shape)
+        self.count = len(polygons)
+
+        xmin, xmax = np.minimum(e.x0, e.x1), np.maximum(e.x0, e.x1)
+        ymin, ymax = np.minimum(e.y0, e.y1), np.maximum(e.y0, e.y1)
+        self.edge_xmax = xmax
+        cx0, cx1 = self._columns(xmin), self._columns(xmax)
+        cy0, cy1 = self._rows(ymin), self._rows(ymax)
+
+        # edges overlapping each row of cells, as CSR
+        edge, row = expand(cy0, cy1)
+        order = np.argsort(row, kind='stable')
+        self.row_edges = edge[order]
+        self.row_offsets = np.searchsorted(row[order], np.arange(g.ny + 1))
+
+        # cells an edge's bounding box touches need per point tests
+        edge, cell_x = expand(cx0, cx1)
+        span, cell_y = expand(cy0[edge], cy1[edge])
+        boundary = np.zeros(g.nx * g.ny, dtype=bool)
+        boundary[cell_y * g.nx + cell_x[span]] = True
+
+        self.cell_owner = np.full(g.nx * g.ny, -1, dtype=np.int64)
+        self.cell_owner[boundary] = BOUNDARY
+        has_candidates = np.diff(g.offsets) > 0
+        inner = np.flatnonzero(has_candidates & ~boundary)
+        centers_x = g.xmin + (inner % g.nx + 0.5) * g.dx
+        centers_y = g.ymin + (inner // g.nx + 0.5) * g.dy
+        self.cell_owner[inner] = self._test_rows(centers_x, centers_y, inner // g.nx)
+
+    @classmethod
+    def from_geojson(cls, path, name_property, shape=(256, 256)):
+        """Index of a FeatureCollection; names are the lowercase ``name_property``."""
+        with open(path) as f:
+            features = json.load(f)['features']
+        return cls([feature_rings(feature['geometry']) for feature in features],
+                   [feature['properties'][name_property].lower() for feature in features],
+                   shape)
+
+    def _columns(self, x):
+        return np.clip(((x - self.grid.xmin) // self.grid.dx).astype(np.int64),
+                       0, self.grid.nx - 1)
+
+    def _rows(self, y):
+        return np.clip(((y - self.grid.ymin) // self.grid.dy).astype(np.int64),
+                       0, self.grid.ny - 1)
+
+    def _parity(self, px, py, edges):
+        """(points x polygons) "inside" of the polygons owning ``edges``.
+
+        ``edges`` must be sorted, which groups them by polygon.
+        """
+        e = self.edges
+        owners = e.owner[edges]
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        hit = crossings(px, py, e.x0[edges], e.y0[edges], e.x1[edges], e.y1[edges])
+        return owners[starts], np.logical_xor.reduceat(hit, starts, axis=1)
+
+    def _test(self, px, py, cells):
+        """Polygon of every point by ray casting; ``cells`` are their grid cells."""
+        g = self.grid
+        result = np.full(len(px), -1, dtype=np.int64)
+        if not len(px):
+            return result
+        order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[order]
+        starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        candidate = np.zeros(self.count, dtype=bool)
+        for start, end in zip(starts, ends):
+            cell = sorted_cells[start]
+            candidates = g.ids[g.offsets[cell]:g.offsets[cell + 1]]
+            if not len(candidates):
+                continue
+            row = cell // g.nx
+            edges = self.row_edges[self.row_offsets[row]:self.row_offsets[row + 1]]
+            # rays go towards +x: edges left of the cell are never crossed
+            left = g.xmin + (cell % g.nx) * g.dx
+            candidate[candidates] = True
+            edges = edges[candidate[self.edges.owner[edges]] & (self.edge_xmax[edges] >= left)]
+            candidate[candidates] = False
+            if not len(edges):
+                continue
+            points = order[start:end]
+            owners, inside = self._parity(px[points], py[points], edges)
+            # overlapping polygons resolve to the lowest index
+            result[points] = np.where(inside.any(axis=1), owners[inside.argmax(axis=1)], -1)
+        return result
+
+    def _test_rows(self, px, py, rows):
+        """As :meth:`_test`, one grid row at a time against all its edges."""
+        result = np.full(len(px), -1, dtype=np.int64)
+        for row in np.unique(rows):
+            points = np.flatnonzero(rows == row)
+            edges = self.row_edges[self.row_offsets[row]:self.row_offsets[row + 1]]
+            if not len(edges):
+                continue
+            owners, inside = self._parity(px[points], py[points], edges)
+            result[points] = np.where(inside.any(axis=1), owners[inside.argmax(axis=1)], -1)
+        return result
+
+    def locate(self, x, y):
+        """Index of the polygon containing every point, -1 for none."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        cells = self.grid.cell_of(x, y)
+        result = np.full(len(x), -1, dtype=np.int64)
+        inside = np.flatnonzero(cells >= 0)
+        result[inside] = self.cell_owner[cells[inside]]
+        test = inside[result[inside] == BOUNDARY]
+        result[test] = self._test(x[test], y[test], cells[test])
+        return result
+
+    def locate_parallel(self, x, y, workers=None, chunk=1 << 17):
+        """:meth:`locate` split over a process pool.
+
+        Points are ordered by grid cell first, so each task covers few cells.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        order = np.argsort(self.grid.cell_of(x, y), kind='stable')
+        sx, sy = x[order], y[order]
+        bounds = range(0, len(x), chunk)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self,)) as executor:
+            parts = list(executor.map(_locate_chunk, (sx[i:i + chunk] for i in bounds),
+                                      (sy[i:i + chunk] for i in bounds)))
+        result = np.empty(len(x), dtype=np.int64)
+        result[order] = np.concatenate(parts) if parts else np.zeros(0, np.int64)
+        return result
+
+    def names_of(self, index):
+        """Names for the results of :meth:`locate`, None where there is no polygon."""
+        index = np.asarray(index)
+        names = np.full(len(index), None, dtype=object)
+        found = index >= 0
+        names[found] = self.names[index[found]]
+        return names
+
+
+_worker_join = None
+
+
+def _init_worker(join):
+    global _worker_join
+    _worker_join = join
+
+
+def _locate_chunk(x, y):
+    return _worker_join.locate(x, y)
@@ -0,0 +1,68 @@
+"""Tree species counts as a sparse (areas x species) matrix.
+
+Built once from ``GroupedTreesDataSpecies.csv``; the species distribution
+of any selection is then a single mask-vector product instead of filtering
+and grouping the species table.
+"""
+import numpy as np
+
+
+def top_n_with_other(names, counts, n=10, other='other'):
+    """The ``n`` largest counts plus one ``other`` entry for the rest.
+
+    Entries come back sorted by count, descending, with ``other`` in its
+    sorted position; zero counts are left out.
+    """
+    counts = np.asarray(counts)
+    nonzero = np.flatnonzero(counts)
+    if len(nonzero) > n:
+        top = nonzero[np.argpartition(counts[nonzero], -n)[-n:]]
+    else:
+        top = nonzero
+    top = top[np.argsort(-counts[top], kind='stable')]
+    labels = [names[i] for i in top]
+    values = counts[top].tolist()
+    rest = int(counts.sum() - counts[top].sum())
+    if rest > 0:
+        position = int(np.searchsorted(-counts[top], -rest, side='right'))
+        labels.insert(position, other)
+        values.insert(position, rest)
+    return labels, values
+
+
+class SpeciesMatrix:
+    """Tree counts per (area, species) for the areas of one view.
+
+    ``positions[i]`` is the area position of species table row ``i`` (-1
+    when the area is not part of the view, e.g. an NTA dropped as an
+    outlier); those rows still count towards the unselected totals.
+    """
+
+    def __init__(self, positions, species_codes, counts, n_areas, species_names):
+        # scipy.sparse takes a while to import; only load it once a matrix is built
+        from scipy import sparse
+
+        positions = np.asarray(positions)
+        counts = np.asarray(counts, dtype=np.int64)
+        known = positions >= 0
+        self.species = list(species_names)
+        self.matrix = sparse.csr_matrix(
+            (counts[known], (positions[known], np.asarray(species_codes)[known])),
+            shape=(n_areas, len(self.species)))
+        self.totals = np.bincount(species_codes, weights=counts,
+                                  minlength=len(self.species)).astype(np.int64)
+
+    @classmethod
+    def from_table(cls, df_species, positions, n_areas):
+        species = df_species['spc_common'].astype('category')
+        return cls(positions, species.cat.codes.values, df_species['count'].values,
+                   n_areas, [str(c) for c in species.cat.categories])
+
+    def counts(self, mask=None):
+        """Trees per species in the selected areas (all areas without a mask)."""
+        if mask is None:
+            return self.totals
+        return self.matrix.T.dot(mask.astype(np.int64))
+
+    def top(self, mask=None, n=10):
+        return top_n_with_other(self.species, self.counts(mask), n=n)
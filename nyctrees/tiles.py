@@ -0,0 +1,380 @@
+"""Mapbox Vector Tiles of the area polygons, served by the Dash Flask server.
+
+A tile layer is one view (neighborhoods or boroughs) classified by one
+metric. Inside a tile every class is its own source layer (``class0``,
+``class1``, ...), because plotly's mapbox layers take one color per layer
+and cannot style features by attribute. Features also carry the metric
+columns of their table row as attributes.
+
+Tiles are clipped from the level of detail matching their zoom, built on
+demand, kept in an LRU and optionally seeded to disk::
+
+    python -m nyctrees.tiles --seed 13
+"""
+import argparse
+import gzip
+import math
+from pathlib import Path
+
+import numpy as np
+from flask import Response, abort, has_request_context, request
+
+from nyctrees.cache import LRUCache
+from nyctrees.choropleth import classify
+from nyctrees.data import CACHE_DIR
+from nyctrees.geoserve import _gzip, _pick_encoding
+from nyctrees.lod import GRID
+
+EXTENT = 4096
+BUFFER = 64
+MAX_ZOOM = 18
+SEED_DIR = CACHE_DIR / 'tiles'
+
+
+# protobuf encoding (just enough of it for vector_tile.proto)
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _uint_field(number, value):
+    return _field(number, 0) + _varint(value)
+
+
+def _packed(number, values):
+    return _bytes_field(number, b''.join(_varint(int(v)) for v in values))
+
+
+def _value(value):
+    if isinstance(value, str):
+        return _bytes_field(1, value.encode('utf-8'))
+    # double_value
+    return _field(3, 1) + np.float64(value).tobytes()
+
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def encode_polygon(rings):
+    """Geometry command stream of one polygon given as integer tile rings."""
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for ring in rings:
+        deltas = np.diff(ring, axis=0, prepend=cursor[None, :])
+        cursor = ring[-1]
+        params = _zigzag(deltas).ravel()
+        commands.append(_command(1, 1))
+        commands.extend(params[:2].tolist())
+        commands.append(_command(2, len(ring) - 1))
+        commands.extend(params[2:].tolist())
+        commands.append(_command(7, 1))
+    return commands
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """``features`` are ``(id, attributes, polygons)`` tuples."""
+    keys, key_index = [], {}
+    values, value_index = [], {}
+    body = [_bytes_field(1, name.encode('utf-8'))]
+    for fid, attributes, polygons in features:
+        tags = []
+        for key, value in attributes.items():
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            vkey = (type(value).__name__, value)
+            if vkey not in value_index:
+                value_index[vkey] = len(values)
+                values.append(value)
+            tags.extend((key_index[key], value_index[vkey]))
+        geometry = []
+        for rings in polygons:
+            geometry.extend(encode_polygon(rings))
+        feature = (_uint_field(1, fid) + _packed(2, tags) +
+                   _uint_field(3, 3) + _packed(4, geometry))
+        body.append(_bytes_field(2, feature))
+    body.extend(_bytes_field(3, key.encode('utf-8')) for key in keys)
+    body.extend(_bytes_field(4, _value(value)) for value in values)
+    body.append(_uint_field(5, extent))
+    body.append(_uint_field(15, 2))
+    return _bytes_field(3, b''.join(body))
+
+
+# geometry
+
+def lonlat_to_world(coords):
+    """Web mercator in [0, 1] x [0, 1], y pointing south."""
+    lon, lat = coords[:, 0], np.radians(coords[:, 1])
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0
+    return np.column_stack([x, y])
+
+
+def _clip_plane(pts, axis, bound, keep_greater):
+    nxt = np.roll(pts, -1, axis=0)
+    v, vn = pts[:, axis], nxt[:, axis]
+    inside = v >= bound if keep_greater else v <= bound
+    cross = inside != np.roll(inside, -1)
+    t = (bound - v[cross]) / (vn[cross] - v[cross])
+    intersections = pts[cross] + t[:, None] * (nxt[cross] - pts[cross])
+    # every edge emits its start vertex when inside and the crossing point
+    # when it leaves or enters the half plane
+    counts = inside.astype(np.int64) + cross
+    start = np.cumsum(counts) - counts
+    out = np.empty((counts.sum(), 2))
+    out[start[inside]] = pts[inside]
+    out[start[cross] + inside[cross]] = intersections
+    return out
+
+
+def clip_ring(ring, xmin, ymin, xmax, ymax):
+    """Sutherland-Hodgman clip of an open ring to a box."""
+    for axis, bound, keep_greater in ((0, xmin, True), (0, xmax, False),
+                                      (1, ymin, True), (1, ymax, False)):
+        if len(ring) == 0:
+            break
+        ring = _clip_plane(ring, axis, bound, keep_greater)
+    return ring
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def _tile_ring(ring, exterior):
+    ring = ring[np.any(ring != np.roll(ring, 1, axis=0), axis=1)]
+    if len(ring) < 3:
+        return None
+    area = _signed_area(ring)
+    if area == 0:
+        return None
+    # exterior rings have positive area in tile coordinates (y down)
+    if (area > 0) != exterior:
+        ring = ring[::-1]
+    return ring
+
+
+class TileLayer:
+    """One view of the map classified by one metric."""
+
+    def __init__(self, engine, df, key, metric, breaks, decimals=0):
+        self.engine = engine
+        self.breaks = list(breaks)
+        self.classes = len(self.breaks) + 1
+        names = df[key].astype(str).tolist()
+        classes = classify(df[metric], breaks, decimals)
+        numeric = [c for c in df.select_dtypes(include='number').columns
+                   if not c.startswith('center')]
+        self.features = {}
+        for row, (name, cls) in enumerate(zip(names, classes)):
+            if name not in engine.index:
+                continue
+            attributes = {'name': name}
+            if 'borough' in df.columns and key != 'borough':
+                attributes['borough'] = str(df['borough'].iloc[row])
+            for column in numeric:
+                attributes[column] = float(df[column].iloc[row])
+            self.features[engine.index[name]] = (int(cls), attributes)
+        self._levels = {}
+
+    def _world(self, level):
+        """World coordinates and bounding boxes of every feature at a level."""
+        if level not in self._levels:
+            features = []
+            for polygons in self.engine.lod.levels[level]['features']:
+                world = [[lonlat_to_world(ring[:-1] / GRID) for ring in polygon]
+                         for polygon in polygons]
+                stacked = np.concatenate([p[0] for p in world])
+                features.append((world, stacked.min(axis=0), stacked.max(axis=0)))
+            self._levels[level] = features
+        return self._levels[level]
+
+    def render(self, z, x, y):
+        scale = 2 ** z
+        pad = BUFFER / EXTENT
+        xmin, ymin = (x - pad) / scale, (y - pad) / scale
+        xmax, ymax = (x + 1 + pad) / scale, (y + 1 + pad) / scale
+        world = self._world(self.engine.lod.level_for_zoom(z))
+
+        by_class = [[] for _ in range(self.classes)]
+        for fid, (cls, attributes) in sorted(self.features.items()):
+            polygons, lo, hi = world[fid]
+            if hi[0] < xmin or lo[0] > xmax or hi[1] < ymin or lo[1] > ymax:
+                continue
+            tile_polygons = []
+            for polygon in polygons:
+                rings = []
+                for i, ring in enumerate(polygon):
+                    clipped = clip_ring(ring, xmin, ymin, xmax, ymax)
+                    if len(clipped) < 3:
+                        if i == 0:
+                            break
+                        continue
+                    pixels = np.round((clipped * scale - (x, y)) * EXTENT).astype(np.int64)
+                    pixels = _tile_ring(pixels, exterior=(i == 0))
+                    if pixels is None:
+                        if i == 0:
+                            break
+                        continue
+                    rings.append(pixels)
+                if rings:
+                    tile_polygons.append(rings)
+            if tile_polygons:
+                by_class[cls].append((fid, attributes, tile_polygons))
+
+        return b''.join(encode_layer('class{}'.format(cls), features)
+                        for cls, features in enumerate(by_class) if features)
+
+    def bounds(self):
+        """World bounding box of all features at full resolution."""
+        world = self._world(len(self.engine.lod.zooms) - 1)
+        los = np.array([world[fid][1] for fid in self.features])
+        his = np.array([world[fid][2] for fid in self.features])
+        return los.min(axis=0), his.max(axis=0)
+
+
+class TileServer:
+    """Named :class:`TileLayer` objects with an LRU of rendered tiles."""
+
+    def __init__(self, maxsize=4096, seed_dir=SEED_DIR, version='',
+                 url_prefix='/tiles/'):
+        self.layers = {}
+        self.cache = LRUCache(maxsize)
+        self.seed_dir = Path(seed_dir) if seed_dir is not None else None
+        self.version = version
+        self.url_prefix = url_prefix
+
+    def add_layer(self, name, engine, df, key, metric, breaks, decimals=0):
+        return self.add(name, TileLayer(engine, df, key, metric, breaks, decimals))
+
+    def add(self, name, layer):
+        """Serve ``layer``, anything with ``render(z, x, y)`` and ``bounds()``."""
+        self.layers[name] = layer
+        return layer
+
+    def _seed_path(self, name, z, x, y):
+        return self.seed_dir / self.version / name / str(z) / str(x) / '{}.pbf'.format(y)
+
+    def tile(self, name, z, x, y):
+        """Gzipped tile bytes."""
+        def build():
+            if self.seed_dir is not None:
+                try:
+                    return self._seed_path(name, z, x, y).read_bytes()
+                except OSError:
+                    pass
+            return _gzip(self.layers[name].render(z, x, y))
+        return self.cache.get_or_compute((name, z, x, y), build)
+
+    def url(self, name):
+        path = '{}{}/{{z}}/{{x}}/{{y}}.pbf?v={}'.format(self.url_prefix, name, self.version)
+        if has_request_context():
+            return request.url_root.rstrip('/') + path
+        return path
+
+    def mapbox_layers(self, name, colors, opacity=0.8, outline="#afafaf",
+                      minzoom=None, maxzoom=None):
+        """plotly ``layout.mapbox.layers`` drawing ``name`` with one color per class,
+        optionally only from ``minzoom`` and below ``maxzoom``."""
+        source = [self.url(name)]
+        layers = []
+        for cls, color in enumerate(colors):
+            layer = dict(
+                sourcetype="vector",
+                source=source,
+                sourcelayer='class{}'.format(cls),
+                type="fill",
+                color=color,
+                opacity=opacity,
+                fill=dict(outlinecolor=outline or color),
+            )
+            if minzoom is not None:
+                layer['minzoom'] = minzoom
+            if maxzoom is not None:
+                layer['maxzoom'] = maxzoom
+            layers.append(layer)
+        return layers
+
+    def seed(self, max_zoom, names=None):
+        """Write every non-empty tile up to ``max_zoom`` below ``seed_dir``."""
+        written = 0
+        for name in names or self.layers:
+            layer = self.layers[name]
+            lo, hi = layer.bounds()
+            for z in range(max_zoom + 1):
+                scale = 2 ** z
+                x0, y0 = (np.floor(lo * scale)).astype(int)
+                x1, y1 = (np.floor(hi * scale)).astype(int)
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        body = layer.render(z, x, y)
+                        if not body:
+                            continue
+                        path = self._seed_path(name, z, x, y)
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        path.write_bytes(_gzip(body))
+                        written += 1
+        return written
+
+
+def register_tile_route(server, tile_server):
+    """Add ``<url_prefix><layer>/<z>/<x>/<y>.pbf`` to the Flask ``server``."""
+
+    def serve_tile(name, z, x, y):
+        if name not in tile_server.layers or z > MAX_ZOOM or not (
+                0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            abort(404)
+        headers = {
+            'Cache-Control': 'public, max-age=86400',
+            'Vary': 'Accept-Encoding',
+            'Access-Control-Allow-Origin': '*',
+        }
+        body = tile_server.tile(name, z, x, y)
+        # tiles are kept gzipped; the rare client without gzip gets them raw
+        if _pick_encoding(request.headers.get('Accept-Encoding', ''), ('gzip',)):
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            body = gzip.decompress(body)
+        return Response(body, headers=headers, mimetype='application/vnd.mapbox-vector-tile')
+
+    server.add_url_rule(tile_server.url_prefix + '<name>/<int:z>/<int:x>/<int:y>.pbf',
+                        'serve_tile', serve_tile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, metavar='ZOOM', required=True,
+                        help='pre-render every tile up to this zoom')
+    args = parser.parse_args()
+
+    # the layers are configured by the app
+    import Map_test
+    written = Map_test.tile_server.seed(args.seed)
+    print('{} tiles written to {}'.format(written, Map_test.tile_server.seed_dir))
+
+
+if __name__ == '__main__':
+    main()
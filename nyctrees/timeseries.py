@@ -0,0 +1,113 @@
+"""Per area metrics of every valuation year, memory-mapped by year.
+
+The store is a directory partitioned by year::
+
+    years/meta.json          years, the current one, metric columns and
+                             area names per view
+    years/<i>/<view>.npy     float32 (areas x metrics) of year i
+    years/<i>/<view>.delta.npy   the same minus year i - 1 (NaN for the first)
+
+Rows follow the area names of the view in ``meta.json`` (see
+:func:`area_keys`); an area missing in a year is NaN there. Arrays are
+memory-mapped, so the store costs memory only for the years that are read,
+and reading a year is an index into its array: nothing is aggregated after
+:func:`write_years`.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+YEARS_DIR = 'years'
+METRICS = ('trees/sq.mile', 'health', 'avg.landprice_thous$/acre',
+           'avg.propvalue_thous$/acre', 'properties/sq.mile')
+
+
+def area_keys(names):
+    """Area names made unique: repeats (an NTA in two boroughs) get ``#2``, ``#3``..."""
+    names = pd.Series(pd.Index(names).astype(str))
+    repeat = names.groupby(names).cumcount()
+    return pd.Index(names.where(repeat == 0, names + '#' + (repeat + 1).astype(str)))
+
+
+def write_years(out_dir, views, metrics=METRICS, current=None):
+    """Write ``views`` (view -> {year: table indexed by area name}) below
+    ``out_dir``; years are kept in the order given. ``current`` is the year
+    of the snapshot tables (the last year by default)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    years = list(next(iter(views.values())))
+    meta = {'years': years, 'current': current if current in years else years[-1],
+            'metrics': list(metrics), 'views': {}}
+    for view, tables in views.items():
+        # areas in order of first appearance, so the latest tables only append
+        names = pd.Index([])
+        for table in tables.values():
+            names = names.append(area_keys(table.index).difference(names, sort=False))
+        meta['views'][view] = names.tolist()
+        previous = None
+        for i, year in enumerate(years):
+            table = tables[year]
+            table = table.set_axis(area_keys(table.index), axis=0).reindex(names)
+            values = np.column_stack([
+                table[metric].values if metric in table else np.full(len(names), np.nan)
+                for metric in metrics]).astype(np.float32)
+            year_dir = out_dir / str(i)
+            year_dir.mkdir(exist_ok=True)
+            np.save(str(year_dir / '{}.npy'.format(view)), values)
+            delta = values - previous if previous is not None else np.full_like(values, np.nan)
+            np.save(str(year_dir / '{}.delta.npy'.format(view)), delta)
+            previous = values
+    (out_dir / 'meta.json').write_text(json.dumps(meta))
+
+
+class YearStore:
+    """Read side of :func:`write_years`."""
+
+    def __init__(self, path, meta, mmap_mode='r'):
+        self.path = Path(path)
+        self.years = meta['years']
+        self.current = meta.get('current', self.years[-1])
+        self.metrics = meta['metrics']
+        self.names = meta['views']
+        self.mmap_mode = mmap_mode
+        self._arrays = {}
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """The store at ``path``, or None when there is none."""
+        try:
+            meta = json.loads((Path(path) / 'meta.json').read_text())
+        except (OSError, ValueError):
+            return None
+        return cls(path, meta, mmap_mode)
+
+    def _array(self, view, year, suffix=''):
+        key = (view, year, suffix)
+        if key not in self._arrays:
+            filename = '{}{}.npy'.format(view, suffix)
+            self._arrays[key] = np.load(str(self.path / str(self.years.index(year)) / filename),
+                                        mmap_mode=self.mmap_mode)
+        return self._arrays[key]
+
+    def rows(self, view, names):
+        """Rows of the store holding ``names`` (-1 where the store has none)."""
+        return pd.Index(self.names[view]).get_indexer(area_keys(names))
+
+    def previous(self, year):
+        """The year before ``year``, or None."""
+        i = self.years.index(year)
+        return self.years[i - 1] if i else None
+
+    def values(self, view, year, metric, rows=None, delta=False):
+        """``metric`` of ``year`` per row (or per ``rows``, NaN where -1)."""
+        array = self._array(view, year, '.delta' if delta else '')
+        column = array[:, self.metrics.index(metric)]
+        if rows is None:
+            return np.asarray(column)
+        return np.where(rows >= 0, column[np.maximum(rows, 0)], np.nan)
+
+    def pooled(self, view, metric):
+        """``metric`` of every area in every year, for class breaks shared by all."""
+        return np.concatenate([self.values(view, year, metric) for year in self.years])
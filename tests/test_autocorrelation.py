@@ -0,0 +1,127 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from nyctrees.autocorrelation import (HIGH_HIGH, LOW_LOW, NOT_SIGNIFICANT,
+                                      AutocorrelationEngine, contiguity, lisa, moran,
+                                      row_standardize)
+
+
+def lattice(rows, cols):
+    polygons = []
+    for row in range(rows):
+        for col in range(cols):
+            ring = np.array([[col, row], [col + 1, row], [col + 1, row + 1],
+                             [col, row + 1], [col, row]], dtype=np.int64)
+            polygons.append([ring])
+    return polygons
+
+
+def test_queen_and_rook_contiguity():
+    queen = contiguity(lattice(3, 3), 'queen')
+    rook = contiguity(lattice(3, 3), 'rook')
+    assert (queen != queen.T).nnz == 0
+    np.testing.assert_array_equal(np.diff(queen.indptr), [3, 5, 3, 5, 8, 5, 3, 5, 3])
+    np.testing.assert_array_equal(np.diff(rook.indptr), [2, 3, 2, 3, 4, 3, 2, 3, 2])
+    assert rook[0, 1] and rook[0, 3] and not rook[0, 4] and queen[0, 4]
+
+
+def test_area_without_geometry_has_no_neighbors():
+    polygons = lattice(2, 2) + [[]]
+    w = contiguity(polygons)
+    assert w.shape == (5, 5)
+    assert np.diff(w.indptr)[-1] == 0
+
+
+def test_moran_matches_formula():
+    rng = np.random.RandomState(0)
+    w = row_standardize(contiguity(lattice(5, 5), 'rook'))
+    values = rng.randn(25)
+    z = values - values.mean()
+    dense = w.toarray()
+    expected = len(z) / dense.sum() * z.dot(dense).dot(z) / z.dot(z)
+    result = moran(values, w, permutations=0)
+    assert result.I == pytest.approx(expected)
+    assert result.expected == pytest.approx(-1 / 24)
+
+
+def test_moran_detects_clustering_and_dispersion():
+    w = row_standardize(contiguity(lattice(8, 8), 'rook'))
+    rows, cols = np.divmod(np.arange(64), 8)
+    clustered = moran(rows + cols, w, permutations=999)
+    assert clustered.I > 0.5 and clustered.p_sim == pytest.approx(1 / 1000)
+    checkerboard = moran((rows + cols) % 2, w, permutations=999)
+    assert checkerboard.I == pytest.approx(-1)
+    assert checkerboard.z < 0
+
+
+def exact_folded_p(z, i, neighbors, weight, m2, observed):
+    """Folded p-value of area ``i`` over every draw of its neighbors."""
+    others = np.delete(z, i)
+    sums = np.array([others[list(draw)].sum()
+                     for draw in itertools.combinations(range(len(others)), neighbors)])
+    simulated = z[i] * weight * sums / m2
+    larger = (simulated >= observed).mean()
+    return min(larger, 1 - larger)
+
+
+def test_lisa_against_exact_conditional_permutations():
+    rng = np.random.RandomState(1)
+    w = row_standardize(contiguity(lattice(3, 4), 'queen'))
+    values = rng.randn(12)
+    permutations = 19999
+    result = lisa(values, w, permutations=permutations)
+    z = values - values.mean()
+    m2 = z.dot(z) / len(z)
+    np.testing.assert_allclose(result.local, z * w.dot(z) / m2)
+    degree = np.diff(w.indptr)
+    for i in range(12):
+        exact = exact_folded_p(z, i, degree[i], 1.0 / degree[i], m2, result.local[i])
+        assert result.p_sim[i] == pytest.approx(exact, abs=0.015)
+
+
+def test_lisa_quadrants_and_clusters():
+    w = row_standardize(contiguity(lattice(8, 8), 'queen'))
+    rows, cols = np.divmod(np.arange(64), 8)
+    # a high corner and a low corner
+    values = -((rows - 0) ** 2 + (cols - 0) ** 2) + ((rows - 7) ** 2 + (cols - 7) ** 2)
+    result = lisa(values.astype(float), w, permutations=999)
+    assert result.clusters[0] == HIGH_HIGH and result.clusters[63] == LOW_LOW
+    assert (result.clusters[result.p_sim > 0.05] == NOT_SIGNIFICANT).all()
+
+
+def test_engine_leaves_out_undefined_values():
+    engine = AutocorrelationEngine(lattice(4, 4), permutations=99)
+    values = np.arange(16, dtype=float)
+    values[5] = np.nan
+    result = engine.lisa(values)
+    assert np.isnan(result.local[5]) and result.clusters[5] == NOT_SIGNIFICANT
+    assert np.isfinite(np.delete(result.local, 5)).all()
+    assert np.isfinite(engine.moran(values).I)
+
+
+def test_rows_sharing_an_area_are_not_neighbors(tmp_path):
+    import json
+
+    from nyctrees.choropleth import ChoroplethEngine
+
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'name': name},
+         'geometry': {'type': 'Polygon', 'coordinates': [lattice(1, 4)[i][0].tolist()]}}
+        for i, name in enumerate('abcd')]}
+    path = tmp_path / 'areas.geojson'
+    path.write_text(json.dumps(collection))
+    geometry = ChoroplethEngine(path, 'name', cache_dir=tmp_path)
+    # 'b' is listed twice, as an NTA in two boroughs is
+    engine = AutocorrelationEngine.from_engine(geometry, ['a', 'b', 'b', 'c', 'd'],
+                                               permutations=99)
+    assert engine.contiguity.shape == (4, 4)
+    np.testing.assert_array_equal(engine.neighbors(), [1, 2, 2, 1])
+    values = np.array([1.0, 2.0, 4.0, 5.0, 9.0])
+    result = engine.lisa(values)
+    assert len(result.local) == 5 and result.local[1] == result.local[2]
+    # the same as one row per area, with the mean of the repeated rows
+    single = AutocorrelationEngine(lattice(1, 4), permutations=99)
+    np.testing.assert_allclose(result.local[[0, 1, 3, 4]], single.lisa([1, 3, 5, 9]).local)
+    assert engine.moran(values).I == pytest.approx(single.moran([1, 3, 5, 9]).I)
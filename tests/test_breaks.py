@@ -0,0 +1,72 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from nyctrees.breaks import (class_breaks, equal_interval_breaks, jenks_breaks, palette,
+                             quantile_breaks, truncate)
+
+
+def squared_deviations(x, bounds):
+    """Within-class sum of squared deviations, classes ending at ``bounds``."""
+    classes = np.searchsorted(bounds, x, side='left')
+    return sum(((x[classes == c] - x[classes == c].mean()) ** 2).sum()
+               for c in np.unique(classes))
+
+
+def brute_force_jenks(values, k):
+    distinct = np.unique(values)
+    return min(squared_deviations(values, np.array(bounds))
+               for bounds in itertools.combinations(distinct[:-1], k - 1))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('k', [2, 3, 5])
+def test_jenks_is_optimal(seed, k):
+    rng = np.random.RandomState(seed)
+    # with ties, which never straddle a break
+    values = np.round(rng.lognormal(size=14), 1)
+    bounds = jenks_breaks(values, k)
+    assert len(bounds) == k - 1
+    assert list(bounds) == sorted(bounds)
+    assert squared_deviations(values, bounds) == pytest.approx(brute_force_jenks(values, k))
+
+
+def test_jenks_separates_clusters():
+    values = np.r_[np.linspace(0, 1, 50), np.linspace(10, 11, 30), np.linspace(100, 101, 5)]
+    np.testing.assert_array_equal(jenks_breaks(values, 3), [1, 11])
+
+
+def test_jenks_with_fewer_distinct_values_than_classes():
+    np.testing.assert_array_equal(jenks_breaks([1, 1, 2, 2], 5), [1])
+    assert len(jenks_breaks([3, 3, 3], 4)) == 0
+
+
+def test_quantile_and_equal_interval():
+    values = np.arange(1, 101)
+    np.testing.assert_array_equal(quantile_breaks(values, 4), [25, 50, 75])
+    np.testing.assert_allclose(equal_interval_breaks(values, 3), [34, 67])
+
+
+def test_truncate_does_not_floor_representation_error():
+    assert truncate(14.32, 2) == 1432
+    assert truncate(np.float32(14.32), 2) == 1432
+
+
+def test_class_breaks_labels():
+    values = np.r_[np.linspace(0, 1, 50), np.linspace(10, 11, 30), np.nan, np.inf]
+    classes = class_breaks(values, 'jenks', k=2, decimals=1)
+    assert classes.breaks == [1.0]
+    assert classes.labels() == ['0.0-1.0', '1.1-11.0']
+    assert len(classes) == 2
+
+
+def test_class_breaks_of_constant_and_empty_values():
+    assert class_breaks([5.0, 5.0]).labels() == ['5']
+    assert len(class_breaks([np.nan])) == 1
+
+
+def test_palette_spreads_colors():
+    colors = list('abcdefg')
+    assert palette(colors, 3) == ['a', 'd', 'g']
+    assert palette(colors, 1) == ['g']
@@ -0,0 +1,54 @@
+import numpy as np
+
+from nyctrees.cache import LRUCache, SharedCache, code_version
+
+
+def test_lru_evicts_the_least_recent():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get_or_compute('d', lambda: 4) == 4
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_shared_cache_memoizes(tmp_path):
+    cache = SharedCache(tmp_path / 'callbacks.sqlite', version='1')
+    calls = []
+
+    @cache.memoize(lambda x, y: [x])
+    def double(x, y):
+        calls.append(x)
+        return {'value': np.arange(x) * 2}
+
+    assert double(3, 'ignored')['value'].tolist() == [0, 2, 4]
+    # hits come back JSON decoded
+    assert double(3, 'other') == {'value': [0, 2, 4]}
+    assert calls == [3]
+    other = SharedCache(tmp_path / 'callbacks.sqlite', version='2')
+    assert other.get(double.__module__ + '.' + double.__qualname__, [3]) is None
+
+
+def test_unwritable_cache_steps_aside(tmp_path):
+    # the cache directory cannot be created below a regular file
+    blocker = tmp_path / 'not-a-directory'
+    blocker.write_text('')
+    cache = SharedCache(blocker / 'cache' / 'callbacks.sqlite')
+
+    @cache.memoize(lambda x: [x])
+    def square(x):
+        return x * x
+
+    assert square(4) == 16
+    assert square(4) == 16
+
+
+def test_code_version_changes_with_the_files(tmp_path):
+    app = tmp_path / 'app.py'
+    app.write_text('a = 1\n')
+    before = code_version(str(app))
+    assert code_version(str(app)) == before
+    app.write_text('a = 2\n')
+    assert code_version(str(app)) != before
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pytest
+
+from nyctrees.centroids import Rings, area_centroids, label_points, signed_distance
+from nyctrees.data import DATA_DIR
+
+
+def square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+def feature(kind, coordinates):
+    return {'geometry': {'type': kind, 'coordinates': coordinates}}
+
+
+FEATURES = [
+    feature('Polygon', [square(0, 0, 2, 2)]),
+    # a hole in the right half moves the centroid left
+    feature('Polygon', [square(0, 0, 4, 4), square(2, 1, 4, 3)[::-1]]),
+    # two parts, the larger one weighing more; the second ring is clockwise
+    feature('MultiPolygon', [[square(0, 0, 1, 1)], [square(3, 0, 5, 2)[::-1]]]),
+    # a C shape, whose centroid lies outside it
+    feature('Polygon', [[[0, 0], [3, 0], [3, 1], [1, 1], [1, 2], [3, 2], [3, 3], [0, 3],
+                         [0, 0]]]),
+]
+
+
+def test_area_centroids():
+    lon, lat, area = area_centroids(Rings(FEATURES))
+    np.testing.assert_allclose(area, [4, 12, 5, 7])
+    np.testing.assert_allclose(lon[:3], [1, (16 * 2 - 4 * 3) / 12, (0.5 + 4 * 4) / 5])
+    np.testing.assert_allclose(lat[:3], [1, 2, (0.5 + 4 * 1) / 5])
+
+
+def test_signed_distance():
+    rings = Rings(FEATURES)
+    d = signed_distance(rings, [1, 1, 3, 2], [1, 1.9, 1, 1.5], [0, 0, 0, 3])
+    np.testing.assert_allclose(d, [1, 0.1, -1, -0.5])
+
+
+def test_label_points_are_deep_inside():
+    rings = Rings(FEATURES)
+    lon, lat, depth = label_points(rings)
+    assert (signed_distance(rings, lon, lat, np.arange(4)) > 0).all()
+    np.testing.assert_allclose([lon[0], lat[0], depth[0]], [1, 1, 1], atol=2e-3)
+    # the C shape's best spots are in its corners, where a circle touches
+    # both outer sides and the inner corner: r = sqrt(2) (1 - r)
+    r = np.sqrt(2) / (1 + np.sqrt(2))
+    assert depth[3] == pytest.approx(r, abs=3e-3)
+    assert lon[3] == pytest.approx(r, abs=3e-3)
+
+
+def test_ntas_match_shapely():
+    pytest.importorskip('shapely')
+    from shapely.geometry import shape
+
+    with open(str(DATA_DIR / 'NeighborhoodTabulationAreas.geojson')) as f:
+        features = json.load(f)['features']
+    lon, lat, _ = area_centroids(Rings(features))
+    reference = np.array([shape(item['geometry']).centroid.coords[0] for item in features])
+    np.testing.assert_allclose(lon, reference[:, 0], atol=1e-9)
+    np.testing.assert_allclose(lat, reference[:, 1], atol=1e-9)
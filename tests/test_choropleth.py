@@ -0,0 +1,33 @@
+import json
+
+import numpy as np
+
+from nyctrees.choropleth import ChoroplethEngine, classify, stepped_colorscale
+
+
+def square(x, y):
+    return [[x, y], [x + 1, y], [x + 1, y + 1], [x, y + 1], [x, y]]
+
+
+def test_classify_uses_inclusive_upper_bounds():
+    classes = classify([0, 500, 500.7, 501, 1000, 1001], [500, 1000])
+    np.testing.assert_array_equal(classes, [0, 0, 0, 1, 1, 2])
+    np.testing.assert_array_equal(classify([1.26, 1.24], [1.25], decimals=2), [1, 0])
+
+
+def test_stepped_colorscale_paints_whole_classes():
+    assert stepped_colorscale(['a', 'b']) == [[0, 'a'], [0.5, 'a'], [0.5, 'b'], [1, 'b']]
+
+
+def test_areas_without_a_value_are_left_out(tmp_path):
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'name': name},
+         'geometry': {'type': 'Polygon', 'coordinates': [square(i, 0)]}}
+        for i, name in enumerate('abc')]}
+    path = tmp_path / 'areas.geojson'
+    path.write_text(json.dumps(collection))
+    engine = ChoroplethEngine(path, 'name', cache_dir=tmp_path)
+    trace = engine.trace(['a', 'b', 'c'], [10.0, np.nan, 2000.0], [500, 1000],
+                         ['#000', '#111', '#222'])
+    assert trace['locations'] == ['a', 'c']
+    np.testing.assert_array_equal(trace['z'], [0, 2])
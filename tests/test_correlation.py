@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from nyctrees.correlation import CorrelationEngine
+
+METRICS = ['a', 'b', 'c']
+
+
+@pytest.fixture
+def df():
+    rng = np.random.RandomState(0)
+    values = rng.randn(40, 3).dot([[1, 0.5, 0], [0, 1, 0.3], [0, 0, 1]])
+    df = pd.DataFrame(np.round(values, 1), columns=METRICS)
+    # an area missing in a year, and one missing a single metric
+    df.iloc[3] = np.nan
+    df.iloc[7, 1] = np.nan
+    return df
+
+
+def reference(df, mask=None):
+    rows = df if mask is None else df[mask]
+    return rows.dropna()
+
+
+def test_pearson_and_spearman_match_scipy(df):
+    engine = CorrelationEngine(df, METRICS)
+    mask = np.arange(len(df)) % 3 != 0
+    mask[3] = mask[7] = True
+    for selection in [None, mask]:
+        rows = reference(df, selection)
+        r, p, n = engine.pearson(selection)
+        rho = engine.spearman(selection)
+        assert n == len(rows)
+        for i in range(3):
+            for j in range(3):
+                if i == j:
+                    continue
+                expected_r, expected_p = stats.pearsonr(rows.iloc[:, i], rows.iloc[:, j])
+                assert r[i, j] == pytest.approx(expected_r)
+                assert p[i, j] == pytest.approx(expected_p)
+                assert rho[i, j] == pytest.approx(
+                    stats.spearmanr(rows.iloc[:, i], rows.iloc[:, j])[0])
+
+
+def test_annotations_have_no_nan(df):
+    engine = CorrelationEngine(df, METRICS)
+    ann = engine.annotations()
+    assert len(ann) == 6
+    for cell in ann:
+        assert 'nan' not in cell['text']
+        assert np.isfinite(cell['x']) and np.isfinite(cell['y'])
+
+
+def test_selection_of_missing_rows_only(df):
+    engine = CorrelationEngine(df, METRICS)
+    mask = np.zeros(len(df), dtype=bool)
+    mask[[3, 7, 10]] = True
+    r, _, n = engine.pearson(mask)
+    assert n == 1
+    assert np.isnan(r).all()
+    assert engine.annotations(mask) == []
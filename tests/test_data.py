@@ -0,0 +1,60 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyctrees.data import DATA_DIR, SCHEMAS, _read_csv, build_snapshot, load_snapshot
+
+
+def memory_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    return load_snapshot(cache_dir=tmp_path_factory.mktemp('cache'))
+
+
+def test_snapshot_matches_the_csv_files(snapshot):
+    for name, (filename, schema) in SCHEMAS.items():
+        df = snapshot.tables[name]
+        expected = _read_csv(DATA_DIR / filename, schema)
+        assert list(df.columns) == list(schema)
+        for column, kind in schema.items():
+            if kind in ('category', 'str'):
+                assert df[column].astype(str).tolist() == expected[column].astype(str).tolist()
+            else:
+                assert df[column].dtype == kind
+                np.testing.assert_allclose(df[column].to_numpy(), expected[column],
+                                           rtol=1e-6, equal_nan=True)
+
+
+def test_snapshot_columns_stay_memory_mapped(snapshot):
+    for name, (_, schema) in SCHEMAS.items():
+        df = snapshot.tables[name]
+        for column, kind in schema.items():
+            if kind == 'category':
+                assert memory_mapped(np.asarray(df[column].array.codes)), (name, column)
+            elif kind != 'str':
+                assert memory_mapped(df[column].to_numpy()), (name, column)
+    nta = snapshot.nta
+    assert nta.groupby('borough', observed=True)['area'].sum().sum() == \
+        pytest.approx(float(nta['area'].sum()), rel=1e-5)
+
+
+def test_failed_build_leaves_no_temp_directory(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    for filename, _ in SCHEMAS.values():
+        shutil.copy(str(DATA_DIR / filename), str(data_dir / filename))
+    filename = SCHEMAS['species'][0]
+    pd.read_csv(data_dir / filename).drop(columns='spc_per').to_csv(data_dir / filename)
+    cache_dir = tmp_path / 'cache'
+    with pytest.raises(ValueError):
+        build_snapshot(data_dir, cache_dir)
+    assert list(cache_dir.iterdir()) == []
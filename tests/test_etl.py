@@ -0,0 +1,133 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyctrees.etl import HEALTH_LEVEL, PROPERTY_YEAR, SQFT_PER_SQMILE, rebuild
+from nyctrees.raster import TREE_POINTS_FILE, TreePoints
+
+# name, borough, sq. miles, west edge of the area's square; 'b' is drawn as
+# two features, as an area split by a river can be
+AREAS = [('A', 'Brooklyn', 2.0, -74.00), ('B', 'Brooklyn', 1.0, -73.98),
+         ('B', 'Brooklyn', 1.0, -73.97), ('C', 'Queens', 4.0, -73.96),
+         ('D', 'Queens', 0.5, -73.94)]
+# name, borough, species, health, trees; 'c' also has trees filed under
+# another borough, as a few NTAs of the census do
+TREES = [('A', 'Brooklyn', 'London planetree', 'Good', 3),
+         ('A', 'Brooklyn', 'pin oak', 'Poor', 2),
+         ('A', 'Brooklyn', '', '', 1),
+         ('B', 'Brooklyn', 'pin oak', 'Fair', 4),
+         ('C', 'Queens', 'honeylocust', 'Good', 5),
+         ('C', 'Brooklyn', 'honeylocust', 'Fair', 1),
+         ('D', 'Queens', 'London planetree', '', 3)]
+# name, borough, year, avland, lots
+LOTS = [('A', 'Brooklyn', PROPERTY_YEAR, 200000.0, 4),
+        ('A', 'Brooklyn', '2014/15', 100000.0, 4),
+        ('B', 'Brooklyn', PROPERTY_YEAR, 300000.0, 2),
+        ('C', 'Queens', PROPERTY_YEAR, 150000.0, 6),
+        ('D', 'Queens', PROPERTY_YEAR, 250000.0, 1)]
+
+
+def square(x, y, size=0.01):
+    return [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]
+
+
+def lon_of(name):
+    return next(west for area, _, _, west in AREAS if area == name) + 0.005
+
+
+def area_of(name):
+    return next(sq for area, _, sq, _ in AREAS if area == name) * SQFT_PER_SQMILE
+
+
+def write_geojson(path, features):
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': properties,
+         'geometry': {'type': 'Polygon', 'coordinates': coordinates}}
+        for properties, coordinates in features]}))
+
+
+@pytest.fixture(scope='module')
+def rebuilt(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('etl')
+    write_geojson(tmp / 'NeighborhoodTabulationAreas.geojson', [
+        ({'ntaname': name, 'boro_name': borough}, square(west, 40.60))
+        for name, borough, _, west in AREAS])
+    write_geojson(tmp / 'BoroughBoundaries.geojson', [
+        ({'boro_name': 'Brooklyn'}, square(-74.0, 40.6, 0.04)),
+        ({'boro_name': 'Queens'}, square(-73.96, 40.6, 0.04))])
+    trees = pd.DataFrame(
+        [(name, borough, species, health, area_of(name), 40.605, lon_of(name))
+         for name, borough, species, health, n in TREES for _ in range(n)],
+        columns=['nta_name', 'boroname', 'spc_common', 'health', 'shape_area', 'latitude',
+                 'longitude']).rename(columns={'nta_name': 'NTAName', 'boroname': 'borough'})
+    trees.insert(0, 'tree_id', np.arange(len(trees)))
+    trees.to_csv(tmp / 'trees.csv', index=False)
+    lots = pd.DataFrame(
+        [(name, borough, year, 2 * avland, avland, 0.9 * avland, 40.605, lon_of(name))
+         for name, borough, year, avland, n in LOTS for _ in range(n)],
+        columns=['NTA', 'BOROUGH', 'YEAR', 'FULLVAL', 'AVLAND', 'AVTOT', 'Latitude',
+                 'Longitude'])
+    lots.to_csv(tmp / 'lots.csv', index=False)
+    # a few rows per block, so the sums span many blocks
+    tables = rebuild(tmp / 'trees.csv', tmp / 'lots.csv', out_dir=tmp / 'out',
+                     geometry_dir=tmp, workers=2, block_size=256)
+    return tables, tmp / 'out'
+
+
+def test_row_counts(rebuilt):
+    tables, out = rebuilt
+    species = tables['GroupedTreesDataSpecies.csv']
+    assert len(species) == 6
+    assert len(tables['GroupedTreesData.csv']) == 5
+    merged = tables['MergedTreesPropertiesDataNoOutliers.csv']
+    assert sorted(zip(merged['ntaname'], merged['borough'])) == [
+        ('a', 'brooklyn'), ('b', 'brooklyn'), ('c', 'brooklyn'), ('c', 'queens'),
+        ('d', 'queens')]
+    # one row per area row, though 'b' has two features
+    with_centers = tables['Trees_Properties_With_Centroids.csv']
+    assert len(with_centers) == len(merged)
+    assert len(tables['Trees_Properties_With_Centroids_Boro.csv']) == 2
+    written = pd.read_csv(out / 'Trees_Properties_With_Centroids.csv', index_col=0)
+    assert len(written) == len(with_centers)
+
+
+def test_per_area_aggregates(rebuilt):
+    tables, _ = rebuilt
+    areas = tables['Trees_Properties_With_Centroids.csv'].set_index(['ntaname', 'borough'])
+    trees = tables['MergedTreesPropertiesData.csv'].set_index(['ntaname', 'borough'])['#trees']
+    a = areas.loc[('a', 'brooklyn')]
+    # the tree without a species counts towards the species totals only
+    assert trees[('a', 'brooklyn')] == 5
+    assert a['area'] == pytest.approx(2.0)
+    assert a['health'] == pytest.approx((3 * HEALTH_LEVEL['good'] + 2 * HEALTH_LEVEL['poor']) / 5,
+                                        abs=0.01)
+    assert a['trees/sq.mile'] == pytest.approx(2.5)
+    # only the lots of PROPERTY_YEAR
+    assert a['avg.landprice_thous$/acre'] == pytest.approx(200.0)
+    assert a['properties/sq.mile'] == pytest.approx(2.0)
+    assert areas.loc[('d', 'queens'), 'health'] == 0
+    assert (trees[('c', 'queens')], trees[('c', 'brooklyn')]) == (5, 1)
+    assert a['centerLong'] == pytest.approx(lon_of('A'), abs=1e-6)
+
+    species = tables['GroupedTreesDataSpecies.csv']
+    pin_oak = species[(species['ntaname'] == 'a') & (species['spc_common'] == 'pin oak')]
+    assert pin_oak['total'].tolist() == [6]
+    assert pin_oak['spc_per'].tolist() == pytest.approx([100 * 2 / 6])
+
+
+def test_tree_points_gathered_from_every_block(rebuilt):
+    _, out = rebuilt
+    points = TreePoints.load(out / TREE_POINTS_FILE)
+    with_species = [(species, health, n) for _, _, species, health, n in TREES if species]
+    assert len(points) == sum(n for _, _, n in with_species)
+    assert points.species_names == sorted({species.lower() for species, _, _ in with_species})
+    assert int(points.health.sum()) == sum(HEALTH_LEVEL.get(health.lower(), 0) * n
+                                           for _, health, n in with_species)
+    counts = np.bincount(points.species, minlength=len(points.species_names))
+    expected = {}
+    for species, _, n in with_species:
+        expected[species.lower()] = expected.get(species.lower(), 0) + n
+    assert dict(zip(points.species_names, counts.tolist())) == expected
+    assert (np.diff(points.y.astype(np.int64)) >= 0).all()
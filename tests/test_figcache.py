@@ -0,0 +1,69 @@
+from flask import Flask, request
+
+from nyctrees.figcache import DEFAULT_ZOOM, FigureCache
+
+
+def make_cache():
+    calls = []
+
+    def build(view, feature, figure):
+        calls.append((view, feature, figure['layout']['mapbox']['zoom']))
+        layers = [{'source': [request.url_root + 'tiles/' + view]}]
+        return {'data': [{'text': ['a "quoted" <b>name</b>']}],
+                'layout': {'mapbox': {'center': None, 'zoom': None, 'layers': layers}}}
+
+    cache = FigureCache(Flask(__name__), build, zoom_bucket=lambda zoom: int(zoom >= 12))
+    return cache, calls
+
+
+def state(lat, lon, zoom):
+    return {'layout': {'mapbox': {'center': {'lat': lat, 'lon': lon}, 'zoom': zoom}}}
+
+
+def test_figure_echoes_the_view_and_host():
+    cache, _ = make_cache()
+    figure = cache.figure(('nta', 'trees'), state(40.7, -73.9, 11.5), 'http://example.org:8050/')
+    assert figure['layout']['mapbox']['center'] == {'lat': 40.7, 'lon': -73.9}
+    assert figure['layout']['mapbox']['zoom'] == 11.5
+    assert figure['layout']['mapbox']['layers'][0]['source'] == [
+        'http://example.org:8050/tiles/nta']
+    assert figure['data'][0]['text'] == ['a "quoted" <b>name</b>']
+
+
+def test_spliced_host_is_json_escaped():
+    cache, _ = make_cache()
+    root = 'http://evil"host\\/'
+    figure = cache.figure(('nta', 'trees'), None, root)
+    assert figure['layout']['mapbox']['layers'][0]['source'] == ['http://evil"host\\/tiles/nta']
+    assert figure['layout']['mapbox']['zoom'] == DEFAULT_ZOOM
+
+
+def test_one_build_per_zoom_bucket():
+    cache, calls = make_cache()
+    for zoom in (10, 11, 11.9, 12, 15):
+        cache.figure(('nta', 'trees'), state(0, 0, zoom), '')
+    cache.figure(('boro', 'trees'), state(0, 0, 10), '')
+    assert [call[:2] for call in calls] == [('nta', 'trees'), ('nta', 'trees'), ('boro', 'trees')]
+
+
+def test_installed_cache_splices_the_encoded_figure():
+    import json
+
+    from flask import jsonify
+
+    cache, calls = make_cache()
+    cache.install()
+    view = state(40.7, -73.9, 11.5)
+
+    @cache.server.route('/update', methods=['POST'])
+    def update():
+        # as Dash encodes the callback output
+        return jsonify(response={'map': {'data': cache.figure(('nta', 'trees'), view,
+                                                              request.url_root)}})
+
+    response = cache.server.test_client().post('/update', base_url='http://example.org')
+    figure = json.loads(response.get_data(as_text=True))['response']['map']['data']
+    assert figure == cache.figure(('nta', 'trees'), view, 'http://example.org/')
+    assert figure['layout']['mapbox']['layers'][0]['source'] == ['http://example.org/tiles/nta']
+    assert response.content_length == len(response.get_data())
+    assert len(calls) == 1
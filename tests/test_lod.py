@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from nyctrees.lod import GRID, LODPyramid, douglas_peucker
+
+
+def distance_to_polyline(points, line):
+    """Distance of every point to the nearest segment of ``line``."""
+    a, b = line[:-1], line[1:]
+    ab = b - a
+    length = np.maximum((ab ** 2).sum(axis=1), 1e-300)
+    ap = points[:, None, :] - a[None, :, :]
+    t = np.clip((ap * ab).sum(axis=2) / length, 0, 1)
+    nearest = a + t[:, :, None] * ab
+    return np.sqrt(((points[:, None, :] - nearest) ** 2).sum(axis=2)).min(axis=1)
+
+
+def test_straight_line_keeps_its_ends():
+    line = np.column_stack([np.arange(10), 2 * np.arange(10)])
+    np.testing.assert_array_equal(np.flatnonzero(douglas_peucker(line, 0.5)), [0, 9])
+
+
+def test_spike_above_tolerance_is_kept():
+    line = np.array([[0, 0], [1, 0], [2, 5], [3, 0], [4, 0]])
+    assert list(douglas_peucker(line, 1.0)) == [True, False, True, False, True]
+    assert douglas_peucker(line, 10.0).sum() == 2
+    assert douglas_peucker(line, 0).all()
+
+
+@pytest.mark.parametrize('tolerance', [0.5, 2.0, 8.0])
+def test_removed_vertices_stay_within_tolerance(tolerance):
+    rng = np.random.RandomState(0)
+    walk = rng.randn(500, 2).cumsum(axis=0)
+    keep = douglas_peucker(walk, tolerance)
+    assert keep[0] and keep[-1]
+    assert (distance_to_polyline(walk[~keep], walk[keep]) <= tolerance + 1e-9).all()
+
+
+def two_areas():
+    """Two squares sharing a finely sampled wavy border along x = 0."""
+    y = np.linspace(0, 0.1, 400)
+    border = np.column_stack([0.0005 * np.sin(200 * y), y])
+    left = np.concatenate([border, [[-0.1, 0.1], [-0.1, 0.0]], border[:1]])
+    right = np.concatenate([border[::-1], [[0.1, 0.0], [0.1, 0.1]], border[-1:]])
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': i, 'properties': {'name': name},
+         'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]}}
+        for i, (name, ring) in enumerate([('left', left), ('right', right)])]}
+
+
+def test_neighbors_share_the_simplified_border():
+    pyramid = LODPyramid(two_areas())
+    for level in range(len(pyramid.levels)):
+        left, right = (feature[0][0] for feature in pyramid.levels[level]['features'])
+        shared = {tuple(p) for p in left} & {tuple(p) for p in right}
+        on_border = lambda ring: {tuple(p) for p in ring if abs(p[0]) < 0.01 * GRID}
+        # every border vertex of either side is a vertex of the other
+        assert on_border(left) == on_border(right) == shared
+    counts = [pyramid.vertex_count(level) for level in range(len(pyramid.levels))]
+    assert counts == sorted(counts)
+    assert counts[0] < counts[-1]
+
+
+def test_full_resolution_level_is_the_quantized_source():
+    source = two_areas()
+    pyramid = LODPyramid(source)
+    ring = pyramid.geojson(len(pyramid.levels) - 1)['features'][0]['geometry']['coordinates'][0][0]
+    np.testing.assert_allclose(ring, np.round(source['features'][0]['geometry']['coordinates'][0],
+                                              6))
+
+
+def test_encode_decode_round_trip():
+    pyramid = LODPyramid(two_areas())
+    for level in range(len(pyramid.levels)):
+        decoded = LODPyramid.decode(pyramid.encode(level))
+        assert decoded['decimals'] == pyramid.levels[level]['decimals']
+        for got, expected in zip(decoded['features'], pyramid.levels[level]['features']):
+            for got_polygon, polygon in zip(got, expected):
+                for got_ring, ring in zip(got_polygon, polygon):
+                    np.testing.assert_array_equal(got_ring, ring)
+
+
+def test_level_for_zoom():
+    pyramid = LODPyramid(two_areas(), zooms=(10, 12, None))
+    assert [pyramid.level_for_zoom(z) for z in (3, 10, 11, 12, 13, 20)] == [0, 0, 1, 1, 2, 2]
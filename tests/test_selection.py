@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pytest
+
+from nyctrees.data import DATA_DIR
+from nyctrees.geometry import _orientation, segments_cross
+from nyctrees.selection import AreaIndex, PolygonSelector, selection_key
+from nyctrees.spatial import feature_rings
+
+NTA_GEOJSON = DATA_DIR / 'NeighborhoodTabulationAreas.geojson'
+
+
+def all_pairs(a, b):
+    """segments_cross by testing every segment of ``a`` against every one of ``b``."""
+    ax0, ay0, ax1, ay1 = (v[:, None] for v in a)
+    bx0, by0, bx1, by1 = b
+    d1 = _orientation(ax0, ay0, ax1, ay1, bx0, by0)
+    d2 = _orientation(ax0, ay0, ax1, ay1, bx1, by1)
+    d3 = _orientation(bx0, by0, bx1, by1, ax0, ay0)
+    d4 = _orientation(bx0, by0, bx1, by1, ax1, ay1)
+    return ((d1 * d2 < 0) & (d3 * d4 < 0)).any(axis=0)
+
+
+@pytest.mark.parametrize('cells', [1, 7, 64])
+def test_segments_cross_matches_all_pairs(cells):
+    rng = np.random.RandomState(cells)
+    a = tuple(rng.uniform(0, 10, 50) for _ in range(4))
+    # short edges, as polygon edges are, plus a few spanning everything
+    x, y = rng.uniform(-2, 12, (2, 2000))
+    dx, dy = rng.normal(0, 0.3, (2, 2000))
+    dx[:5] *= 50
+    b = (x, y, x + dx, y + dy)
+    np.testing.assert_array_equal(segments_cross(a, b, cells), all_pairs(a, b))
+    assert not segments_cross(a, tuple(v[:0] for v in b)).size
+    assert not segments_cross(tuple(v[:0] for v in a), b).any()
+
+
+def lasso(rng, n):
+    """A star shaped (so simple) ring of ``n`` points somewhere over the city."""
+    cx, cy = rng.uniform(-74.1, -73.8), rng.uniform(40.55, 40.85)
+    radius = rng.uniform(0.01, 0.12)
+    t = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    r = radius * (1 + 0.3 * np.sin(rng.randint(2, 7) * t) + 0.1 * rng.rand(n))
+    return np.c_[cx + 1.3 * r * np.cos(t), cy + r * np.sin(t)]
+
+
+def test_modes_match_shapely_on_the_ntas():
+    shapely = pytest.importorskip('shapely')
+    from shapely.geometry import Polygon, shape
+
+    with open(NTA_GEOJSON) as f:
+        features = json.load(f)['features']
+    areas = np.array([shape(feature['geometry']) for feature in features])
+    centroids = np.array([[area.centroid.x, area.centroid.y] for area in areas])
+    selector = PolygonSelector(AreaIndex(range(len(features))),
+                               [feature_rings(feature['geometry']) for feature in features],
+                               centroids)
+    rng = np.random.RandomState(0)
+    for n in (4, 20, 200):
+        for _ in range(4):
+            ring = lasso(rng, n)
+            outline = Polygon(ring)
+            selected = {'lassoPoints': {'mapbox': ring.tolist()}, 'points': []}
+            expected = {
+                'intersects': shapely.intersects(areas, outline),
+                'contains': shapely.contains(outline, areas),
+                'centroid': shapely.contains_xy(outline, centroids[:, 0], centroids[:, 1]),
+            }
+            for mode, want in expected.items():
+                np.testing.assert_array_equal(selector.mask(selected, mode), want,
+                                              err_msg='{} points, {}'.format(n, mode))
+
+
+def test_selection_key():
+    lasso = {'lassoPoints': {'mapbox': [[-73.91234567, 40.7], [-73.9, 40.8], [-73.8, 40.7]]},
+             'points': [{'customdata': 3}]}
+    assert selection_key(lasso) == [-73.912346, 40.7, -73.9, 40.8, -73.8, 40.7]
+    box = {'range': {'mapbox': [[-74, 40.8], [-73.9, 40.7]]}}
+    assert selection_key(box) == [-74, 40.8, -73.9, 40.8, -73.9, 40.7, -74, 40.7]
+    click = {'points': [{'customdata': 7}, {'customdata': 2}, {'text': 'no id'}]}
+    assert selection_key(click) == [2, 7]
+    assert selection_key(None) == 'all'
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from nyctrees.similarity import SimilarityIndex, standardize
+
+
+def brute_force(values, weights, row, k):
+    z, _, _ = standardize(values)
+    distances = np.sqrt((((z - z[row]) ** 2) * weights).sum(axis=1))
+    distances[row] = np.inf
+    order = np.argsort(distances, kind='stable')[:k]
+    return order, distances[order]
+
+
+def test_standardize_ignores_missing_and_constant_columns():
+    values = np.array([[1.0, 5.0, np.nan], [3.0, 5.0, 2.0], [5.0, 5.0, 4.0]])
+    z, mean, std = standardize(values)
+    np.testing.assert_allclose(mean, [3, 5, 3])
+    np.testing.assert_allclose(z[:, 0], [-1.224744871, 0, 1.224744871])
+    assert (z[:, 1] == 0).all()
+    assert z[0, 2] == 0
+
+
+@pytest.mark.parametrize('weights', [None, [1.0, 2.0, 0.0, 0.5]])
+def test_top_k_table_matches_brute_force(weights):
+    rng = np.random.RandomState(0)
+    values = rng.lognormal(size=(200, 4)) * [1, 100, 1000, 5]
+    index = SimilarityIndex(values, weights, k=5)
+    w = np.ones(4) if weights is None else np.asarray(weights)
+    for row in range(len(values)):
+        rows, distances = brute_force(values, w, row, 5)
+        np.testing.assert_allclose(index.distances[row], distances)
+        np.testing.assert_array_equal(index.neighbors[row], rows)
+        assert row not in index.neighbors[row]
+
+
+def test_query_beyond_the_table_uses_the_tree():
+    rng = np.random.RandomState(1)
+    values = rng.randn(50, 3)
+    index = SimilarityIndex(values, k=3)
+    rows, distances = index.query(7)
+    np.testing.assert_array_equal(rows, index.neighbors[7])
+    rows, distances = index.query(7, 10)
+    expected_rows, expected = brute_force(values, np.ones(3), 7, 10)
+    np.testing.assert_allclose(distances, expected)
+    np.testing.assert_array_equal(rows, expected_rows)
+
+
+def test_duplicate_areas_do_not_list_themselves():
+    values = np.array([[1.0, 1.0], [1.0, 1.0], [5.0, 2.0], [9.0, 0.0]])
+    index = SimilarityIndex(values, k=2)
+    assert index.neighbors[0, 0] == 1 and index.neighbors[1, 0] == 0
+    assert index.distances[0, 0] == 0
+    for row in range(4):
+        assert row not in index.neighbors[row]
+
+
+def test_search_and_table():
+    values = np.array([[0.0, 0.0], [1.0, 1.0], [10.0, 10.0]])
+    index = SimilarityIndex(values, k=5)
+    assert index.k == 2
+    rows, _ = index.search([0.9, 0.9], k=2)
+    np.testing.assert_array_equal(rows, [1, 0])
+    table = index.table(['a', 'b', 'c'])
+    assert list(table.columns) == ['area', 'rank', 'similar', 'distance']
+    assert table[table['area'] == 'a']['similar'].tolist() == ['b', 'c']
+    assert len(index.table(['a', 'b', 'c'], k=1)) == 3
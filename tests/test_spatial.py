@@ -0,0 +1,110 @@
+import json
+
+import numpy as np
+import pytest
+
+from nyctrees.data import DATA_DIR
+from nyctrees.geometry import points_in_polygon, ring_edges
+from nyctrees.spatial import SpatialJoin, feature_rings
+
+NTA_GEOJSON = DATA_DIR / 'NeighborhoodTabulationAreas.geojson'
+
+
+def square(x0, y0, x1, y1):
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]], dtype=np.float64)
+
+
+# 0: a square with a hole, 1: an island in the hole, 2: a MultiPolygon of two
+# squares, 3: a square sharing an edge with 0 and a corner with part of 2
+POLYGONS = [
+    [square(0, 0, 4, 4), square(1, 1, 3, 3)[::-1]],
+    [square(1.5, 1.5, 2.5, 2.5)],
+    [square(5, 0, 6, 1), square(5, 3, 6, 4)],
+    [square(4, 0, 5, 3)],
+]
+
+
+def reference(polygons, x, y):
+    """Lowest index of the polygon containing every point, by brute force."""
+    result = np.full(len(x), -1, dtype=np.int64)
+    for i in reversed(range(len(polygons))):
+        result[points_in_polygon(x, y, *ring_edges(polygons[i]))] = i
+    return result
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (4, 4), (64, 64)])
+def test_random_points_match_reference(shape):
+    join = SpatialJoin(POLYGONS, shape=shape)
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(-1, 7, 20000), rng.uniform(-1, 5, 20000)
+    np.testing.assert_array_equal(join.locate(x, y), reference(POLYGONS, x, y))
+
+
+def test_holes_and_multipolygons():
+    join = SpatialJoin(POLYGONS, names=['ring', 'island', 'multi', 'edge'], shape=(16, 16))
+    x = np.array([0.5, 1.2, 2.0, 5.5, 5.5, 5.5, 4.5, 10.0])
+    y = np.array([0.5, 1.2, 2.0, 0.5, 3.5, 2.0, 1.0, 10.0])
+    located = join.locate(x, y)
+    np.testing.assert_array_equal(located, [0, -1, 1, 2, 2, -1, 3, -1])
+    assert list(join.names_of(located)) == ['ring', None, 'island', 'multi', 'multi', None,
+                                            'edge', None]
+
+
+def test_points_on_shared_boundaries_belong_to_one_polygon():
+    join = SpatialJoin(POLYGONS, shape=(16, 16))
+    # on the edge shared by 0 and 3, on the corner of 3 and 2, and on grid lines
+    x = np.array([4.0, 4.0, 4.0, 5.0, 2.0, 0.25])
+    y = np.array([0.5, 2.0, 2.75, 1.0, 0.25, 2.0])
+    located = join.locate(x, y)
+    np.testing.assert_array_equal(located, reference(POLYGONS, x, y))
+    assert (located[:3] >= 0).all()
+
+
+def test_parallel_matches_serial():
+    join = SpatialJoin(POLYGONS, shape=(8, 8))
+    rng = np.random.RandomState(1)
+    x, y = rng.uniform(-1, 7, 5000), rng.uniform(-1, 5, 5000)
+    np.testing.assert_array_equal(join.locate_parallel(x, y, workers=2, chunk=1000),
+                                  join.locate(x, y))
+
+
+def test_ntas_match_shapely():
+    shapely = pytest.importorskip('shapely')
+    from shapely.geometry import shape
+
+    with open(str(NTA_GEOJSON)) as f:
+        features = json.load(f)['features']
+    join = SpatialJoin.from_geojson(NTA_GEOJSON, 'ntaname')
+    xmin, ymin, xmax, ymax = np.array(
+        [shape(feature['geometry']).bounds for feature in features]).T
+    rng = np.random.RandomState(2)
+    x = rng.uniform(xmin.min(), xmax.max(), 20000)
+    y = rng.uniform(ymin.min(), ymax.max(), 20000)
+    # and every NTA's vertices, which lie on borders shared with other NTAs
+    vertices = np.concatenate([ring[:-1] for feature in features[:3]
+                               for ring in feature_rings(feature['geometry'])])
+    x, y = np.r_[x, vertices[:, 0]], np.r_[y, vertices[:, 1]]
+    located = join.locate(x, y)
+
+    tree = shapely.STRtree([shape(feature['geometry']) for feature in features])
+    point, polygon = tree.query(shapely.points(x, y), predicate='within')
+    inside = np.full(len(x), -1, dtype=np.int64)
+    inside[point] = polygon
+    strict = np.zeros(len(x), dtype=bool)
+    strict[point] = True
+    # points strictly inside an NTA match shapely exactly; the others (on
+    # a border, which shapely puts in none) agree with the brute force join
+    covered = tree.query(shapely.points(x, y), predicate='intersects')[0]
+    on_border = np.zeros(len(x), dtype=bool)
+    on_border[covered] = True
+    on_border &= ~strict
+    assert (located[strict] == inside[strict]).all()
+    polygons = [feature_rings(feature['geometry']) for feature in features]
+    border = np.flatnonzero(on_border)
+    np.testing.assert_array_equal(located[border], reference(polygons, x[border], y[border]))
+
+
+def test_no_points_near_edges():
+    join = SpatialJoin(POLYGONS, shape=(64, 64))
+    np.testing.assert_array_equal(join.locate([0.1, 10.0], [3.9, 10.0]), [0, -1])
+    assert len(join.locate([], [])) == 0
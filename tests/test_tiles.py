@@ -0,0 +1,180 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyctrees.choropleth import ChoroplethEngine
+from nyctrees.tiles import (EXTENT, TileLayer, _varint, _zigzag, clip_ring, encode_layer,
+                            encode_polygon, lonlat_to_world)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def fields(data):
+    """(field number, value) of a protobuf message: ints and bytes."""
+    out, pos = [], 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = np.frombuffer(data[pos:pos + 8], dtype=np.float64)[0], pos + 8
+        else:
+            assert wire_type == 2
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        out.append((number, value))
+    return out
+
+
+def packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def decode_layers(tile):
+    """{layer name: (extent, version, [(id, attributes, commands)])}."""
+    layers = {}
+    for number, layer in fields(tile):
+        assert number == 3
+        items = fields(layer)
+        keys = [v.decode() for n, v in items if n == 3]
+        values = []
+        for n, v in items:
+            if n == 4:
+                (kind, value), = fields(v)
+                values.append(value.decode() if kind == 1 else value)
+        features = []
+        for n, v in items:
+            if n == 2:
+                feature = dict(fields(v))
+                assert feature[3] == 3
+                tags = packed(feature[2])
+                attributes = {keys[k]: values[i] for k, i in zip(tags[::2], tags[1::2])}
+                features.append((feature[1], attributes, packed(feature[4])))
+        name = dict(items)[1].decode()
+        layers[name] = (dict(items)[5], dict(items)[15], features)
+    return layers
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def test_varint_and_zigzag():
+    assert _varint(1) == b'\x01'
+    assert _varint(300) == b'\xac\x02'
+    np.testing.assert_array_equal(_zigzag(np.array([0, -1, 1, -2, 2])), [0, 1, 2, 3, 4])
+
+
+def test_polygon_commands():
+    ring = np.array([[2, 2], [6, 2], [6, 6], [2, 6]])
+    commands = encode_polygon([ring])
+    # MoveTo(1) 2,2; LineTo(3) +4,0 0,+4 -4,0; ClosePath
+    assert commands == [9, 4, 4, 26, 8, 0, 0, 8, 7, 0, 15]
+    # the second ring starts relative to the last vertex of the first: +1, -3
+    hole = np.array([[3, 3], [3, 5], [5, 5]])
+    assert encode_polygon([ring, hole])[11:14] == [9, 2, 5]
+
+
+def test_layer_round_trip():
+    square = np.array([[0, 0], [10, 0], [10, 10], [0, 10]])
+    tile = encode_layer('class1', [(4, {'name': 'a', 'value': 1.5}, [[square]]),
+                                   (7, {'name': 'b', 'value': 1.5}, [[square + 20]])])
+    extent, version, features = decode_layers(tile)['class1']
+    assert (extent, version) == (EXTENT, 2)
+    assert [(fid, attributes) for fid, attributes, _ in features] == [
+        (4, {'name': 'a', 'value': 1.5}), (7, {'name': 'b', 'value': 1.5})]
+    commands = features[1][2]
+    assert [unzigzag(v) for v in commands[1:3]] == [20, 20]
+
+
+def test_clip_ring_to_box():
+    ring = np.array([[-1.0, -1.0], [1.0, -1.0], [1.0, 1.0], [-1.0, 1.0]])
+    clipped = clip_ring(ring, 0, 0, 2, 2)
+    assert sorted(map(tuple, clipped)) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert len(clip_ring(ring, 5, 5, 6, 6)) == 0
+
+
+def test_lonlat_to_world():
+    np.testing.assert_allclose(lonlat_to_world(np.array([[0.0, 0.0], [180.0, 0.0]])),
+                               [[0.5, 0.5], [1.0, 0.5]])
+
+
+@pytest.fixture
+def layer(tmp_path):
+    def square(x0, y0, x1, y1):
+        return [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'name': name},
+         'geometry': {'type': 'Polygon', 'coordinates': square(*box)}}
+        for name, box in [('West', (-10, -10, 0, 10)), ('East', (0, -10, 10, 10))]]}
+    path = tmp_path / 'areas.geojson'
+    path.write_text(json.dumps(collection))
+    engine = ChoroplethEngine(path, 'name', cache_dir=tmp_path)
+    df = pd.DataFrame({'area': ['west', 'east', 'unknown'], 'metric': [5.0, 50.0, 1.0],
+                       'centerLong': [0.0, 0.0, 0.0]})
+    return TileLayer(engine, df, 'area', 'metric', breaks=[10])
+
+
+def test_tile_layer_classes_and_attributes(layer):
+    layers = decode_layers(layer.render(0, 0, 0))
+    assert sorted(layers) == ['class0', 'class1']
+    (fid, attributes, commands), = layers['class0'][2]
+    assert attributes == {'name': 'west', 'metric': 5.0}
+    # one ring: MoveTo, LineTo(3), ClosePath; the square spans a 1/36 of the tile
+    assert commands[0] == 9 and commands[3] == 26 and commands[-1] == 15
+    x0, y0 = unzigzag(commands[1]), unzigzag(commands[2])
+    assert abs(x0 - EXTENT * (0.5 - 10 / 360)) <= 1
+    assert layers['class1'][2][0][1]['name'] == 'east'
+
+
+def test_tile_outside_the_areas_is_empty(layer):
+    assert layer.render(4, 0, 0) == b''
+
+
+def test_tile_decodes_with_mapbox_vector_tile(layer):
+    mapbox_vector_tile = pytest.importorskip('mapbox_vector_tile')
+    decoded = mapbox_vector_tile.decode(layer.render(2, 1, 1))
+    assert decoded['class1']['features'][0]['properties']['name'] == 'east'
+    assert decoded['class1']['features'][0]['geometry']['type'] == 'Polygon'
+
+
+def test_tile_route_honors_accept_encoding(layer):
+    import gzip
+
+    from flask import Flask
+
+    from nyctrees.tiles import TileServer, register_tile_route
+
+    server = Flask(__name__)
+    tiles = TileServer(seed_dir=None)
+    tiles.add('areas', layer)
+    register_tile_route(server, tiles)
+    client = server.test_client()
+    raw = layer.render(0, 0, 0)
+
+    response = client.get('/tiles/areas/0/0/0.pbf', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == raw
+    for accept in ('identity', 'gzip;q=0'):
+        response = client.get('/tiles/areas/0/0/0.pbf', headers={'Accept-Encoding': accept})
+        assert 'Content-Encoding' not in response.headers
+        assert response.data == raw
+    assert client.get('/tiles/areas/0/0/0.pbf').data == raw
+    assert client.get('/tiles/other/0/0/0.pbf').status_code == 404